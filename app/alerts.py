@@ -0,0 +1,159 @@
+"""Alert state per (series, rule), built from fault events.
+
+Fault events are instantaneous detections; an alert is the state operators
+care about. Transitions are what gets pushed:
+
+    pending  -> firing    ``min_count`` events within ``debounce_ms`` (at once
+                          for severities in ``immediate``)
+    firing   -> firing    repeated events only bump count/last_ts, nothing sent
+    firing   -> resolved  no event for ``clear_after_ms`` (hysteresis); rules
+                          with a resolving event (sensor_silent is resolved by
+                          sensor_resumed) only on that event, since the
+                          condition is reported once and lasts until then
+
+A flapping sensor therefore produces one ``firing`` and, once it has been
+quiet long enough, one ``resolved``, not a message per detection.
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.faults import FaultEvent
+
+log = logging.getLogger(__name__)
+
+
+class AlertConfig(BaseModel):
+    debounce_ms: int = 10_000
+    min_count: int = 2
+    clear_after_ms: int = 30_000
+    immediate: Tuple[str, ...] = ("critical",)
+
+
+# event rule -> rule of the alert it resolves
+RESOLVES = {"sensor_resumed": "sensor_silent"}
+RESOLVED_BY_EVENT = frozenset(RESOLVES.values())  # not cleared after clear_after_ms
+
+AlertKey = Tuple[str, str]  # (series, rule)
+
+
+def now_ms() -> int:
+    return int(time.monotonic() * 1000)
+
+
+class Alert:
+    __slots__ = ("series", "rule", "severity", "device_id", "sensor_id", "metric",
+                 "first_ts", "last_ts", "count", "message", "state", "seen_at", "pending_since")
+
+    def __init__(self, event: FaultEvent, at: int):
+        self.series = event.series
+        self.rule = event.rule
+        self.device_id = event.device_id
+        self.sensor_id = event.sensor_id
+        self.metric = event.metric
+        self.severity = event.severity
+        self.first_ts = event.start_ts
+        self.last_ts = event.start_ts
+        self.count = 0
+        self.message = event.message
+        self.state = "pending"
+        self.seen_at = at
+        self.pending_since = at
+
+    def to_dict(self) -> dict:
+        return {
+            "type": "alert", "state": self.state, "series": self.series, "rule": self.rule,
+            "severity": self.severity, "device_id": self.device_id, "sensor_id": self.sensor_id,
+            "metric": self.metric, "first_ts": self.first_ts, "last_ts": self.last_ts,
+            "count": self.count, "message": self.message,
+        }
+
+
+class AlertManager:
+    def __init__(self, on_transition: Callable[[AlertKey, dict], None],
+                 config: Optional[AlertConfig] = None, tick_interval: float = 1.0):
+        self.on_transition = on_transition
+        self.config = config or AlertConfig()
+        self.tick_interval = tick_interval
+        self._alerts: Dict[AlertKey, Alert] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.suppressed = 0
+
+    def observe(self, event: FaultEvent):
+        """FaultStore listener."""
+        at = now_ms()
+        resolves = RESOLVES.get(event.rule)
+        if resolves is not None:
+            alert = self._alerts.pop((event.series, resolves), None)
+            if alert is not None and alert.state == "firing":
+                alert.state = "resolved"
+                alert.last_ts = event.end_ts or event.start_ts
+                self._emit(alert)
+            return
+
+        key = (event.series, event.rule)
+        alert = self._alerts.get(key)
+        if alert is None or (alert.state == "pending"
+                             and at - alert.pending_since > self.config.debounce_ms):
+            alert = self._alerts[key] = Alert(event, at)
+        alert.count += 1
+        alert.seen_at = at
+        alert.last_ts = max(alert.last_ts, event.end_ts or event.start_ts)
+        alert.message = event.message
+        if event.severity == "critical":
+            alert.severity = "critical"
+
+        if alert.state == "firing":
+            self.suppressed += 1  # duplicate of an active alert
+        elif alert.count >= self.config.min_count or alert.severity in self.config.immediate:
+            alert.state = "firing"
+            self._emit(alert)
+
+    def tick(self, at: Optional[int] = None):
+        """Resolve quiet alerts (except those awaiting a resolving event) and
+        forget pending ones that never fired."""
+        at = now_ms() if at is None else at
+        cfg = self.config
+        for key, alert in list(self._alerts.items()):
+            if (alert.state == "firing" and at - alert.seen_at >= cfg.clear_after_ms
+                    and alert.rule not in RESOLVED_BY_EVENT):
+                del self._alerts[key]
+                alert.state = "resolved"
+                self._emit(alert)
+            elif alert.state == "pending" and at - alert.pending_since > cfg.debounce_ms:
+                del self._alerts[key]
+
+    def _emit(self, alert: Alert):
+        try:
+            self.on_transition((alert.series, alert.rule), alert.to_dict())
+        except Exception as e:
+            log.error(f"Alert transition handler failed: {e}")
+
+    def active(self) -> List[dict]:
+        return [alert.to_dict() for alert in self._alerts.values() if alert.state == "firing"]
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            self.tick()
+
+    def stats(self) -> dict:
+        return {
+            "firing": sum(1 for a in self._alerts.values() if a.state == "firing"),
+            "pending": sum(1 for a in self._alerts.values() if a.state == "pending"),
+            "suppressed": self.suppressed,
+        }
@@ -0,0 +1,305 @@
+"""Compressed columnar archive for history beyond the Redis retention.
+
+Every ingested sample passes through ``Archive.add`` (from the archive stream
+consumer, see app/streams.py, or inline on ingest). Each series buffers them
+in memory until the buffer spans ``block_ms``, then seals it as one compressed
+block. Blocks are appended to a segment per series and UTC day::
+
+    <dir>/<series>/<day start ms>.seg   blocks, back to back
+    <dir>/<series>/<day start ms>.idx   one 32-byte entry per block:
+                                        t_min, t_max, count, offset, length
+
+A block stores two columns:
+
+* timestamps as delta-of-delta, zigzag-encoded (regular sampling gives zeros)
+* values XOR-ed with the previous value's bits (slow signals give mostly zero
+  high bytes)
+
+Each column is split into byte planes (all first bytes, then all second bytes,
+...) and deflated, so the long zero runs cost almost nothing. Encoding and
+decoding are whole-array NumPy operations.
+
+A range read loads the small index, picks the blocks that overlap, and decodes
+only those, from a memory map of the segment. ``block_ms`` must stay below the
+Redis retention: until a block is sealed its points are still served from
+Redis, and after a crash the unsealed tail is re-read from there
+(``backfill``).
+"""
+import asyncio
+import logging
+import mmap
+import os
+import shutil
+import struct
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+_INDEX = struct.Struct("<qqIQI")  # t_min, t_max, count, offset, length
+_BLOCK = struct.Struct("<II")     # count, compressed timestamp bytes
+DAY_MS = 86_400_000
+
+
+# ----- Block encoding -----
+
+def _shuffle(words: np.ndarray) -> bytes:
+    """uint64 words -> byte planes, deflated."""
+    planes = words.astype("<u8").view(np.uint8).reshape(-1, 8).T
+    # raw deflate: no zlib header/checksum, which matters for small blocks
+    c = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return c.compress(np.ascontiguousarray(planes).tobytes()) + c.flush()
+
+
+def _unshuffle(data: bytes, n: int) -> np.ndarray:
+    planes = np.frombuffer(zlib.decompress(data, -15), np.uint8).reshape(8, n)
+    return np.ascontiguousarray(planes.T).view("<u8").ravel()
+
+
+def encode_block(ts: np.ndarray, values: np.ndarray) -> bytes:
+    ts = np.asarray(ts, dtype=np.int64)
+    d1 = np.diff(ts, prepend=np.int64(0))
+    d2 = np.diff(d1, prepend=np.int64(0))
+    zigzag = ((d2 << 1) ^ (d2 >> 63)).view(np.uint64)
+
+    bits = np.asarray(values, dtype=np.float64).view(np.uint64)
+    xored = bits.copy()
+    xored[1:] ^= bits[:-1]
+
+    ts_z = _shuffle(zigzag)
+    return _BLOCK.pack(len(ts), len(ts_z)) + ts_z + _shuffle(xored)
+
+
+def decode_block(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    n, ts_len = _BLOCK.unpack_from(data)
+    body = data[_BLOCK.size:]
+    zigzag = _unshuffle(body[:ts_len], n)
+    d2 = (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64)
+    ts = np.cumsum(np.cumsum(d2))
+    bits = np.bitwise_xor.accumulate(_unshuffle(body[ts_len:], n))
+    return ts, bits.view(np.float64)
+
+
+# ----- Archive -----
+
+def series_dir_name(key: str) -> str:
+    return key.replace(":", "_")
+
+
+class _Buffer:
+    __slots__ = ("ts", "values", "last_ts")
+
+    def __init__(self, last_ts: int):
+        self.ts: List[int] = []
+        self.values: List[float] = []
+        self.last_ts = last_ts
+
+
+class Archive:
+    def __init__(self, directory: str, block_ms: int = 300_000, max_block_samples: int = 100_000,
+                 retention_ms: int = 365 * DAY_MS):
+        self.directory = directory
+        self.block_ms = block_ms
+        self.max_block_samples = max_block_samples
+        self.retention_ms = retention_ms
+        self._buffers: Dict[str, _Buffer] = {}
+        self._archived_until: Dict[str, int] = {}
+        self._queue: asyncio.Queue[Tuple[str, np.ndarray, np.ndarray]] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = 0.0
+        self.blocks = 0
+        self.samples = 0
+        self.bytes = 0
+
+    def _series_dir(self, key: str) -> str:
+        return os.path.join(self.directory, series_dir_name(key))
+
+    def _segments(self, key: str) -> List[int]:
+        try:
+            names = os.listdir(self._series_dir(key))
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-4]) for name in names if name.endswith(".idx"))
+
+    def _index(self, key: str, day: int) -> np.ndarray:
+        path = os.path.join(self._series_dir(key), f"{day}.idx")
+        with open(path, "rb") as f:
+            data = f.read()
+        n = len(data) // _INDEX.size  # ignore a torn last entry
+        dtype = np.dtype([("t_min", "<i8"), ("t_max", "<i8"), ("count", "<u4"),
+                          ("offset", "<u8"), ("length", "<u4")])
+        return np.frombuffer(data[:n * _INDEX.size], dtype)
+
+    def archived_until(self, key: str) -> int:
+        """Newest timestamp in a sealed block of ``key`` (-1 if none)."""
+        until = self._archived_until.get(key)
+        if until is None:
+            until = -1
+            for day in reversed(self._segments(key)):
+                index = self._index(key, day)
+                if len(index):
+                    until = int(index["t_max"][-1])
+                    break
+            self._archived_until[key] = until
+        return until
+
+    # ----- Writing -----
+
+    def add(self, key: str, ts: int, value: float):
+        """Buffer a sample; seals a block once the buffer spans ``block_ms``."""
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = _Buffer(self.archived_until(key))
+        if ts <= buf.last_ts:
+            return  # already archived (e.g. replayed after a restart)
+        if buf.ts and (ts // DAY_MS != buf.ts[0] // DAY_MS
+                       or ts - buf.ts[0] >= self.block_ms
+                       or len(buf.ts) >= self.max_block_samples):
+            self._seal(key, buf)
+        buf.ts.append(ts)
+        buf.values.append(value)
+        buf.last_ts = ts
+
+    def _seal(self, key: str, buf: _Buffer):
+        ts = np.array(buf.ts, dtype=np.int64)
+        values = np.array(buf.values, dtype=np.float64)
+        buf.ts, buf.values = [], []
+        self._queue.put_nowait((key, ts, values))
+
+    def _write_block(self, key: str, ts: np.ndarray, values: np.ndarray):
+        day = int(ts[0]) - int(ts[0]) % DAY_MS
+        directory = self._series_dir(key)
+        os.makedirs(directory, exist_ok=True)
+        block = encode_block(ts, values)
+        seg_path = os.path.join(directory, f"{day}.seg")
+        with open(seg_path, "ab") as f:
+            offset = f.tell()
+            f.write(block)
+            f.flush()
+            os.fdatasync(f.fileno())
+        # the index entry goes last, so readers never see a half-written block
+        with open(os.path.join(directory, f"{day}.idx"), "ab") as f:
+            f.write(_INDEX.pack(int(ts[0]), int(ts[-1]), len(ts), offset, len(block)))
+            f.flush()
+            os.fdatasync(f.fileno())
+        self._archived_until[key] = int(ts[-1])
+        self.blocks += 1
+        self.samples += len(ts)
+        self.bytes += len(block) + _INDEX.size
+
+    def _seal_idle(self):
+        """Seal buffers of series that went quiet, before Redis expires their points."""
+        now = int(time.time() * 1000)
+        for key, buf in self._buffers.items():
+            if buf.ts and now - buf.ts[0] >= self.block_ms:
+                self._seal(key, buf)
+
+    async def _writer(self):
+        while True:
+            try:
+                key, ts, values = await asyncio.wait_for(self._queue.get(), self.block_ms / 5000)
+            except asyncio.TimeoutError:
+                self._seal_idle()
+                continue
+            try:
+                await asyncio.to_thread(self._write_block, key, ts, values)
+            except OSError as e:
+                log.error(f"Archiving {len(ts)} samples of {key} failed: {e}")
+            finally:
+                self._queue.task_done()
+            if time.monotonic() - self._last_prune > 3600:
+                self._last_prune = time.monotonic()
+                await asyncio.to_thread(self.prune)
+
+    def prune(self):
+        """Delete day segments older than the retention."""
+        cutoff = int(time.time() * 1000) - self.retention_ms
+        try:
+            series = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in series:
+            directory = os.path.join(self.directory, name)
+            for file in os.listdir(directory):
+                stem, _, ext = file.partition(".")
+                if ext in ("seg", "idx") and int(stem) + DAY_MS <= cutoff:
+                    os.remove(os.path.join(directory, file))
+            if not os.listdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        """Seal everything buffered and wait for the writer to store it."""
+        for key, buf in self._buffers.items():
+            if buf.ts:
+                self._seal(key, buf)
+        if self._task:
+            await self._queue.join()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def archived_series(self) -> List[str]:
+        """Series keys with archived data (assumes keys of the form sensor:S:device:D:metric)."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [name.replace("_", ":", 4) for name in names]
+
+    async def backfill(self, r):
+        """After a restart, buffer what Redis still holds past each series' last block."""
+        keys = self.archived_series()
+        if not keys:
+            return
+        pipe = r.pipeline(transaction=False)
+        for key in keys:
+            pipe.execute_command("TS.RANGE", key, self.archived_until(key) + 1, "+")
+        for key, samples in zip(keys, await pipe.execute(raise_on_error=False)):
+            if isinstance(samples, Exception):
+                log.warning(f"Archive backfill of {key} failed: {samples}")
+                continue
+            for ts, value in samples:
+                self.add(key, int(ts), float(value))
+
+    # ----- Reading -----
+
+    def read(self, key: str, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Archived points of ``key`` with ``start <= ts <= end``."""
+        ts_parts, value_parts = [], []
+        first_day = start - start % DAY_MS
+        for day in self._segments(key):
+            if day < first_day or day > end:
+                continue
+            index = self._index(key, day)
+            hit = index[(index["t_max"] >= start) & (index["t_min"] <= end)]
+            if not len(hit):
+                continue
+            path = os.path.join(self._series_dir(key), f"{day}.seg")
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for entry in hit:
+                    offset, length = int(entry["offset"]), int(entry["length"])
+                    ts, values = decode_block(m[offset:offset + length])
+                    keep = (ts >= start) & (ts <= end)
+                    ts_parts.append(ts[keep])
+                    value_parts.append(values[keep])
+        if not ts_parts:
+            return np.empty(0, np.int64), np.empty(0, np.float64)
+        return np.concatenate(ts_parts), np.concatenate(value_parts)
+
+    def stats(self) -> dict:
+        return {
+            "blocks": self.blocks,
+            "samples": self.samples,
+            "bytes_per_sample": self.bytes / self.samples if self.samples else None,
+            "queued": self._queue.qsize(),
+            "buffered": sum(len(buf.ts) for buf in self._buffers.values()),
+        }
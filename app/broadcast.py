@@ -0,0 +1,336 @@
+"""Fan-out of server-pushed frames to WebSocket subscribers.
+
+``publish`` never awaits a client. Each subscriber has a small outbox keyed by
+topic (a series, an alert) holding only the newest frame per topic, and its
+own sender task that drains the outbox. A slow or stalled client delays only
+itself, and what it falls behind on is conflated instead of queued without
+bound. When the outbox is full the oldest topic is dropped and counted.
+
+An optional token bucket limits how many frames per second each subscriber
+gets. Frames over the limit stay in the outbox, where newer frames for the
+same topic replace them.
+
+Subscribers can instead ask for value updates at a fixed frame rate
+(``serve(..., fps=10, mode="minmax")``). Raw samples come in through
+``publish_values``; between two frames they are conflated per topic, to the
+latest sample (``latest``) or to the minimum, maximum and latest sample
+(``minmax``, so spikes survive). Subscribers with the same fps, mode and format
+share one ``Feed``: its ticker encodes a single frame per tick, holding every
+topic that changed, and puts it in each member's outbox. Publishing therefore
+costs one merge per feed, not per client. A client that can't keep up with
+its frame rate has its unsent updates merged with the next tick's (a frame
+only holds the topics that changed, so replacing it would lose topics), and
+that frame is encoded for it alone when it is sent.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
+
+import numpy as np
+from fastapi import WebSocket, WebSocketDisconnect
+
+from app import codec
+
+log = logging.getLogger(__name__)
+
+Frame = Union[str, bytes]
+Point = Tuple[int, float]
+MODES = ("latest", "minmax")
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token; returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Subscriber:
+    __slots__ = ("ws", "format", "outbox", "wakeup", "bucket", "feed", "feed_updates",
+                 "sent", "dropped")
+
+    def __init__(self, ws: WebSocket, format: str, bucket: Optional[TokenBucket],
+                 feed: Optional["Feed"] = None):
+        self.ws = ws
+        self.format = format
+        # topic -> (frame, monotonic time it was queued)
+        self.outbox: "OrderedDict[Hashable, Tuple[Frame, float]]" = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.bucket = bucket
+        self.feed = feed
+        # updates of the feed frame in the outbox (topic None), while it is unsent
+        self.feed_updates: Optional[Dict[str, List[Point]]] = None
+        self.sent = 0
+        self.dropped = 0
+
+
+def encode_points(format: str, updates: Dict[str, List[Point]]) -> Frame:
+    """Frame of conflated points per series, in a codec format (JSON as text)."""
+    series = [codec.Series(key, np.array([ts for ts, _ in points], np.int64),
+                           np.array([value for _, value in points], np.float64))
+              for key, points in updates.items()]
+    start = min(int(s.ts[0]) for s in series)
+    end = max(int(s.ts[-1]) for s in series)
+    frame = codec.encode(format, series, start, end)
+    return frame.decode() if format == "json" else frame
+
+
+class Feed:
+    """Conflated values for the subscribers sharing one fps, mode and format."""
+
+    __slots__ = ("fps", "mode", "format", "members", "pending", "task")
+
+    def __init__(self, fps: int, mode: str, format: str):
+        self.fps = fps
+        self.mode = mode
+        self.format = format
+        self.members: Set[Subscriber] = set()
+        # topic -> latest point, or [min point, max point, latest point]
+        self.pending: Dict[str, list] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def merge(self, topic: str, points: List[Point]):
+        if self.mode == "latest":
+            self.pending[topic] = [points[-1]]
+            return
+        state = self.pending.get(topic)
+        if state is None:
+            state = self.pending[topic] = [points[0], points[0], points[0]]
+        lo, hi, _ = state
+        for point in points:
+            if point[1] < lo[1]:
+                lo = point
+            if point[1] > hi[1]:
+                hi = point
+        state[0], state[1], state[2] = lo, hi, points[-1]
+
+    def take(self) -> Dict[str, List[Point]]:
+        pending, self.pending = self.pending, {}
+        if self.mode == "minmax":
+            # extremes and latest in time order, each once
+            return {topic: sorted(set(state)) for topic, state in pending.items()}
+        return pending
+
+    def combine(self, older: Dict[str, List[Point]],
+                newer: Dict[str, List[Point]]) -> Dict[str, List[Point]]:
+        """Updates of two ticks as one (neither argument is modified)."""
+        merged = dict(older)
+        for topic, points in newer.items():
+            prev = merged.get(topic)
+            if prev is None or self.mode == "latest":
+                merged[topic] = points
+            else:
+                both = prev + points
+                lo = min(both, key=lambda point: point[1])
+                hi = max(both, key=lambda point: point[1])
+                merged[topic] = sorted({lo, hi, max(both)})  # max: the latest
+        return merged
+
+
+class Broadcaster:
+    def __init__(self, name: str, rate: Optional[float] = None, burst: float = 10,
+                 max_pending: int = 1000, send_timeout: float = 5.0, max_fps: int = 30,
+                 encode: Callable[[str, Dict[str, List[Point]]], Frame] = encode_points):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_pending = max_pending
+        self.send_timeout = send_timeout
+        self.max_fps = max_fps
+        self.encode = encode
+        self.subscribers: Set[Subscriber] = set()
+        self.feeds: Dict[Tuple[int, str, str], Feed] = {}
+        self.sent = 0
+        self.dropped = 0
+        self.frames = 0
+        self.lag_ms = 0.0  # EWMA of queue-to-sent time
+        self.max_lag_ms = 0.0
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def formats(self) -> Set[str]:
+        return {sub.format for sub in self.subscribers if sub.feed is None}
+
+    def publish(self, topic: Hashable, frames: Dict[str, Frame]):
+        """Queue the newest frame of ``topic`` for every subscriber, encoded per format."""
+        for sub in self.subscribers:
+            if sub.feed is not None:
+                continue
+            frame = frames.get(sub.format)
+            if frame is not None:
+                self._enqueue(sub, topic, frame)
+
+    def publish_values(self, topic: str, points: List[Point]):
+        """Hand new samples of ``topic`` to the fixed-rate feeds (no-op without any)."""
+        if points:
+            for feed in self.feeds.values():
+                feed.merge(topic, points)
+
+    def _enqueue(self, sub: Subscriber, topic: Hashable, frame: Frame,
+                 queued: Optional[float] = None):
+        """Queue ``frame``; ``queued`` keeps an earlier queue time for the send lag."""
+        outbox = sub.outbox
+        if topic in outbox:
+            outbox.move_to_end(topic)
+            sub.dropped += 1  # replaced before it was sent
+            self.dropped += 1
+        elif len(outbox) >= self.max_pending:
+            outbox.popitem(last=False)
+            sub.dropped += 1
+            self.dropped += 1
+        outbox[topic] = (frame, time.monotonic() if queued is None else queued)
+        sub.wakeup.set()
+
+    def _join_feed(self, sub: Subscriber, fps: int, mode: str):
+        key = (fps, mode, sub.format)
+        feed = self.feeds.get(key)
+        if feed is None:
+            feed = self.feeds[key] = Feed(fps, mode, sub.format)
+            feed.task = asyncio.create_task(self._ticker(feed))
+        feed.members.add(sub)
+        sub.feed = feed
+
+    def _leave_feed(self, sub: Subscriber):
+        feed = sub.feed
+        feed.members.discard(sub)
+        if not feed.members:
+            del self.feeds[(feed.fps, feed.mode, feed.format)]
+            feed.task.cancel()
+
+    async def _ticker(self, feed: Feed):
+        interval = 1 / feed.fps
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += interval
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            if not feed.pending:
+                continue
+            updates = feed.take()
+            frame = None
+            for sub in feed.members:
+                if sub.feed_updates is not None and None in sub.outbox:
+                    # the last frame is still unsent: send both ticks' updates in one,
+                    # lagging from when the older one was queued
+                    sub.feed_updates = feed.combine(sub.feed_updates, updates)
+                    self._enqueue(sub, None, None, queued=sub.outbox[None][1])
+                    continue
+                if frame is None:
+                    try:
+                        frame = self.encode(feed.format, updates)
+                    except Exception as e:
+                        log.error(f"{self.name}: encoding a {feed.format} frame failed: {e}")
+                        break
+                    self.frames += 1
+                sub.feed_updates = updates
+                self._enqueue(sub, None, frame)
+
+    async def serve(self, ws: WebSocket, format: str,
+                    initial: Iterable[Tuple[Hashable, Frame]] = (),
+                    fps: Optional[int] = None, mode: str = "latest"):
+        """Run an accepted connection until the client goes away.
+
+        With ``fps`` the client gets conflated value frames from ``publish_values``
+        at that rate (capped at ``max_fps``) instead of ``publish`` frames.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unsupported mode: {mode}")
+        bucket = TokenBucket(self.rate, self.burst) if self.rate else None
+        sub = Subscriber(ws, format, bucket)
+        for topic, frame in initial:
+            self._enqueue(sub, topic, frame)
+        if fps:
+            self._join_feed(sub, max(1, min(int(fps), self.max_fps)), mode)
+        self.subscribers.add(sub)
+        log.info(f"{self.name}: client connected. Total clients: {len(self.subscribers)}")
+        sender = asyncio.create_task(self._sender(sub))
+        receiver = asyncio.create_task(self._receiver(ws))
+        try:
+            await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.subscribers.discard(sub)
+            if sub.feed is not None:
+                self._leave_feed(sub)
+            for task in (sender, receiver):
+                task.cancel()
+            await asyncio.gather(sender, receiver, return_exceptions=True)
+            log.info(f"{self.name}: client disconnected. Total clients: {len(self.subscribers)}")
+
+    async def _receiver(self, ws: WebSocket):
+        # clients don't send anything; this only notices when they disconnect
+        try:
+            while True:
+                message = await ws.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+        except (WebSocketDisconnect, RuntimeError):
+            return
+
+    async def _sender(self, sub: Subscriber):
+        try:
+            while True:
+                await sub.wakeup.wait()
+                sub.wakeup.clear()
+                while sub.outbox:
+                    if sub.bucket is not None:
+                        delay = sub.bucket.take()
+                        if delay:
+                            await asyncio.sleep(delay)
+                            continue
+                    topic, (frame, queued) = sub.outbox.popitem(last=False)
+                    if topic is None and sub.feed is not None:
+                        updates, sub.feed_updates = sub.feed_updates, None
+                        if frame is None:  # merged for this client
+                            try:
+                                frame = self.encode(sub.format, updates)
+                            except Exception as e:
+                                log.error(f"{self.name}: encoding a {sub.format} frame failed: {e}")
+                                continue
+                            self.frames += 1
+                    if isinstance(frame, bytes):
+                        send = sub.ws.send_bytes(frame)
+                    else:
+                        send = sub.ws.send_text(frame)
+                    await asyncio.wait_for(send, self.send_timeout)
+                    sub.sent += 1
+                    self.sent += 1
+                    lag = (time.monotonic() - queued) * 1000
+                    self.lag_ms += 0.01 * (lag - self.lag_ms)
+                    self.max_lag_ms = max(self.max_lag_ms, lag)
+        except asyncio.CancelledError:
+            raise
+        except WebSocketDisconnect:
+            pass
+        except asyncio.TimeoutError:
+            log.warning(f"{self.name}: client stopped reading for {self.send_timeout}s, dropping it")
+        except Exception as e:
+            log.warning(f"{self.name}: send failed: {e!r}")
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.subscribers),
+            "pending": sum(len(sub.outbox) for sub in self.subscribers),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "feeds": {f"{fps}fps/{mode}/{fmt}": len(feed.members)
+                      for (fps, mode, fmt), feed in self.feeds.items()},
+            "feed_frames": self.frames,
+            "send_lag_ms": round(self.lag_ms, 2),
+            "max_send_lag_ms": round(self.max_lag_ms, 2),
+        }
@@ -0,0 +1,225 @@
+"""Read-through cache for /data range queries.
+
+Requests for the same series and window are coalesced: the first caller runs
+the query, everyone arriving while it is in flight awaits the same future, and
+the result is then kept for a short TTL. Windows are aligned to
+``bucket_ms`` so that dashboards reloading at the same moment ask for
+identical ranges. The still-open bucket after an aligned window holds the
+newest samples; callers read it as a window of its own (see ``tail``), so
+nothing fresh is hidden behind the alignment and concurrent readers share
+that query too.
+
+An ingested sample only invalidates cached windows whose range contains its
+timestamp, so normal live samples leave the aligned windows untouched and
+only drop the open bucket. A query still in flight when a sample lands in its
+range answers its waiters but isn't cached, since it may have missed the
+sample.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, int, int]  # (series key, start, end)
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class ReadCache:
+    def __init__(self, max_samples: int = 1_000_000, ttl_ms: int = 2000, bucket_ms: int = 1000):
+        self.max_samples = max_samples
+        self.ttl_ms = ttl_ms
+        self.bucket_ms = bucket_ms
+        # key -> (expires_at_ms, samples); ordered oldest-used first
+        self._entries: "OrderedDict[CacheKey, Tuple[int, list]]" = OrderedDict()
+        self._by_series: Dict[str, Set[CacheKey]] = {}
+        self._inflight: Dict[CacheKey, asyncio.Future] = {}
+        self._inflight_by_series: Dict[str, Set[CacheKey]] = {}
+        self._stale: Set[CacheKey] = set()  # in flight, invalidated meanwhile
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def window(self, span_ms: int, at_ms: int | None = None) -> Tuple[int, int]:
+        """Return a ``(start, end)`` window of ``span_ms`` ending on a bucket boundary."""
+        at_ms = now_ms() if at_ms is None else at_ms
+        end = at_ms - at_ms % self.bucket_ms
+        return end - span_ms, end
+
+    def tail(self, end: int) -> Tuple[int, int]:
+        """The open bucket after a window ending at ``end``, as a ``(start, end)`` window."""
+        return end + 1, end + self.bucket_ms
+
+    # ----- Lookup -----
+
+    def _lookup(self, key: CacheKey):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, samples = entry
+        if expires < now_ms():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return samples
+
+    async def get(self, series: str, start: int, end: int,
+                  fetch: Callable[[], Awaitable[list]]) -> list:
+        """Return samples for one series, fetching at most once per window."""
+        key = (series, start, end)
+        samples = self._lookup(key)
+        if samples is not None:
+            self.hits += 1
+            return samples
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return await asyncio.shield(fut)
+
+        self.misses += 1
+        fut = self._begin(key)
+        try:
+            samples = await fetch()
+        except BaseException as e:
+            self._fail(key, fut, e)
+            raise
+        self._finish(key, fut, samples)
+        return samples
+
+    async def get_many(self, series_keys: Iterable[str], start: int, end: int,
+                       fetch_many: Callable[[List[str]], Awaitable[list]]) -> List[list]:
+        """Like ``get`` for several series; all misses are fetched in one call.
+
+        ``fetch_many`` receives the missing series keys and must return one
+        result per key, in order. A result that is an Exception is not cached.
+        """
+        series_keys = list(series_keys)
+        results: Dict[str, list] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        missing: List[str] = []
+        for series in series_keys:
+            key = (series, start, end)
+            samples = self._lookup(key)
+            if samples is not None:
+                self.hits += 1
+                results[series] = samples
+            elif key in self._inflight:
+                self.coalesced += 1
+                waiting[series] = self._inflight[key]
+            elif series not in missing:
+                self.misses += 1
+                missing.append(series)
+
+        if missing:
+            futs = {series: self._begin((series, start, end)) for series in missing}
+            try:
+                fetched = await fetch_many(missing)
+            except BaseException as e:
+                for series, fut in futs.items():
+                    self._fail((series, start, end), fut, e)
+                raise
+            for series, samples in zip(missing, fetched):
+                key = (series, start, end)
+                if isinstance(samples, Exception):
+                    self._fail(key, futs[series], samples)
+                else:
+                    self._finish(key, futs[series], samples)
+                results[series] = samples
+
+        for series, fut in waiting.items():
+            try:
+                results[series] = await asyncio.shield(fut)
+            except Exception as e:
+                results[series] = e
+        return [results[series] for series in series_keys]
+
+    # ----- In-flight bookkeeping -----
+
+    def _begin(self, key: CacheKey) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        self._inflight_by_series.setdefault(key[0], set()).add(key)
+        return fut
+
+    def _end(self, key: CacheKey) -> bool:
+        """Forget an in-flight query; False if it was invalidated meanwhile."""
+        self._inflight.pop(key, None)
+        keys = self._inflight_by_series.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._inflight_by_series[key[0]]
+        if key in self._stale:
+            self._stale.discard(key)
+            return False
+        return True
+
+    def _finish(self, key: CacheKey, fut: asyncio.Future, samples: list):
+        fresh = self._end(key)
+        if not fut.done():
+            fut.set_result(samples)
+        if fresh:
+            self._store(key, samples)
+
+    def _fail(self, key: CacheKey, fut: asyncio.Future, exc: BaseException):
+        self._end(key)
+        if fut.done():
+            return
+        if isinstance(exc, asyncio.CancelledError):
+            fut.cancel()
+        else:
+            fut.set_exception(exc)
+            fut.exception()  # waiters get it re-raised; don't warn if there are none
+
+    # ----- Storage -----
+
+    def _store(self, key: CacheKey, samples: list):
+        if len(samples) > self.max_samples:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (now_ms() + self.ttl_ms, samples)
+        self._by_series.setdefault(key[0], set()).add(key)
+        self._size += len(samples)
+        while self._size > self.max_samples:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key: CacheKey):
+        _, samples = self._entries.pop(key)
+        self._size -= len(samples)
+        keys = self._by_series.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_series[key[0]]
+
+    def invalidate(self, series: str, ts: int | None = None):
+        """Drop cached windows of ``series`` that contain ``ts`` (all of them if None)."""
+        for key in self._inflight_by_series.get(series, ()):
+            _, start, end = key
+            if ts is None or start <= ts <= end:
+                self._stale.add(key)
+        keys = self._by_series.get(series)
+        if not keys:
+            return
+        for key in list(keys):
+            _, start, end = key
+            if ts is None or start <= ts <= end:
+                self._remove(key)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "samples": self._size,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
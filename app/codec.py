@@ -0,0 +1,235 @@
+"""Response encodings for time-series reads.
+
+Readings come out of Redis as ``[[ts, b"value"], ...]``. Instead of building a
+JSON list per point, the samples are turned into two NumPy columns (int64
+timestamps, float64 values) and written out as raw little-endian buffers.
+
+Formats:
+    json      - the original ``{"start", "end", "key", "data"}`` shape
+    columnar  - packed binary frame, see ``encode_columnar``
+    msgpack   - map per series with the two columns as ``bin`` fields
+    arrow     - Arrow IPC stream (only when ``pyarrow`` is installed)
+"""
+import json
+import struct
+from typing import Iterable, Optional
+
+import msgpack
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional
+    pa = None
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "columnar": "application/x-fd-columnar",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+MAGIC = b"FDC1"
+
+# ts/value columns are stored little-endian regardless of host byte order
+TS_DTYPE = np.dtype("<i8")
+VALUE_DTYPE = np.dtype("<f8")
+
+
+class Series:
+    """One time series as a pair of columns."""
+
+    __slots__ = ("key", "ts", "values")
+
+    def __init__(self, key: str, ts: np.ndarray, values: np.ndarray):
+        self.key = key
+        self.ts = ts
+        self.values = values
+
+    def __len__(self):
+        return len(self.ts)
+
+
+def to_columns(samples) -> tuple[np.ndarray, np.ndarray]:
+    """Convert a TS.RANGE reply to (timestamps, values) arrays.
+
+    The reply is converted in one pass to a fixed-width bytes array and the
+    numeric parsing is done by NumPy, not per element in Python.
+    """
+    if not samples:
+        return np.empty(0, TS_DTYPE), np.empty(0, VALUE_DTYPE)
+    raw = np.array(samples, dtype="S32")
+    return raw[:, 0].astype(TS_DTYPE), raw[:, 1].astype(VALUE_DTYPE)
+
+
+def from_range(key: str, samples) -> Series:
+    ts, values = to_columns(samples)
+    return Series(key, ts, values)
+
+
+def negotiate(accept: Optional[str], fmt: Optional[str] = None) -> str:
+    """Pick a response format from an explicit ``format`` param or the Accept header."""
+    if fmt:
+        if fmt not in MEDIA_TYPES or (fmt == "arrow" and pa is None):
+            raise ValueError(f"Unsupported format: {fmt}")
+        return fmt
+    if accept:
+        for part in accept.split(","):
+            media = part.split(";")[0].strip()
+            for name, media_type in MEDIA_TYPES.items():
+                if media == media_type and (name != "arrow" or pa is not None):
+                    return name
+    return "json"
+
+
+# ----- Encoders -----
+
+def encode_json(series: Series, start: int, end: int) -> bytes:
+    # keep the old shape: timestamps as ints, values as strings
+    data = [[ts, repr(value)] for ts, value in zip(series.ts.tolist(), series.values.tolist())]
+    return json.dumps({"start": start, "end": end, "key": series.key, "data": data}).encode()
+
+
+def encode_columnar(series_list: Iterable[Series]) -> bytes:
+    """Pack series into one binary frame.
+
+    Layout (all little-endian)::
+
+        "FDC1" | u32 series count
+        per series:
+            u16 key length | key (utf-8) | u32 n | zero padding to 8 bytes
+            int64[n] timestamps (ms) | float64[n] values
+
+    The padding keeps both columns 8-byte aligned, so a browser can wrap them
+    directly in ``BigInt64Array`` / ``Float64Array`` views.
+    """
+    series_list = list(series_list)
+    parts = [MAGIC, struct.pack("<I", len(series_list))]
+    offset = 8
+    for s in series_list:
+        key = s.key.encode()
+        header = struct.pack("<H", len(key)) + key + struct.pack("<I", len(s))
+        offset += len(header)
+        pad = -offset % 8
+        offset += pad
+        parts.append(header)
+        parts.append(b"\x00" * pad)
+        ts = np.ascontiguousarray(s.ts, dtype=TS_DTYPE)
+        values = np.ascontiguousarray(s.values, dtype=VALUE_DTYPE)
+        parts.append(ts.data)
+        parts.append(values.data)
+        offset += ts.nbytes + values.nbytes
+    return b"".join(parts)
+
+
+def decode_columnar(buf: bytes) -> list[Series]:
+    """Inverse of ``encode_columnar``; returned arrays are views on ``buf``."""
+    if buf[:4] != MAGIC:
+        raise ValueError("Not a columnar frame")
+    (count,) = struct.unpack_from("<I", buf, 4)
+    offset = 8
+    out = []
+    for _ in range(count):
+        (key_len,) = struct.unpack_from("<H", buf, offset)
+        offset += 2
+        key = bytes(buf[offset:offset + key_len]).decode()
+        offset += key_len
+        (n,) = struct.unpack_from("<I", buf, offset)
+        offset += 4
+        offset += -offset % 8
+        ts = np.frombuffer(buf, TS_DTYPE, n, offset)
+        offset += ts.nbytes
+        values = np.frombuffer(buf, VALUE_DTYPE, n, offset)
+        offset += values.nbytes
+        out.append(Series(key, ts, values))
+    return out
+
+
+def _msgpack_series(s: Series) -> dict:
+    return {
+        "key": s.key,
+        "n": len(s),
+        "ts": np.ascontiguousarray(s.ts, dtype=TS_DTYPE).tobytes(),
+        "values": np.ascontiguousarray(s.values, dtype=VALUE_DTYPE).tobytes(),
+    }
+
+
+def encode_msgpack(series_list: Iterable[Series], start: int, end: int) -> bytes:
+    return msgpack.packb({
+        "start": start,
+        "end": end,
+        "series": [_msgpack_series(s) for s in series_list],
+    })
+
+
+def encode_arrow(series_list: Iterable[Series]) -> bytes:
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed")
+    schema = pa.schema([("key", pa.dictionary(pa.int32(), pa.string())),
+                        ("ts", pa.timestamp("ms")), ("value", pa.float64())])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for s in series_list:
+            keys = pa.DictionaryArray.from_arrays(
+                pa.array(np.zeros(len(s), dtype=np.int32)), pa.array([s.key]))
+            batch = pa.record_batch([keys, pa.array(s.ts, pa.timestamp("ms")),
+                                     pa.array(s.values, pa.float64())], schema=schema)
+            writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def encode(fmt: str, series_list: list[Series], start: int, end: int) -> bytes:
+    """Encode one or many series in ``fmt``.
+
+    JSON keeps the original single-series response shape; for several series
+    it returns ``{"start", "end", "series": [...]}`` with one entry per key.
+    """
+    if fmt == "columnar":
+        return encode_columnar(series_list)
+    if fmt == "msgpack":
+        return encode_msgpack(series_list, start, end)
+    if fmt == "arrow":
+        return encode_arrow(series_list)
+    if len(series_list) == 1:
+        return encode_json(series_list[0], start, end)
+    return json.dumps({
+        "start": start,
+        "end": end,
+        "series": [json.loads(encode_json(s, start, end)) for s in series_list],
+    }).encode()
+
+
+# ----- Decoders (for exported files) -----
+
+def decode_json(buf: bytes) -> list[Series]:
+    doc = json.loads(buf)
+    return [from_range(s["key"], s["data"]) for s in doc.get("series", [doc])]
+
+
+def decode_msgpack(buf: bytes) -> list[Series]:
+    return [Series(s["key"], np.frombuffer(s["ts"], TS_DTYPE), np.frombuffer(s["values"], VALUE_DTYPE))
+            for s in msgpack.unpackb(buf)["series"]]
+
+
+def decode_arrow(buf: bytes) -> list[Series]:
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed")
+    out = []
+    for batch in pa.ipc.open_stream(buf):
+        if not batch.num_rows:
+            continue
+        key = batch.column(0).dictionary[0].as_py()
+        ts = batch.column(1).cast(pa.int64()).to_numpy()
+        out.append(Series(key, ts, batch.column(2).to_numpy()))
+    return out
+
+
+def decode(buf: bytes) -> list[Series]:
+    """Decode any format written by ``encode``, detected from its first bytes."""
+    if buf[:4] == MAGIC:
+        return decode_columnar(buf)
+    if buf[:1] == b"{":
+        return decode_json(buf)
+    if buf[:4] == b"\xff\xff\xff\xff":  # Arrow IPC continuation marker
+        return decode_arrow(buf)
+    return decode_msgpack(buf)
@@ -0,0 +1,187 @@
+"""Deadband and swinging-door compression for process values.
+
+Both compressors take samples one at a time through ``offer(ts, value)`` and
+return the points that should actually be sent/stored (usually none). Every
+series has a tolerance, and the stored points reconstruct the original signal
+within it:
+
+    deadband       - hold the last stored value until the next one (step)
+    swinging_door  - interpolate linearly between stored points
+
+``max_gap_ms`` forces a point out at least that often, so a flat signal still
+shows up as alive.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+Point = Tuple[int, float]
+
+MODES = ("none", "deadband", "swinging_door")
+
+# per-metric tolerances, in the metric's own units
+COMPRESSION_TOLERANCES: Dict[str, float] = {
+    "default": 0.1,
+    "position": 0.5,
+    "distance": 0.5,
+    "speed": 0.1,
+    "acceleration": 0.05,
+    "load": 0.5,
+    "grip_force": 0.2,
+    "pressure": 0.01,
+}
+
+
+class Deadband:
+    __slots__ = ("tolerance", "max_gap_ms", "last")
+
+    def __init__(self, tolerance: float, max_gap_ms: int = 60_000):
+        self.tolerance = tolerance
+        self.max_gap_ms = max_gap_ms
+        self.last: Optional[Point] = None
+
+    def offer(self, ts: int, value: float) -> List[Point]:
+        last = self.last
+        if (last is None or abs(value - last[1]) > self.tolerance
+                or ts - last[0] >= self.max_gap_ms):
+            self.last = (ts, value)
+            return [self.last]
+        return []
+
+    def flush(self) -> List[Point]:
+        return []
+
+
+class SwingingDoor:
+    """Swinging-door trending (SDT).
+
+    The door pivots on the last stored point +/- tolerance. Each new sample
+    narrows the range of slopes a line from the pivot can take while staying
+    within tolerance of every sample since; once that range is empty, the
+    previous sample is stored and becomes the new pivot.
+
+    The stored value is the previous sample snapped onto a slope inside the
+    range, which keeps linear reconstruction within tolerance of every
+    original sample (plain SDT stores the raw sample and can overshoot).
+    """
+
+    __slots__ = ("tolerance", "max_gap_ms", "archived", "prev", "slope_upper", "slope_lower")
+
+    def __init__(self, tolerance: float, max_gap_ms: int = 60_000):
+        self.tolerance = tolerance
+        self.max_gap_ms = max_gap_ms
+        self.archived: Optional[Point] = None
+        self.prev: Optional[Point] = None
+        self.slope_upper = -np.inf
+        self.slope_lower = np.inf
+
+    def _open(self, ts: int, value: float):
+        t0, v0 = self.archived
+        dt = ts - t0
+        self.slope_upper = max(self.slope_upper, (value - v0 - self.tolerance) / dt)
+        self.slope_lower = min(self.slope_lower, (value - v0 + self.tolerance) / dt)
+
+    def _archive(self, ts: int, value: float, upper: float, lower: float) -> Point:
+        t0, v0 = self.archived
+        slope = min(max((value - v0) / (ts - t0), upper), lower)
+        self.archived = (ts, v0 + slope * (ts - t0))
+        self.slope_upper, self.slope_lower = -np.inf, np.inf
+        return self.archived
+
+    def offer(self, ts: int, value: float) -> List[Point]:
+        if self.archived is None:
+            self.archived = (ts, value)
+            return [self.archived]
+        if ts <= (self.prev or self.archived)[0]:
+            return []  # duplicate or out of order
+
+        out = []
+        upper, lower = self.slope_upper, self.slope_lower
+        self._open(ts, value)
+        if self.slope_upper > self.slope_lower:
+            # door closed: store the previous sample and restart from it
+            out.append(self._archive(*self.prev, upper, lower))
+            self._open(ts, value)
+
+        if ts - self.archived[0] >= self.max_gap_ms:
+            out.append(self._archive(ts, value, self.slope_upper, self.slope_lower))
+            self.prev = None
+            return out
+
+        self.prev = (ts, value)
+        return out
+
+    def flush(self) -> List[Point]:
+        """Store the pending sample, e.g. before shutdown."""
+        if self.prev is None:
+            return []
+        point = self._archive(*self.prev, self.slope_upper, self.slope_lower)
+        self.prev = None
+        return [point]
+
+
+def make_compressor(mode: str, tolerance: float, max_gap_ms: int = 60_000):
+    if mode == "deadband":
+        return Deadband(tolerance, max_gap_ms)
+    if mode == "swinging_door":
+        return SwingingDoor(tolerance, max_gap_ms)
+    raise ValueError(f"Unknown compression mode: {mode}")
+
+
+class SeriesCompressor:
+    """One compressor per series key, with per-metric (or per-key) tolerances."""
+
+    def __init__(self, mode: str = "none", max_gap_ms: int = 60_000,
+                 tolerances: Optional[Dict[str, float]] = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown compression mode: {mode}")
+        self.mode = mode
+        self.max_gap_ms = max_gap_ms
+        self.tolerances = dict(COMPRESSION_TOLERANCES if tolerances is None else tolerances)
+        self._series: Dict[str, object] = {}
+        self.offered = 0
+        self.kept = 0
+
+    def tolerance_for(self, key: str) -> float:
+        if key in self.tolerances:
+            return self.tolerances[key]
+        metric = key.rsplit(":", 1)[-1]
+        return self.tolerances.get(metric, self.tolerances.get("default", 0.0))
+
+    def set_tolerance(self, key: str, tolerance: float):
+        self.tolerances[key] = tolerance
+        self._series.pop(key, None)
+
+    def offer(self, key: str, ts: int, value: float) -> List[Point]:
+        self.offered += 1
+        if self.mode == "none":
+            self.kept += 1
+            return [(ts, value)]
+        compressor = self._series.get(key)
+        if compressor is None:
+            compressor = self._series[key] = make_compressor(
+                self.mode, self.tolerance_for(key), self.max_gap_ms)
+        points = compressor.offer(ts, value)
+        self.kept += len(points)
+        return points
+
+    def flush(self) -> Dict[str, List[Point]]:
+        return {key: points for key, c in self._series.items() if (points := c.flush())}
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "offered": self.offered, "kept": self.kept,
+                "ratio": self.offered / self.kept if self.kept else None}
+
+
+def reconstruct(ts: np.ndarray, values: np.ndarray, grid: np.ndarray, mode: str) -> np.ndarray:
+    """Evaluate stored points on ``grid`` (ms) the way ``mode`` compressed them."""
+    if len(ts) == 0:
+        return np.full(len(grid), np.nan)
+    if mode == "deadband":
+        idx = np.searchsorted(ts, grid, side="right") - 1
+        out = values[np.clip(idx, 0, None)].astype(np.float64)
+        out[idx < 0] = np.nan
+        return out
+    out = np.interp(grid, ts, values)
+    out[(grid < ts[0]) | (grid > ts[-1])] = np.nan
+    return out
@@ -1,11 +1,95 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
+import socket
+from typing import List, Optional
 
 class Settings(BaseSettings):
     POSTGRES_URL: str = "postgres://localhost:5432"
     SQLITE_URL: str = "sqlite:///./app.db"
     REDIS_URL: str = "redis://localhost:6379"
+    # Redis TimeSeries nodes for app/main.py; series are sharded across them by device
+    REDIS_URLS: List[str] = ["redis://localhost:6379"]
+    REDIS_MAX_CONNECTIONS: int = 50
     app_name: str = "Fault Detection API"
+    # /data read cache
+    READ_CACHE_MAX_SAMPLES: int = 1_000_000
+    READ_CACHE_TTL_MS: int = 2000
+    READ_CACHE_BUCKET_MS: int = 1000
+    # fault event store
+    FAULT_BATCH_SIZE: int = 1000
+    FAULT_FLUSH_INTERVAL: float = 0.5
+    FAULT_MAX_BUFFER: int = 100_000
+    # spectral features for acceleration/load
+    SPECTRAL_WINDOW: int = 256
+    SPECTRAL_HOP: int = 128
+    SPECTRAL_WORKERS: int = 2
+    # storage-side compression: "none", "deadband" or "swinging_door"
+    INGEST_COMPRESSION: str = "none"
+    COMPRESSION_MAX_GAP_MS: int = 60_000
+    # sharded ingest workers
+    INGEST_WORKERS: int = 4
+    INGEST_BATCH_SIZE: int = 500
+    INGEST_QUEUE_SIZE: int = 10_000
+    # how long to wait for late/out-of-order samples before writing a series in order
+    REORDER_LATENESS_MS: int = 1000
+    # a series is reported silent after WATCHDOG_FACTOR typical sample gaps without data
+    WATCHDOG_FACTOR: float = 3.0
+    # senders that compress before sending (python -m app.sensors --compress) need
+    # this above their max gap, or flat stretches are reported as silent
+    WATCHDOG_MIN_TIMEOUT_MS: int = 2000
+    # /stats rollup bucket sizes (each divides the next) and how long each level is kept
+    ROLLUP_LEVELS_MS: List[int] = [60_000, 3_600_000, 86_400_000]
+    ROLLUP_RETENTION_MS: List[int] = [2 * 86_400_000, 90 * 86_400_000, 730 * 86_400_000]
+    # alert channel (/ws_alerts): debounce, hysteresis and per-subscriber rate limit
+    ALERT_DEBOUNCE_MS: int = 10_000
+    ALERT_MIN_COUNT: int = 2
+    ALERT_CLEAR_AFTER_MS: int = 30_000
+    ALERT_RATE: float = 5.0
+    ALERT_BURST: int = 20
+    # local write-ahead log for /ws frames (opt-in); when enabled, sensors are acked
+    # once a frame is on disk in WAL_DIR rather than once it is stored in Redis
+    WAL_ENABLED: bool = False
+    WAL_DIR: str = "wal"
+    WAL_SEGMENT_BYTES: int = 64 * 1024 * 1024
+    WAL_MAX_BYTES: int = 8 * 1024 * 1024 * 1024
+    WAL_COMMIT_DELAY: float = 0.0
+    WAL_REPLAY_BATCH: int = 2000
+    # local compressed archive of ingested samples (opt-in, files under ARCHIVE_DIR);
+    # ARCHIVE_BLOCK_MS must stay below the Redis retention
+    ARCHIVE_ENABLED: bool = False
+    ARCHIVE_DIR: str = "archive"
+    ARCHIVE_BLOCK_MS: int = 300_000
+    ARCHIVE_RETENTION_DAYS: int = 365
+    # Redis Streams log of ingested batches (one stream per ingest worker), read
+    # by consumer groups; see app/streams.py. All instances need the same INGEST_WORKERS.
+    # Opt-in: it moves the detectors off the ingest path, so faults are emitted a
+    # stream read (up to STREAM_BATCH entries, blocking up to 1 s) after ingest
+    # rather than inline with it.
+    INGEST_STREAM: bool = False
+    STREAM_MAXLEN: int = 1_000_000
+    STREAM_GROUPS: List[str] = ["analysis", "rollup", "archive"]
+    STREAM_PARTITIONS: Optional[List[int]] = None  # default: all streams
+    STREAM_CONSUMER: str = socket.gethostname()
+    STREAM_BATCH: int = 100
+    STREAM_CLAIM_IDLE_MS: int = 30_000
+    # upper bound for the frame rate a /ws_dashboard client can ask for
+    DASHBOARD_MAX_FPS: int = 30
+    # machine cycles kept in the per-device index (app/cycles.py)
+    CYCLE_RETENTION_DAYS: int = 30
+    PROFILE_BIN_MS: int = 250
+    PROFILE_HISTORY_MS: int = 6 * 3_600_000
+    PROFILE_REFRESH_S: float = 60.0
+    PROFILE_BAND_Z: float = 4.0
+    # sensor /ws connections (app/gateway.py)
+    WS_MAX_CONNECTIONS: int = 50_000
+    WS_ACCEPT_RATE: float = 2_000.0      # new /ws connections per second
+    WS_ACCEPT_BURST: float = 5_000.0
+    WS_HEARTBEAT_TIMEOUT_S: float = 60.0  # no frame at all, not even "[]"
+    WS_IDLE_TIMEOUT_S: float = 600.0      # no readings
+    WS_MAX_IN_FLIGHT: int = 16            # frames per connection awaiting storage
+    # gc.freeze() the connections' objects (app/gateway.py); process-wide, so only
+    # for processes that run just the gateway
+    WS_GC_FREEZE: bool = False
     # comment out to use defaults 
     model_config = SettingsConfigDict(env_file=".env")
 
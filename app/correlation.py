@@ -0,0 +1,225 @@
+"""Cross-sensor consistency checks per device.
+
+Some faults only show across sensors of one device: ``load`` rising while
+``speed`` stays flat, or ``grip_force`` changing with no matching change in
+``distance``. For every configured pair (y, x) of a device type the engine
+learns ``y ~ a + b*x`` from exponentially weighted means, variances and
+covariance, and tracks the prediction residual. When the residual stays more
+than ``residual_z`` standard deviations from normal for ``persist`` samples, the
+pair has diverged.
+
+The two streams are joined in time with a band join: a sample waits in a short
+queue until the other stream delivers one within ``max_skew_ms``. Each series
+arrives in timestamp order (after the reorder buffer), so matching only looks
+at the head of the other queue, and everything is O(1) per sample.
+
+Device types and their metrics come from ``models.sensors``.
+"""
+import math
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.faults import FaultEvent, Severity
+from app.models import sensors as DEVICE_SENSORS
+
+
+class PairConfig(BaseModel):
+    y: str                      # dependent metric
+    x: str                      # metric it should follow
+    max_skew_ms: int = 250      # samples further apart than this are not paired
+    halflife: int = 200         # samples, for the exponentially weighted stats
+    warmup: int = 50            # pairs used to learn the relation before checking
+    residual_z: float = 4.0     # alarm threshold on the standardized residual
+    persist: int = 5            # consecutive out-of-band pairs before an alarm
+    min_sigma: float = 0.1      # floor for the residual std
+    min_corr: Optional[float] = None  # also alarm when |correlation| drops below this
+    severity: Severity = "warning"
+
+
+# device type (keys of models.sensors) -> pairs to check
+CORRELATION_PAIRS: Dict[str, List[PairConfig]] = {
+    "axis": [
+        PairConfig(y="load", x="speed", min_sigma=1.0, severity="critical"),
+        # not speed ~ acceleration: acceleration is the derivative of speed, so a
+        # linear fit breaks on every move (speed is flat while acceleration is not)
+    ],
+    "gripper": [
+        PairConfig(y="grip_force", x="distance", max_skew_ms=500, min_sigma=0.5,
+                   severity="critical"),
+    ],
+}
+
+Sample = Tuple[int, int, float]  # (ts, sensor_id, value)
+
+
+class PairStats:
+    """Exponentially weighted regression of y on x plus residual statistics."""
+
+    __slots__ = ("cfg", "n", "mx", "my", "vx", "vy", "cxy", "r_mean", "r_var",
+                 "out", "alarmed", "corr_alarmed", "last_z")
+
+    def __init__(self, cfg: PairConfig):
+        self.cfg = cfg
+        self.n = 0
+        self.mx = self.my = 0.0
+        self.vx = self.vy = self.cxy = 0.0
+        self.r_mean = self.r_var = 0.0
+        self.out = 0
+        self.alarmed = False
+        self.corr_alarmed = False
+        self.last_z = 0.0
+
+    @property
+    def slope(self) -> float:
+        return self.cxy / self.vx if self.vx > 1e-12 else 0.0
+
+    @property
+    def correlation(self) -> float:
+        d = math.sqrt(self.vx * self.vy)
+        return self.cxy / d if d > 1e-12 else 0.0
+
+    def predict(self, x: float) -> float:
+        return self.my + self.slope * (x - self.mx)
+
+    def update(self, x: float, y: float) -> Optional[str]:
+        """Add one aligned pair; returns "residual" or "correlation" on a new alarm."""
+        cfg = self.cfg
+        residual = y - self.predict(x)
+        sigma = max(math.sqrt(self.r_var), cfg.min_sigma)
+        z = (residual - self.r_mean) / sigma
+        self.last_z = z
+
+        alarm = None
+        if self.n >= cfg.warmup:
+            if abs(z) > cfg.residual_z:
+                self.out += 1
+                if self.out >= cfg.persist and not self.alarmed:
+                    self.alarmed = True
+                    alarm = "residual"
+                elif not self.alarmed:
+                    return None  # keep outliers out of the baseline until they persist
+            else:
+                self.out = 0
+                self.alarmed = False
+            if cfg.min_corr is not None:
+                weak = abs(self.correlation) < cfg.min_corr
+                if weak and not self.corr_alarmed and alarm is None:
+                    alarm = "correlation"
+                self.corr_alarmed = weak
+
+        self.n += 1
+        a = max(1.0 - 0.5 ** (1.0 / cfg.halflife), 1.0 / self.n)
+        dx, dy = x - self.mx, y - self.my
+        self.mx += a * dx
+        self.my += a * dy
+        self.vx = (1 - a) * (self.vx + a * dx * dx)
+        self.vy = (1 - a) * (self.vy + a * dy * dy)
+        self.cxy = (1 - a) * (self.cxy + a * dx * dy)
+        if self.n > 1:
+            dr = residual - self.r_mean
+            self.r_mean += a * dr
+            self.r_var = (1 - a) * (self.r_var + a * dr * dr)
+        return alarm
+
+
+class _Pair:
+    __slots__ = ("cfg", "stats", "pending_x", "pending_y")
+
+    def __init__(self, cfg: PairConfig, max_pending: int):
+        self.cfg = cfg
+        self.stats = PairStats(cfg)
+        self.pending_x: Deque[Sample] = deque(maxlen=max_pending)
+        self.pending_y: Deque[Sample] = deque(maxlen=max_pending)
+
+
+class CorrelationEngine:
+    def __init__(self, pairs: Optional[Dict[str, List[PairConfig]]] = None,
+                 device_sensors: Optional[Dict[str, List[str]]] = None, max_pending: int = 1000):
+        self.pairs = CORRELATION_PAIRS if pairs is None else pairs
+        self.max_pending = max_pending
+        device_sensors = device_sensors or DEVICE_SENSORS
+        # metric -> (device type, indices of the pairs it takes part in)
+        self._by_metric: Dict[str, Tuple[str, List[int]]] = {}
+        for dtype, metrics in device_sensors.items():
+            for metric in metrics:
+                idx = [i for i, p in enumerate(self.pairs.get(dtype, [])) if metric in (p.x, p.y)]
+                if idx:
+                    self._by_metric[metric] = (dtype, idx)
+        self._devices: Dict[Tuple[int, str], List[_Pair]] = {}
+        self.paired = 0
+
+    def _device(self, device_id: int, dtype: str) -> List[_Pair]:
+        pairs = self._devices.get((device_id, dtype))
+        if pairs is None:
+            pairs = self._devices[(device_id, dtype)] = [
+                _Pair(cfg, self.max_pending) for cfg in self.pairs[dtype]]
+        return pairs
+
+    def update(self, sensor_id: int, device_id: int, metric: str, ts: int,
+               value: float) -> List[FaultEvent]:
+        entry = self._by_metric.get(metric)
+        if entry is None:
+            return []
+        dtype, idx = entry
+        pairs = self._device(device_id, dtype)
+        events = []
+        for i in idx:
+            pair = pairs[i]
+            is_y = metric == pair.cfg.y
+            own, other = (pair.pending_y, pair.pending_x) if is_y else (pair.pending_x, pair.pending_y)
+            skew = pair.cfg.max_skew_ms
+            while other and other[0][0] < ts - skew:
+                other.popleft()  # too old to match anything that is still to come
+            if not other or other[0][0] > ts + skew:
+                own.append((ts, sensor_id, value))
+                continue
+            o_ts, o_sensor, o_value = other.popleft()
+            if is_y:
+                y_ts, y_sensor, y, x = ts, sensor_id, value, o_value
+            else:
+                y_ts, y_sensor, y, x = o_ts, o_sensor, o_value, value
+            self.paired += 1
+            alarm = pair.stats.update(x, y)
+            if alarm is not None:
+                events.append(self._event(pair, device_id, y_sensor, y_ts, y, x, alarm))
+        return events
+
+    def _event(self, pair: _Pair, device_id: int, sensor_id: int, ts: int, y: float,
+               x: float, alarm: str) -> FaultEvent:
+        cfg, stats = pair.cfg, pair.stats
+        if alarm == "residual":
+            message = (f"{cfg.y} diverged from {cfg.x}: expected {stats.predict(x):.2f}, "
+                       f"got {y:.2f} (z {stats.last_z:.1f})")
+        else:
+            message = f"{cfg.y} no longer follows {cfg.x} (correlation {stats.correlation:.2f})"
+        return FaultEvent(
+            device_id=device_id, sensor_id=sensor_id, metric=cfg.y,
+            rule=f"cross_sensor_{alarm}", severity=cfg.severity,
+            start_ts=ts, value=y, message=message,
+        )
+
+    def snapshot(self, device_id: int) -> List[dict]:
+        """Current relation of every pair of a device."""
+        out = []
+        for (dev, dtype), pairs in self._devices.items():
+            if dev != device_id:
+                continue
+            for pair in pairs:
+                s = pair.stats
+                out.append({
+                    "device_type": dtype, "y": pair.cfg.y, "x": pair.cfg.x, "samples": s.n,
+                    "correlation": s.correlation, "slope": s.slope,
+                    "intercept": s.my - s.slope * s.mx,
+                    "residual_std": math.sqrt(s.r_var), "last_z": s.last_z,
+                    "alarmed": s.alarmed,
+                })
+        return out
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._devices),
+            "paired": self.paired,
+            "alarmed": sum(p.stats.alarmed for pairs in self._devices.values() for p in pairs),
+        }
@@ -0,0 +1,426 @@
+"""Machine-cycle segmentation and a per-device index of cycle features.
+
+Axes and grippers repeat the same motion: ``position`` / ``distance`` move
+between two plateaus (see ``sensors.periodic_step_function``). For each
+device the engine tracks the driver metric's envelope (slowly decaying
+min/max) and reports a transition when the value crosses from below
+``lower`` to above ``upper`` or back, where ``lower`` and ``upper`` sit
+``hysteresis`` of the range either side of the midpoint, so noise on a plateau
+never toggles the state. A cycle runs from one transition in the ``start_on``
+direction to the next one.
+
+Features per cycle:
+
+    duration_ms   start to next start
+    move_ms       start transition: time from the last sample past one threshold
+                  to the first past the other
+    return_ms     the same for the transition back
+    settle_ms     longest time from a crossing to the driver's last step larger
+                  than ``settle_tol`` of the range, taken once it has made no such
+                  step for ``settle_hold_ms`` (times, not sample counts, so it
+                  doesn't depend on the sample rate or on compression)
+    peak_<metric> maximum of every other metric of the device during the cycle
+
+A device is segmented as the type of the first driver metric seen from it;
+metrics of other device types reported under the same device id are ignored.
+The other metrics may be handled by other ingest workers and arrive a bit
+later, so a closed cycle stays open for their samples for ``grace_ms`` (of
+driver time) before it goes into the index. Samples are matched to cycles by
+timestamp.
+
+The index is columnar per device (NumPy arrays ordered by start), so a time
+range is two binary searches and "slowest 100 cycles today" is one
+``argpartition``. Closed cycles are also written to a Redis sorted set per
+device (``cycles:device:<id>``, scored by start) and the index is reloaded from
+there on startup.
+"""
+import asyncio
+import logging
+import struct
+import time
+from collections import deque
+from typing import Deque, Dict, List, Literal, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from app.models import sensors as DEVICE_SENSORS
+
+log = logging.getLogger(__name__)
+
+
+class CycleConfig(BaseModel):
+    driver: str                         # metric whose transitions delimit cycles
+    start_on: Literal["rise", "fall"] = "rise"
+    hysteresis: float = 0.25            # thresholds at midpoint -/+ this fraction of the range
+    min_range: float = 1.0              # no cycles until the driver has moved this much
+    envelope_decay: float = 0.001       # per sample, lets min/max follow a changed stroke
+    settle_tol: float = 0.01            # "not moving": step below this fraction of the range
+    settle_hold_ms: int = 500           # settled after not moving for this long
+    grace_ms: int = 5_000               # how long a closed cycle waits for other metrics
+
+
+# device type (keys of models.sensors) -> how its cycles are found
+CYCLE_CONFIG: Dict[str, CycleConfig] = {
+    "axis": CycleConfig(driver="position"),
+    "gripper": CycleConfig(driver="distance", start_on="fall"),
+}
+
+BASE_FEATURES = ("duration_ms", "move_ms", "return_ms", "settle_ms")
+
+
+def feature_names(dtype: str, cfg: CycleConfig) -> Tuple[str, ...]:
+    return BASE_FEATURES + tuple(f"peak_{m}" for m in DEVICE_SENSORS[dtype] if m != cfg.driver)
+
+
+def cycles_key(device_id: int) -> str:
+    return f"cycles:device:{device_id}"
+
+
+# ----- Index -----
+
+class CycleIndex:
+    """Closed cycles of one device, as columns ordered by start."""
+
+    def __init__(self, features: Tuple[str, ...], max_cycles: int = 200_000):
+        self.features = features
+        self.max_cycles = max_cycles
+        self.n = 0
+        self.start = np.empty(1024, np.int64)
+        self.end = np.empty(1024, np.int64)
+        self.values = np.empty((1024, len(features)), np.float32)
+        self._member = struct.Struct(f"<qq{len(features)}f")
+
+    def append(self, start: int, end: int, values: np.ndarray):
+        if self.n and start <= self.start[self.n - 1]:
+            return  # already indexed (reloaded, or replayed)
+        if self.n == len(self.start):
+            if self.n >= self.max_cycles:
+                keep = self.n // 2  # drop the oldest half
+                for col in (self.start, self.end, self.values):
+                    col[:keep] = col[self.n - keep:self.n]
+                self.n = keep
+            else:
+                size = min(2 * len(self.start), self.max_cycles)
+                self.start = np.resize(self.start, size)
+                self.end = np.resize(self.end, size)
+                self.values = np.resize(self.values, (size, len(self.features)))
+        self.start[self.n] = start
+        self.end[self.n] = end
+        self.values[self.n] = values
+        self.n += 1
+
+    def encode(self, start: int, end: int, values: np.ndarray) -> bytes:
+        return self._member.pack(start, end, *values.tolist())
+
+    def decode(self, member: bytes) -> Tuple[int, int, np.ndarray]:
+        start, end, *values = self._member.unpack(member)
+        return start, end, np.array(values, np.float32)
+
+    def query(self, start: Optional[int] = None, end: Optional[int] = None,
+              sort: Optional[str] = None, limit: int = 100, descending: bool = True) -> List[dict]:
+        """Cycles starting in ``[start, end)``: the newest ``limit``, or the top
+        ``limit`` by feature ``sort``."""
+        lo = 0 if start is None else int(np.searchsorted(self.start[:self.n], start, "left"))
+        hi = self.n if end is None else int(np.searchsorted(self.start[:self.n], end, "left"))
+        if hi <= lo or limit <= 0:
+            return []
+        if sort is None:
+            rows = np.arange(hi - 1, max(lo, hi - limit) - 1, -1)
+        else:
+            col = self.values[lo:hi, self.features.index(sort)]
+            key = -col if descending else col
+            if limit < len(key):
+                rows = np.argpartition(key, limit - 1)[:limit]
+                rows = rows[np.argsort(key[rows], kind="stable")]
+            else:
+                rows = np.argsort(key, kind="stable")
+            rows = rows + lo
+        return [self._row(i) for i in rows]
+
+    def _row(self, i: int) -> dict:
+        row = {"start_ts": int(self.start[i]), "end_ts": int(self.end[i])}
+        for name, value in zip(self.features, self.values[i].tolist()):
+            row[name] = None if np.isnan(value) else round(value, 3)
+        return row
+
+
+# ----- Segmentation -----
+
+class _Cycle:
+    __slots__ = ("start", "end", "values")
+
+    def __init__(self, start: int, n_features: int):
+        self.start = start
+        self.end: Optional[int] = None
+        self.values = np.full(n_features, np.nan, np.float32)
+
+
+class _Device:
+    __slots__ = ("dtype", "cfg", "features", "aux", "index", "lo", "hi", "level",
+                 "last_low", "last_high", "cross_ts", "moved_ts", "prev", "current",
+                 "recent")
+
+    def __init__(self, dtype: str, cfg: CycleConfig, index: CycleIndex):
+        self.dtype = dtype
+        self.cfg = cfg
+        self.features = index.features
+        # metric -> column of its peak
+        self.aux = {name[5:]: i for i, name in enumerate(self.features) if name.startswith("peak_")}
+        self.index = index
+        self.lo = self.hi = None
+        self.level: Optional[str] = None     # "low" / "high" once the range is known
+        self.last_low = self.last_high = 0   # last ts on each plateau side
+        self.cross_ts: Optional[int] = None  # last crossing, until the driver settles
+        self.moved_ts = 0                    # last step beyond settle_tol since then
+        self.prev = 0.0
+        self.current: Optional[_Cycle] = None
+        self.recent: Deque[_Cycle] = deque()  # closed, still taking late samples
+
+
+class CycleEngine:
+    def __init__(self, redis_client=None, config: Optional[Dict[str, CycleConfig]] = None,
+                 device_sensors: Optional[Dict[str, List[str]]] = None,
+                 retention_ms: int = 30 * 86_400_000, max_cycles: int = 200_000,
+                 flush_interval: float = 5.0, max_unsaved: int = 100_000):
+        self.r = redis_client
+        self.config = CYCLE_CONFIG if config is None else config
+        self.retention_ms = retention_ms
+        self.max_cycles = max_cycles
+        self.flush_interval = flush_interval
+        self.max_unsaved = max_unsaved
+        device_sensors = device_sensors or DEVICE_SENSORS
+        # metric -> device type, for the types that have a cycle config
+        self._types: Dict[str, str] = {
+            metric: dtype for dtype, metrics in device_sensors.items()
+            if dtype in self.config for metric in metrics}
+        self._devices: Dict[int, _Device] = {}
+        self._unsaved: List[Tuple[int, bytes, int]] = []  # (device, member, start)
+        self._task: Optional[asyncio.Task] = None
+        self.cycles = 0
+        self.late = 0
+
+    def _device(self, device_id: int, dtype: str) -> _Device:
+        dev = self._devices.get(device_id)
+        if dev is None:
+            cfg = self.config[dtype]
+            index = CycleIndex(feature_names(dtype, cfg), self.max_cycles)
+            dev = self._devices[device_id] = _Device(dtype, cfg, index)
+        return dev
+
+    def update(self, sensor_id: int, device_id: int, metric: str, ts: int, value: float):
+        dtype = self._types.get(metric)
+        if dtype is None:
+            return
+        dev = self._devices.get(device_id)
+        if dev is None:
+            if metric != self.config[dtype].driver:
+                return  # nothing to attach it to before the first cycle anyway
+            dev = self._device(device_id, dtype)
+        if metric == dev.cfg.driver:
+            self._driver(device_id, dev, ts, value)
+        else:
+            col = dev.aux.get(metric)
+            if col is not None:  # None: a metric of another device type
+                self._aux(dev, col, ts, value)
+
+    def _aux(self, dev: _Device, col: int, ts: int, value: float):
+        cycle = dev.current
+        if cycle is None or ts < cycle.start:
+            # a closed cycle still waiting for stragglers, newest first
+            for cycle in reversed(dev.recent):
+                if cycle.start <= ts < cycle.end:
+                    break
+            else:
+                if dev.current is not None:
+                    self.late += 1
+                return
+        peak = cycle.values[col]
+        if not value <= peak:  # also replaces NaN
+            cycle.values[col] = value
+
+    def _driver(self, device_id: int, dev: _Device, ts: int, x: float):
+        cfg = dev.cfg
+        if dev.lo is None:
+            dev.lo = dev.hi = x
+            dev.prev = x
+        span = dev.hi - dev.lo
+        dev.hi = max(x, dev.hi - cfg.envelope_decay * span)
+        dev.lo = min(x, dev.lo + cfg.envelope_decay * span)
+        span = dev.hi - dev.lo
+
+        # settling after the last crossing
+        if dev.cross_ts is not None:
+            if abs(x - dev.prev) > cfg.settle_tol * span:
+                dev.moved_ts = ts
+            elif ts - dev.moved_ts >= cfg.settle_hold_ms:
+                self._settled(dev, dev.moved_ts)
+        dev.prev = x
+
+        if span < cfg.min_range:
+            return
+        mid = (dev.hi + dev.lo) / 2
+        lower, upper = mid - cfg.hysteresis * span, mid + cfg.hysteresis * span
+        if x <= lower:
+            if dev.level == "high":
+                self._transition(device_id, dev, "fall", dev.last_high, ts)
+            dev.level = "low"
+            dev.last_low = ts
+        elif x >= upper:
+            if dev.level == "low":
+                self._transition(device_id, dev, "rise", dev.last_low, ts)
+            dev.level = "high"
+            dev.last_high = ts
+
+        self._close_recent(device_id, dev, ts)
+
+    def _settled(self, dev: _Device, ts: int):
+        """The driver stopped moving at ``ts`` after the last crossing."""
+        cycle = dev.current
+        if cycle is not None:
+            col = BASE_FEATURES.index("settle_ms")
+            settle = ts - dev.cross_ts
+            if not settle <= cycle.values[col]:
+                cycle.values[col] = settle
+        dev.cross_ts = None
+
+    def _transition(self, device_id: int, dev: _Device, direction: str, left_ts: int, ts: int):
+        if dev.cross_ts is not None:
+            self._settled(dev, ts)  # moved again before settling
+        move = float(ts - left_ts)
+        if direction == dev.cfg.start_on:
+            if dev.current is not None:
+                closed = dev.current
+                closed.end = ts
+                closed.values[0] = ts - closed.start
+                dev.recent.append(closed)
+            dev.current = _Cycle(ts, len(dev.features))
+            dev.current.values[1] = move
+        elif dev.current is not None:
+            dev.current.values[2] = move
+        dev.cross_ts = dev.moved_ts = ts
+
+    def _close_recent(self, device_id: int, dev: _Device, now: int):
+        while dev.recent and dev.recent[0].end + dev.cfg.grace_ms <= now:
+            self._index(device_id, dev, dev.recent.popleft())
+
+    def _index(self, device_id: int, dev: _Device, cycle: _Cycle):
+        dev.index.append(cycle.start, cycle.end, cycle.values)
+        self.cycles += 1
+        if self.r is not None:
+            self._unsaved.append((device_id, dev.index.encode(cycle.start, cycle.end, cycle.values),
+                                  cycle.start))
+
+    # ----- Queries -----
+
+    def cycle_start(self, device_id: int, ts: int) -> Optional[int]:
+        """Start of the device's open or not yet indexed cycle containing ``ts``."""
+        dev = self._devices.get(device_id)
+        if dev is None or dev.current is None:
+            return None
+        if ts >= dev.current.start:
+            return dev.current.start
+        for cycle in reversed(dev.recent):
+            if cycle.start <= ts < cycle.end:
+                return cycle.start
+        return None
+
+    def closed_since(self, device_id: int, since: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(starts, ends) of the indexed cycles of a device that started at or after ``since``."""
+        dev = self._devices.get(device_id)
+        if dev is None:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        index = dev.index
+        lo = int(np.searchsorted(index.start[:index.n], since, "left"))
+        return index.start[lo:index.n].copy(), index.end[lo:index.n].copy()
+
+    def query(self, device_id: int, start: Optional[int] = None, end: Optional[int] = None,
+              sort: Optional[str] = None, limit: int = 100, descending: bool = True) -> dict:
+        dev = self._devices.get(device_id)
+        if dev is None:
+            return {"device_id": device_id, "features": [], "cycles": []}
+        if sort is not None and sort not in dev.features:
+            raise ValueError(f"Unknown feature {sort}; one of {', '.join(dev.features)}")
+        return {
+            "device_id": device_id,
+            "device_type": dev.dtype,
+            "features": list(dev.features),
+            "cycles": dev.index.query(start, end, sort, limit, descending),
+        }
+
+    # ----- Persistence -----
+
+    async def load(self):
+        """Rebuild the indexes from Redis (devices listed in ``cycles:devices``)."""
+        members = await self.r.execute_command("SMEMBERS", "cycles:devices")
+        since = int(time.time() * 1000) - self.retention_ms
+        for member in members:
+            device_id, dtype = (member.decode() if isinstance(member, bytes) else member).split(":")
+            if dtype not in self.config:
+                continue
+            dev = self._device(int(device_id), dtype)
+            rows = await self.r.execute_command(
+                "ZRANGEBYSCORE", cycles_key(int(device_id)), since, "+inf")
+            for row in rows:
+                dev.index.append(*dev.index.decode(row))
+
+    async def flush(self):
+        if not self._unsaved or self.r is None:
+            return
+        unsaved, self._unsaved = self._unsaved, []
+        cutoff = int(time.time() * 1000) - self.retention_ms
+        pipe = self.r.pipeline(transaction=False)
+        for device_id in {device_id for device_id, _, _ in unsaved}:
+            pipe.execute_command("SADD", "cycles:devices",
+                                 f"{device_id}:{self._devices[device_id].dtype}")
+            pipe.execute_command("ZREMRANGEBYSCORE", cycles_key(device_id), "-inf", cutoff)
+        for device_id, member, start in unsaved:
+            pipe.execute_command("ZADD", cycles_key(device_id), start, member)
+        try:
+            await pipe.execute()
+        except Exception:
+            # keep them for the next flush; the index itself has them already
+            self._unsaved = (unsaved + self._unsaved)[-self.max_unsaved:]
+            raise
+
+    async def start(self):
+        if self.r is None:
+            return
+        try:
+            await self.load()
+        except Exception as e:
+            log.error(f"Loading the cycle index failed: {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # cycles that were still waiting for other metrics
+        for device_id, dev in self._devices.items():
+            while dev.recent:
+                self._index(device_id, dev, dev.recent.popleft())
+        try:
+            await self.flush()
+        except Exception as e:
+            log.error(f"Saving {len(self._unsaved)} cycles failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error(f"Saving {len(self._unsaved)} cycles failed, will retry: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._devices),
+            "cycles": self.cycles,
+            "waiting": sum(len(dev.recent) for dev in self._devices.values()),
+            "unsaved": len(self._unsaved),
+            "late": self.late,
+        }
@@ -1,2 +1,118 @@
+"""Async SQLModel engine and a batched writer for the relational backend (v0.py).
 
+``BatchWriter.write`` turns payloads into rows and queues them, then waits
+for them to be committed. Rows are built on the caller's side, so a payload
+that can't be converted (e.g. a bad timestamp) fails only its own caller, not
+the shared batch. A single background task takes whatever is queued (up to
+``batch_size`` rows) and inserts it with one multi-row INSERT per table and
+one commit for the whole batch. It doesn't wait for more: a lone writer is
+committed right away, and under load the rows queued during one commit make
+up the next batch.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
 
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import models
+
+log = logging.getLogger(__name__)
+
+Row = Tuple[type, Dict[str, Any]]  # (table model, column values)
+
+
+def async_url(url: str) -> str:
+    """Turn a plain postgres URL into one for the asyncpg driver."""
+    for prefix in ("postgres://", "postgresql://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+def make_engine(url: str) -> AsyncEngine:
+    return create_async_engine(async_url(url), pool_size=10, max_overflow=10)
+
+
+def make_sessionmaker(engine: AsyncEngine) -> async_sessionmaker:
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def create_db_and_tables(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+
+class BatchWriter:
+    def __init__(self, sessionmaker: async_sessionmaker, batch_size: int = 1000,
+                 queue_size: int = 50_000):
+        self.sessionmaker = sessionmaker
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue[Tuple[Row, asyncio.Future]] = asyncio.Queue(maxsize=queue_size)
+        self._task = None
+        self.written = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def write(self, payload: models.SensorPayload):
+        """Queue a payload and wait until its batch is committed."""
+        await self.write_many([payload])
+
+    async def write_many(self, payloads: List[models.SensorPayload]):
+        """Queue payloads and wait until all of them are committed.
+
+        Raises before queueing anything if a payload can't be turned into a row.
+        """
+        rows = [(models.TABLE_MODELS[payload.sensor_type], models.to_row(payload))
+                for payload in payloads]
+        loop = asyncio.get_running_loop()
+        futures = []
+        for row in rows:
+            fut = loop.create_future()
+            await self._queue.put((row, fut))
+            futures.append(fut)
+        for fut in futures:
+            await fut
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                await self._insert([row for row, _ in batch])
+                self.written += len(batch)
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_result(None)
+            except asyncio.CancelledError:
+                for _, fut in batch:
+                    fut.cancel()
+                raise
+            except Exception as e:
+                log.error(f"Batch insert of {len(batch)} records failed: {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    async def _insert(self, rows: List[Row]):
+        by_model: Dict[type, List[dict]] = {}
+        for model, values in rows:
+            by_model.setdefault(model, []).append(values)
+        async with self.sessionmaker() as session:
+            for model, model_rows in by_model.items():
+                await session.execute(insert(model), model_rows)
+            await session.commit()
@@ -0,0 +1,195 @@
+"""Streaming change-point detectors (CUSUM, Page-Hinkley).
+
+Both run in O(1) per sample and are fed inline from ingest, so a step or drift
+is reported on the sample that crosses the threshold. After an alarm a detector
+resets and re-learns its baseline, so a step to a new steady level is reported
+once rather than on every following sample.
+"""
+import math
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.faults import FaultEvent
+
+
+class DetectorConfig(BaseModel):
+    # CUSUM, in units of the baseline standard deviation
+    cusum_k: float = 0.5        # drift allowance
+    cusum_h: float = 8.0        # alarm threshold
+    # Page-Hinkley, in units of the signal
+    ph_delta: float = 0.5       # tolerated change magnitude
+    ph_lambda: float = 50.0     # alarm threshold
+    ph_alpha: float = 0.99      # forgetting factor for the running mean (1.0 = plain mean)
+    warmup: int = 20            # samples used to learn the baseline mean/std
+    min_sigma: float = 0.1      # floor for the std, for signals that are perfectly flat
+    severity: str = "warning"
+
+
+# per-metric tuning; anything not listed uses "default"
+DETECTOR_CONFIG: Dict[str, DetectorConfig] = {
+    "default": DetectorConfig(),
+    "position": DetectorConfig(min_sigma=0.5, ph_delta=1.0, ph_lambda=100.0),
+    "distance": DetectorConfig(min_sigma=0.5, ph_delta=1.0, ph_lambda=100.0),
+    "speed": DetectorConfig(min_sigma=0.2),
+    "acceleration": DetectorConfig(min_sigma=0.2, cusum_h=10.0),
+    "load": DetectorConfig(min_sigma=1.0, ph_delta=2.0, ph_lambda=200.0, severity="critical"),
+    "grip_force": DetectorConfig(min_sigma=0.5, severity="critical"),
+    "pressure": DetectorConfig(min_sigma=0.05, ph_delta=0.1, ph_lambda=5.0),
+}
+
+
+class Detection(BaseModel):
+    rule: str
+    direction: str      # "up" or "down"
+    onset_ts: int       # best estimate of when the change started
+    ts: int             # sample that triggered the alarm
+    value: float
+    statistic: float
+
+
+class Cusum:
+    """Two-sided tabular CUSUM against a baseline learned during warm-up."""
+
+    __slots__ = ("cfg", "n", "mean", "m2", "sigma", "s_hi", "s_lo", "onset_hi", "onset_lo")
+
+    def __init__(self, cfg: DetectorConfig):
+        self.cfg = cfg
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sigma = 0.0
+        self.s_hi = 0.0
+        self.s_lo = 0.0
+        self.onset_hi = 0
+        self.onset_lo = 0
+
+    def update(self, ts: int, x: float) -> Optional[Detection]:
+        cfg = self.cfg
+        if self.n < cfg.warmup:
+            # Welford
+            self.n += 1
+            d = x - self.mean
+            self.mean += d / self.n
+            self.m2 += d * (x - self.mean)
+            if self.n == cfg.warmup:
+                std = math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+                self.sigma = max(std, cfg.min_sigma)
+            self.onset_hi = self.onset_lo = ts
+            return None
+
+        z = (x - self.mean) / self.sigma
+        if self.s_hi == 0.0:
+            self.onset_hi = ts
+        if self.s_lo == 0.0:
+            self.onset_lo = ts
+        self.s_hi = max(0.0, self.s_hi + z - cfg.cusum_k)
+        self.s_lo = max(0.0, self.s_lo - z - cfg.cusum_k)
+
+        if self.s_hi > cfg.cusum_h:
+            det = Detection(rule="cusum", direction="up", onset_ts=self.onset_hi, ts=ts,
+                            value=x, statistic=self.s_hi)
+        elif self.s_lo > cfg.cusum_h:
+            det = Detection(rule="cusum", direction="down", onset_ts=self.onset_lo, ts=ts,
+                            value=x, statistic=self.s_lo)
+        else:
+            return None
+        self.reset()
+        return det
+
+
+class PageHinkley:
+    """Two-sided Page-Hinkley test with an exponentially weighted running mean."""
+
+    __slots__ = ("cfg", "n", "mean", "m_up", "min_up", "m_down", "max_down", "onset_up", "onset_down")
+
+    def __init__(self, cfg: DetectorConfig):
+        self.cfg = cfg
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m_up = 0.0
+        self.min_up = 0.0
+        self.m_down = 0.0
+        self.max_down = 0.0
+        self.onset_up = 0
+        self.onset_down = 0
+
+    def update(self, ts: int, x: float) -> Optional[Detection]:
+        cfg = self.cfg
+        self.n += 1
+        if self.n == 1:
+            self.mean = x
+            self.onset_up = self.onset_down = ts
+            return None
+        alpha = min(cfg.ph_alpha, 1.0 - 1.0 / self.n)
+        self.mean = alpha * self.mean + (1.0 - alpha) * x
+
+        self.m_up += x - self.mean - cfg.ph_delta
+        if self.m_up <= self.min_up:
+            self.min_up = self.m_up
+            self.onset_up = ts
+        self.m_down += x - self.mean + cfg.ph_delta
+        if self.m_down >= self.max_down:
+            self.max_down = self.m_down
+            self.onset_down = ts
+
+        if self.n <= cfg.warmup:
+            return None
+        if self.m_up - self.min_up > cfg.ph_lambda:
+            det = Detection(rule="page_hinkley", direction="up", onset_ts=self.onset_up, ts=ts,
+                            value=x, statistic=self.m_up - self.min_up)
+        elif self.max_down - self.m_down > cfg.ph_lambda:
+            det = Detection(rule="page_hinkley", direction="down", onset_ts=self.onset_down, ts=ts,
+                            value=x, statistic=self.max_down - self.m_down)
+        else:
+            return None
+        self.reset()
+        return det
+
+
+SeriesId = Tuple[int, int, str]  # (sensor_id, device_id, metric)
+
+
+def to_event(sensor_id: int, device_id: int, metric: str, cfg: DetectorConfig,
+             det: Detection) -> FaultEvent:
+    return FaultEvent(
+        device_id=device_id, sensor_id=sensor_id, metric=metric,
+        rule=det.rule, severity=cfg.severity,
+        start_ts=det.onset_ts, end_ts=det.ts, value=det.value,
+        message=f"{det.direction} step detected (statistic {det.statistic:.2f})",
+    )
+
+
+class DetectorBank:
+    """One CUSUM and one Page-Hinkley detector per series, created on first sample."""
+
+    def __init__(self, config: Optional[Dict[str, DetectorConfig]] = None):
+        self.config = config or DETECTOR_CONFIG
+        self._detectors: Dict[SeriesId, Tuple[Cusum, PageHinkley]] = {}
+
+    def config_for(self, metric: str) -> DetectorConfig:
+        return self.config.get(metric) or self.config["default"]
+
+    def update(self, sensor_id: int, device_id: int, metric: str, ts: int,
+               value: float) -> List[FaultEvent]:
+        sid = (sensor_id, device_id, metric)
+        detectors = self._detectors.get(sid)
+        if detectors is None:
+            cfg = self.config_for(metric)
+            detectors = self._detectors[sid] = (Cusum(cfg), PageHinkley(cfg))
+
+        events = []
+        for detector in detectors:
+            det = detector.update(ts, value)
+            if det is not None:
+                events.append(to_event(sensor_id, device_id, metric, detector.cfg, det))
+        return events
+
+    def reset(self, sensor_id: int, device_id: int, metric: str):
+        self._detectors.pop((sensor_id, device_id, metric), None)
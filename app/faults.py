@@ -0,0 +1,252 @@
+"""Fault event store (Postgres).
+
+Detectors call ``FaultStore.record`` which only appends to an in-memory buffer,
+so an alarm storm never blocks analysis. A background task drains the buffer
+in batches with COPY. If Postgres is down the buffer keeps filling up to
+``max_buffer`` events, after which the oldest are dropped and counted.
+
+Listeners added with ``add_listener`` see every recorded event synchronously
+(e.g. the alert channel), so they must not block either. Only the first
+``log_limit`` events per flush interval are logged one by one; the rest are
+summarized per rule once per flush, so a storm doesn't turn into log I/O.
+"""
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Literal, Optional
+
+import asyncpg
+from pydantic import BaseModel
+
+log = logging.getLogger(__name__)
+
+Severity = Literal["info", "warning", "critical"]
+
+COLUMNS = ("device_id", "sensor_id", "metric", "rule", "severity",
+           "start_time", "end_time", "value", "message")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fault_events (
+    id BIGSERIAL PRIMARY KEY,
+    device_id INTEGER NOT NULL,
+    sensor_id INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    rule TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    start_time TIMESTAMPTZ NOT NULL,
+    end_time TIMESTAMPTZ,
+    value DOUBLE PRECISION,
+    message TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS fault_events_device_time_idx
+    ON fault_events (device_id, start_time DESC, id DESC);
+CREATE INDEX IF NOT EXISTS fault_events_sensor_time_idx
+    ON fault_events (sensor_id, start_time DESC, id DESC);
+CREATE INDEX IF NOT EXISTS fault_events_time_idx
+    ON fault_events (start_time DESC, id DESC);
+"""
+
+
+class FaultEvent(BaseModel):
+    device_id: int
+    sensor_id: int
+    metric: str
+    rule: str
+    severity: Severity = "warning"
+    start_ts: int  # ms
+    end_ts: Optional[int] = None
+    value: Optional[float] = None
+    message: str = ""
+    id: Optional[int] = None
+
+    @property
+    def series(self) -> str:
+        return f"sensor:{self.sensor_id}:device:{self.device_id}:{self.metric}"
+
+
+def ms_to_dt(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def dt_to_ms(dt: datetime) -> int:
+    return round(dt.timestamp() * 1000)
+
+
+def encode_cursor(start_ts: int, id: int) -> str:
+    return f"{start_ts}:{id}"
+
+
+def decode_cursor(cursor: str) -> tuple[int, int]:
+    start_ts, id = cursor.split(":")
+    return int(start_ts), int(id)
+
+
+class FaultStore:
+    def __init__(self, dsn: str, batch_size: int = 1000, flush_interval: float = 0.5,
+                 max_buffer: int = 100_000, log_limit: int = 20):
+        self.dsn = dsn
+        self.log_limit = log_limit
+        self._logged = 0
+        self._unlogged: Dict[str, int] = {}  # rule -> events not logged since the last summary
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: deque[FaultEvent] = deque(maxlen=max_buffer)
+        self._pool: Optional[asyncpg.Pool] = None
+        self._wakeup = asyncio.Event()
+        self._connect_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[FaultEvent], None]] = []
+        self.written = 0
+        self.dropped = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._flush_worker())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._pool:
+            try:
+                await self._flush()
+            except Exception as e:
+                log.error(f"Final fault flush failed, {len(self._buffer)} events lost: {e}")
+            await self._pool.close()
+
+    def add_listener(self, listener: Callable[[FaultEvent], None]):
+        self._listeners.append(listener)
+
+    def record(self, event: FaultEvent):
+        """Queue an event for writing. Never blocks."""
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(event)
+        if self._logged < self.log_limit:
+            self._logged += 1
+            log.warning(f"Fault {event.rule} on {event.series}: {event.message}")
+        else:
+            self._unlogged[event.rule] = self._unlogged.get(event.rule, 0) + 1
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                log.error(f"Fault listener failed: {e}")
+
+    def _log_summary(self):
+        if self._unlogged:
+            counts = ", ".join(f"{rule}: {n}" for rule, n in sorted(self._unlogged.items()))
+            log.warning(f"{sum(self._unlogged.values())} more fault events not logged ({counts})")
+            self._unlogged = {}
+        self._logged = 0
+
+    # ----- Writer -----
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        async with self._connect_lock:
+            if self._pool is None:
+                pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+                async with pool.acquire() as conn:
+                    await conn.execute(SCHEMA)
+                self._pool = pool
+        return self._pool
+
+    async def _flush(self):
+        while self._buffer:
+            n = min(len(self._buffer), self.batch_size)
+            batch = [self._buffer.popleft() for _ in range(n)]
+            records = [
+                (e.device_id, e.sensor_id, e.metric, e.rule, e.severity,
+                 ms_to_dt(e.start_ts), ms_to_dt(e.end_ts) if e.end_ts is not None else None,
+                 e.value, e.message)
+                for e in batch
+            ]
+            try:
+                async with self._pool.acquire() as conn:
+                    await conn.copy_records_to_table("fault_events", records=records, columns=COLUMNS)
+            except BaseException:
+                # put the batch back in order; anything pushed out of the buffer is lost
+                space = self._buffer.maxlen - len(self._buffer)
+                self.dropped += max(0, len(batch) - space)
+                self._buffer.extendleft(reversed(batch[:space]))
+                raise
+            self.written += len(batch)
+
+    async def _flush_worker(self):
+        backoff = 1.0
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._log_summary()
+            try:
+                await self._get_pool()
+                await self._flush()
+                backoff = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Fault store write failed ({len(self._buffer)} buffered): {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    # ----- Queries -----
+
+    async def query(self, device_id: Optional[int] = None, sensor_id: Optional[int] = None,
+                    metric: Optional[str] = None, start: Optional[int] = None,
+                    end: Optional[int] = None, limit: int = 100,
+                    cursor: Optional[str] = None) -> dict:
+        """Newest-first page of events. Pass the returned ``next_cursor`` to get the next page."""
+        pool = await self._get_pool()
+        where, args = [], []
+
+        def arg(value):
+            args.append(value)
+            return f"${len(args)}"
+
+        if device_id is not None:
+            where.append(f"device_id = {arg(device_id)}")
+        if sensor_id is not None:
+            where.append(f"sensor_id = {arg(sensor_id)}")
+        if metric is not None:
+            where.append(f"metric = {arg(metric)}")
+        if start is not None:
+            where.append(f"start_time >= {arg(ms_to_dt(start))}")
+        if end is not None:
+            where.append(f"start_time < {arg(ms_to_dt(end))}")
+        if cursor is not None:
+            cursor_ts, cursor_id = decode_cursor(cursor)
+            where.append(f"(start_time, id) < ({arg(ms_to_dt(cursor_ts))}, {arg(cursor_id)})")
+
+        sql = "SELECT id, " + ", ".join(COLUMNS) + " FROM fault_events"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY start_time DESC, id DESC LIMIT {arg(limit)}"
+
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(sql, *args)
+
+        items = [
+            FaultEvent(
+                id=row["id"], device_id=row["device_id"], sensor_id=row["sensor_id"],
+                metric=row["metric"], rule=row["rule"], severity=row["severity"],
+                start_ts=dt_to_ms(row["start_time"]),
+                end_ts=dt_to_ms(row["end_time"]) if row["end_time"] is not None else None,
+                value=row["value"], message=row["message"],
+            )
+            for row in rows
+        ]
+        next_cursor = None
+        if len(items) == limit:
+            next_cursor = encode_cursor(items[-1].start_ts, items[-1].id)
+        return {"items": items, "next_cursor": next_cursor}
+
+    def stats(self) -> dict:
+        return {"buffered": len(self._buffer), "written": self.written, "dropped": self.dropped}
@@ -0,0 +1,290 @@
+"""Connection handling for the sensor ingest WebSocket (``/ws``).
+
+Built for tens of thousands of mostly quiet gateway connections:
+
+* a connection is one coroutine reading raw ASGI events plus one slotted
+  ``_Conn``. Timestamps come from a coarse clock that the sweeper advances,
+  not a clock call per frame, and every accepted frame is answered with the
+  same preallocated ``ok`` event. Frames are validated by the handler
+  (``frame_payloads`` in main parses the JSON text in one pass);
+* admission: at most ``max_connections`` at once, further capped by the
+  process's open-file limit minus ``fd_reserve`` so accepting never runs into
+  EMFILE, and at most ``accept_rate`` new connections per second (bursts of
+  ``accept_burst``). A restart then doesn't have every gateway handshake at
+  once. Refused connections are closed before the handshake completes (HTTP
+  403), and the sensor client retries with backoff;
+* frames: the handler answers a frame once its readings are stored, which
+  can take a reorder delay, so up to ``max_in_flight`` frames per connection
+  are handled concurrently and answered in the order they came in (the
+  sensor client pipelines frames and matches answers to the oldest);
+* timeouts: one sweeper task, not a timer per connection, closes connections
+  that sent no frame for ``heartbeat_timeout`` (code 1001) and those that sent
+  frames but no readings for ``idle_timeout`` (code 1000, reason "idle").
+  A sensor that is quiet for a while sends empty frames ``[]`` so it isn't
+  taken for dead; one with nothing to report for ``idle_timeout`` gives its
+  slot back, and app/sensor_client.py reconnects only once it has readings
+  again. Dead TCP peers are found by the server's own WebSocket pings
+  (uvicorn ``--ws-ping-interval``);
+* garbage collection: each connection is a hundred or so long-lived objects
+  (transport, protocol, futures), and at tens of thousands of connections a
+  full collection walks millions of them and stalls the loop for seconds.
+  With ``gc_freeze`` (off by default) the sweeper calls ``gc.freeze()`` after every
+  ``freeze_every`` new connections, moving everything alive into the
+  permanent generation that collections skip. Objects freed by reference
+  counting are still released. Once as many connections have closed (and at
+  least half as many as were frozen), it unfreezes and collects once, so
+  cycles they left behind are not kept. Freezing is process-wide and that
+  collection is a full one, so turn it on only in processes that run
+  nothing but the gateway;
+* metrics: open connections and what was refused or timed out, memory per
+  connection (process RSS growth since start over open connections, from
+  /proc) and event-loop lag (how late a probe sleeping ``probe_interval``
+  wakes up: EWMA and the maximum over the last ``lag_window`` seconds).
+  Reading them doesn't reset anything, so several readers see the same.
+"""
+import asyncio
+import gc
+import logging
+import os
+import resource
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional, Set, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from app.broadcast import TokenBucket
+
+log = logging.getLogger(__name__)
+
+# ingests one frame, returns how many readings it held (0 for a heartbeat)
+Handler = Callable[[Union[str, bytes]], Awaitable[int]]
+
+_OK = {"type": "websocket.send", "text": "ok"}
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Conn:
+    __slots__ = ("ws", "last_frame", "last_data", "closing")
+
+    def __init__(self, ws: WebSocket, now: float):
+        self.ws = ws
+        self.last_frame = now
+        self.last_data = now
+        self.closing = False
+
+
+class SensorGateway:
+    def __init__(self, handler: Handler, max_connections: int = 50_000,
+                 accept_rate: float = 2_000.0, accept_burst: float = 5_000.0,
+                 heartbeat_timeout: float = 60.0, idle_timeout: float = 600.0,
+                 max_in_flight: int = 16, sweep_interval: float = 1.0,
+                 probe_interval: float = 0.1, lag_window: float = 60.0,
+                 fd_reserve: int = 1024, gc_freeze: bool = False, freeze_every: int = 1000):
+        self.handler = handler
+        self.max_in_flight = max_in_flight
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        self.max_connections = max_connections
+        if soft != resource.RLIM_INFINITY and soft - fd_reserve < max_connections:
+            self.max_connections = max(soft - fd_reserve, 0)
+            log.warning(f"Open-file limit {soft} allows only {self.max_connections} sensor "
+                        f"connections (asked for {max_connections}); raise `ulimit -n`")
+        self.bucket = TokenBucket(accept_rate, accept_burst)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.probe_interval = probe_interval
+        self.lag_window = lag_window
+        self.gc_freeze = gc_freeze
+        self.freeze_every = freeze_every
+        self._frozen = 0  # connections open at the last gc.freeze()
+        self._frozen_accepted = 0
+        self._collected_closed = 0
+        self._conns: Set[_Conn] = set()
+        self._clock = time.monotonic()
+        self._tasks = []
+        self._closing: Set[asyncio.Task] = set()
+        self._rss_base = rss_bytes()
+        self.accepted = 0
+        self.closed = 0
+        self.refused_full = 0
+        self.refused_rate = 0
+        self.heartbeat_timeouts = 0
+        self.idle_timeouts = 0
+        self.frames = 0
+        self.readings = 0
+        self.errors = 0
+        self.gc_freezes = 0
+        self.lag_ms = 0.0
+        self._lag_peaks: Deque[List] = deque()  # [whole monotonic second, max lag in it]
+
+    def __len__(self):
+        return len(self._conns)
+
+    async def start(self):
+        self._clock = time.monotonic()
+        self._rss_base = rss_bytes()
+        self._tasks = [asyncio.create_task(self._sweep()), asyncio.create_task(self._probe())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ----- Connections -----
+
+    async def serve(self, ws: WebSocket):
+        """Run a sensor connection (not yet accepted) until it closes."""
+        if len(self._conns) >= self.max_connections:
+            self.refused_full += 1
+            await ws.close(code=1013)
+            return
+        if self.bucket.take():
+            self.refused_rate += 1
+            await ws.close(code=1013)
+            return
+        await ws.accept()
+        self.accepted += 1
+        conn = _Conn(ws, self._clock)
+        self._conns.add(conn)
+        in_flight: Deque[asyncio.Task] = deque()
+        try:
+            while True:
+                message = await ws.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                conn.last_frame = self._clock
+                raw = message.get("text")
+                if raw is None:
+                    raw = message.get("bytes")
+                while in_flight and in_flight[0].done():
+                    in_flight.popleft()
+                if len(in_flight) >= self.max_in_flight:
+                    await in_flight.popleft()
+                prev = in_flight[-1] if in_flight else None
+                in_flight.append(asyncio.create_task(self._frame(conn, raw, prev)))
+        except (WebSocketDisconnect, RuntimeError):
+            pass  # closed by the client or by the sweeper meanwhile
+        finally:
+            self._conns.discard(conn)
+            self.closed += 1
+
+    async def _frame(self, conn: _Conn, raw: Union[str, bytes], prev: Optional[asyncio.Task]):
+        """Handle one frame, then answer it after the frame before it."""
+        try:
+            n = await self.handler(raw)
+        except Exception as e:
+            self.errors += 1
+            reply = {"type": "websocket.send", "text": f"error: {e}"}
+        else:
+            self.frames += 1
+            reply = _OK
+            if n:
+                self.readings += n
+                conn.last_data = self._clock
+        if prev is not None:
+            await prev
+        try:
+            await conn.ws.send(reply)
+        except Exception:
+            pass  # connection gone
+
+    async def _close(self, conn: _Conn, code: int, reason: str):
+        try:
+            await conn.ws.close(code=code, reason=reason)
+        except Exception:
+            pass  # already gone
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self._clock = now = time.monotonic()
+            dead = now - self.heartbeat_timeout
+            idle = now - self.idle_timeout
+            for conn in list(self._conns):
+                if conn.closing:
+                    continue
+                if conn.last_frame < dead:
+                    self.heartbeat_timeouts += 1
+                    code, reason = 1001, "no heartbeat"
+                elif conn.last_data < idle:
+                    self.idle_timeouts += 1
+                    code, reason = 1000, "idle"
+                else:
+                    continue
+                conn.closing = True
+                task = asyncio.create_task(self._close(conn, code, reason))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+            if self.gc_freeze:
+                self._freeze()
+
+    def _freeze(self):
+        gone = self.closed - self._collected_closed
+        if gone >= max(self.freeze_every, self._frozen // 2):
+            # let the collector see what the closed connections left behind
+            gc.unfreeze()
+            gc.collect()
+            self._collected_closed = self.closed
+        elif self.accepted - self._frozen_accepted >= self.freeze_every:
+            gc.collect(1)  # young garbage first, so it isn't frozen with the rest
+        else:
+            return
+        gc.freeze()
+        self._frozen = len(self._conns)
+        self._frozen_accepted = self.accepted
+        self.gc_freezes += 1
+
+    async def _probe(self):
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(self.probe_interval)
+            lag = max(0.0, (time.perf_counter() - t - self.probe_interval) * 1000)
+            self.lag_ms += 0.05 * (lag - self.lag_ms)
+            second = int(time.monotonic())
+            peaks = self._lag_peaks
+            if peaks and peaks[-1][0] == second:
+                peaks[-1][1] = max(peaks[-1][1], lag)
+            else:
+                peaks.append([second, lag])
+            while peaks[0][0] <= second - self.lag_window:
+                peaks.popleft()
+
+    def max_lag_ms(self) -> float:
+        """Largest loop lag seen in the last ``lag_window`` seconds."""
+        since = time.monotonic() - self.lag_window
+        return max((lag for second, lag in self._lag_peaks if second + 1 > since), default=0.0)
+
+    def stats(self) -> dict:
+        rss = rss_bytes()
+        per_conn = None
+        if rss is not None and self._rss_base is not None and self._conns:
+            per_conn = max(rss - self._rss_base, 0) // len(self._conns)
+        return {
+            "connections": len(self._conns),
+            "max_connections": self.max_connections,
+            "accepted": self.accepted,
+            "closed": self.closed,
+            "refused_full": self.refused_full,
+            "refused_rate": self.refused_rate,
+            "heartbeat_timeouts": self.heartbeat_timeouts,
+            "idle_timeouts": self.idle_timeouts,
+            "frames": self.frames,
+            "readings": self.readings,
+            "errors": self.errors,
+            "gc_freezes": self.gc_freezes,
+            "gc_frozen_objects": gc.get_freeze_count(),
+            "rss_bytes": rss,
+            "rss_per_connection": per_conn,
+            "loop_lag_ms": round(self.lag_ms, 2),
+            "max_loop_lag_ms": round(self.max_lag_ms(), 2),
+        }
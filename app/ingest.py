@@ -0,0 +1,186 @@
+"""Sharded ingest workers.
+
+Every payload is routed by ``(device_id, sensor_id)`` to one of N worker tasks.
+A worker drains its queue in batches and hands each batch to the handler
+together with its own state object, so everything per series (detector state,
+compression, write order) is only ever touched by one worker, and samples of a
+series are written in the order they arrived.
+
+A batch is a list of ``(payloads, future)`` items, one per ``submit`` call.
+The handler resolves each future once its payloads are written, which may be
+in a later call: a reorder buffer holds samples back, and ``PendingAcks``
+tracks which submissions its drains complete. If the handler raises, the
+futures of the batch it has not resolved get the exception.
+
+If ``idle_interval`` is set, a worker with nothing queued calls the handler
+with an empty batch that often, so time-based state (e.g. reorder buffers)
+still gets flushed when traffic stops.
+
+``shard_for`` is a stable hash (not Python's ``hash``), so the same routing
+can be used to split sensors across processes or hosts.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+Item = Tuple[List[Any], asyncio.Future]
+Handler = Callable[[Any, List[Item]], Awaitable[None]]
+
+
+def shard_for(device_id: int, sensor_id: int, n: int) -> int:
+    return zlib.crc32(f"{device_id}:{sensor_id}".encode()) % n
+
+
+class PendingAcks:
+    """Submissions waiting for their samples to leave a reorder buffer.
+
+    ``released_through(series)`` is the newest timestamp the buffer has
+    released for a series. A future is added with the newest timestamp it
+    holds per series and becomes ready once every one of them is released;
+    ``settle`` resolves the ready futures after their samples are written.
+    """
+
+    def __init__(self, released_through: Callable[[Hashable], int]):
+        self.released_through = released_through
+        self._waiting: Dict[Hashable, List[Tuple[int, int, list]]] = {}  # series -> heap
+        self._seq = itertools.count()
+        self._tickets = 0
+        self._ready: List[asyncio.Future] = []
+
+    def add(self, fut: asyncio.Future, newest: Dict[Hashable, int]):
+        ticket = [0, fut]  # series still held back, future
+        for series, ts in newest.items():
+            if ts > self.released_through(series):
+                heapq.heappush(self._waiting.setdefault(series, []), (ts, next(self._seq), ticket))
+                ticket[0] += 1
+        if ticket[0]:
+            self._tickets += 1
+        else:
+            self._ready.append(fut)  # e.g. only samples dropped as late
+
+    def release(self, series: Iterable[Hashable]):
+        """Mark what a drain released from ``series``; call before writing it."""
+        for key in series:
+            heap = self._waiting.get(key)
+            if heap is None:
+                continue
+            through = self.released_through(key)
+            while heap and heap[0][0] <= through:
+                ticket = heapq.heappop(heap)[2]
+                ticket[0] -= 1
+                if not ticket[0]:
+                    self._tickets -= 1
+                    self._ready.append(ticket[1])
+            if not heap:
+                del self._waiting[key]
+
+    def settle(self, error: Optional[BaseException] = None):
+        """Resolve the ready futures, or fail them with the write's ``error``."""
+        ready, self._ready = self._ready, []
+        for fut in ready:
+            if fut.done():
+                continue
+            if error is None:
+                fut.set_result(None)
+            else:
+                fut.set_exception(error)
+
+    def __len__(self):
+        return self._tickets + len(self._ready)
+
+
+class IngestDispatcher:
+    def __init__(self, handler: Handler, make_state: Callable[[int], Any], n_workers: int = 4,
+                 batch_size: int = 500, queue_size: int = 10_000,
+                 idle_interval: Optional[float] = None):
+        self.handler = handler
+        self.make_state = make_state
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.idle_interval = idle_interval
+        # items are (payloads, future resolved once they are written)
+        self._queues: List[asyncio.Queue[Item]] = [
+            asyncio.Queue(maxsize=queue_size) for _ in range(n_workers)
+        ]
+        self.states = [make_state(i) for i in range(n_workers)]
+        self._tasks: List[asyncio.Task] = []
+        self.processed = [0] * n_workers
+        self.failed = [0] * n_workers
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.n_workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, payloads: List[Any]):
+        """Route payloads to their workers and wait until they are written.
+
+        Raises the handler's exception if the batch containing them failed.
+        Waits for queue space when a worker is backed up.
+        """
+        await (await self.enqueue(payloads))
+
+    async def enqueue(self, payloads: List[Any]) -> asyncio.Future:
+        """Route payloads to their workers; returns a future that completes once
+        they are written. Payloads of successive calls are queued in call order."""
+        by_shard: Dict[int, List[Any]] = {}
+        for payload in payloads:
+            i = shard_for(payload.device_id, payload.sensor_id, self.n_workers)
+            by_shard.setdefault(i, []).append(payload)
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for i, items in by_shard.items():
+            fut = loop.create_future()
+            await self._queues[i].put((items, fut))
+            futures.append(fut)
+        return asyncio.gather(*futures)
+
+    async def _worker(self, i: int):
+        queue = self._queues[i]
+        state = self.states[i]
+        while True:
+            try:
+                items, fut = await asyncio.wait_for(queue.get(), timeout=self.idle_interval)
+            except asyncio.TimeoutError:
+                try:
+                    await self.handler(state, [])
+                except Exception as e:
+                    log.error(f"Ingest worker {i} idle flush failed: {e}")
+                continue
+            batch = [(items, fut)]
+            n = len(items)
+            while not queue.empty() and n < self.batch_size:
+                items, fut = queue.get_nowait()
+                batch.append((items, fut))
+                n += len(items)
+            try:
+                await self.handler(state, batch)
+                self.processed[i] += n
+            except asyncio.CancelledError:
+                for _, fut in batch:
+                    fut.cancel()
+                raise
+            except Exception as e:
+                self.failed[i] += n
+                log.error(f"Ingest worker {i} failed on batch of {n}: {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.n_workers,
+            "queued": [q.qsize() for q in self._queues],
+            "processed": self.processed,
+            "failed": self.failed,
+        }
@@ -1,20 +1,121 @@
 from contextlib import asynccontextmanager
 import datetime
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 import redis.asyncio as redis
-from pydantic import BaseModel, TypeAdapter
-from typing import Union, Literal, Dict
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import Annotated, Union, Literal, Dict, List, Optional, Tuple
 import json
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Query, Request, WebSocket
 import logging
 import asyncio
+import asyncpg
+import numpy as np
+
+from app import codec
+from app.alerts import AlertConfig, AlertManager
+from app.archive import DAY_MS, Archive
+from app.broadcast import MODES, Broadcaster
+from app.cache import ReadCache
+from app.compression import SeriesCompressor, reconstruct
+from app.config import get_settings
+from app.correlation import CorrelationEngine
+from app.cycles import CycleEngine
+from app.detectors import DetectorBank
+from app.faults import FaultEvent, FaultStore
+from app.gateway import SensorGateway
+from app.ingest import IngestDispatcher, PendingAcks
+from app.profiles import ProfileStore
+from app.reorder import ReorderBuffer
+from app.rollup import Rollup, range_stats, write_closed
+from app.shards import ShardedRedis
+from app.spectral import SpectralAnalyzer
+from app.streams import GroupConsumer, encode_entry, stream_key
+from app.wal import WAL, Replayer
+from app.watchdog import Watchdog
 
 log = logging.getLogger(__name__)
 
-r = redis.Redis(host="localhost", port=6379)
+settings = get_settings()
+
+r = ShardedRedis(settings.REDIS_URLS, max_connections=settings.REDIS_MAX_CONNECTIONS)
 
 RETENTION_MS = 600_000
+# storage writes kept per ingest worker for retry while Redis is unreachable; once
+# this many are waiting, new submissions are refused before they reach the reorder
+# buffer (the WAL replays them later), and none of the waiting ones are dropped
+MAX_RETRY_COMMANDS = 1_000_000
+ROLLUP_RETENTION = dict(zip(settings.ROLLUP_LEVELS_MS, settings.ROLLUP_RETENTION_MS))
+
+read_cache = ReadCache(
+    max_samples=settings.READ_CACHE_MAX_SAMPLES,
+    ttl_ms=settings.READ_CACHE_TTL_MS,
+    bucket_ms=settings.READ_CACHE_BUCKET_MS,
+)
+fault_store = FaultStore(
+    settings.POSTGRES_URL,
+    batch_size=settings.FAULT_BATCH_SIZE,
+    flush_interval=settings.FAULT_FLUSH_INTERVAL,
+    max_buffer=settings.FAULT_MAX_BUFFER,
+)
+archive = Archive(
+    settings.ARCHIVE_DIR,
+    block_ms=settings.ARCHIVE_BLOCK_MS,
+    retention_ms=settings.ARCHIVE_RETENTION_DAYS * DAY_MS,
+) if settings.ARCHIVE_ENABLED else None
+spectral = SpectralAnalyzer(
+    r,
+    window=settings.SPECTRAL_WINDOW,
+    hop=settings.SPECTRAL_HOP,
+    workers=settings.SPECTRAL_WORKERS,
+    retention_ms=RETENTION_MS,
+)
+
+# one engine for all workers: sensors of a device can land on different workers
+correlations = CorrelationEngine()
+cycles = CycleEngine(r, retention_ms=settings.CYCLE_RETENTION_DAYS * DAY_MS)
+
+
+def on_sensor_silent(series: tuple, last_ts: int, timeout_ms: float):
+    sensor_id, device_id, metric = series
+    fault_store.record(FaultEvent(
+        device_id=device_id, sensor_id=sensor_id, metric=metric, rule="sensor_silent",
+        severity="critical", start_ts=last_ts,
+        message=f"No data for {timeout_ms:.0f} ms",
+    ))
+
+
+def on_sensor_resumed(series: tuple, silent_since: int, ts: int):
+    sensor_id, device_id, metric = series
+    fault_store.record(FaultEvent(
+        device_id=device_id, sensor_id=sensor_id, metric=metric, rule="sensor_resumed",
+        severity="info", start_ts=silent_since, end_ts=ts,
+        message=f"Data resumed after {ts - silent_since} ms",
+    ))
+
+
+# dashboard and alert subscribers; see app/broadcast.py
+dashboard = Broadcaster("dashboard", max_fps=settings.DASHBOARD_MAX_FPS)
+alert_channel = Broadcaster("alerts", rate=settings.ALERT_RATE, burst=settings.ALERT_BURST)
+
+
+def push_alert(key: tuple, alert: dict):
+    alert_channel.publish(key, {"json": json.dumps(alert)})
+
+
+alerts = AlertManager(push_alert, AlertConfig(
+    debounce_ms=settings.ALERT_DEBOUNCE_MS,
+    min_count=settings.ALERT_MIN_COUNT,
+    clear_after_ms=settings.ALERT_CLEAR_AFTER_MS,
+))
+fault_store.add_listener(alerts.observe)
+
+watchdog = Watchdog(
+    on_sensor_silent,
+    on_sensor_resumed,
+    factor=settings.WATCHDOG_FACTOR,
+    min_timeout_ms=settings.WATCHDOG_MIN_TIMEOUT_MS,
+)
 
 
 async def initialize_redis():
@@ -43,6 +144,25 @@ async def lifespan(app: FastAPI):
         log.error(f"Redis init failed: {e}")
         raise
 
+    if archive is not None:
+        await archive.start()
+        try:
+            await archive.backfill(r)
+        except Exception as e:
+            log.error(f"Archive backfill failed: {e}")
+    await fault_store.start()
+    await cycles.start()
+    await profiles.start()
+    await spectral.start()
+    for consumer in consumers:
+        await consumer.start()
+    await ingest.start()
+    await watchdog.start()
+    await alerts.start()
+    if wal is not None:
+        await wal.start()
+        await replayer.start()
+    await gateway.start()
     worker_task = asyncio.create_task(dashboard_update_worker())
     try:
         yield
@@ -52,6 +172,46 @@ async def lifespan(app: FastAPI):
             await worker_task
         except asyncio.CancelledError:
             pass
+        await gateway.stop()
+        if wal is not None:
+            await replayer.stop()
+            try:
+                await replayer.drain()
+            except Exception as e:
+                log.error(f"WAL replay on shutdown failed, will resume on restart: {e}")
+            await wal.stop()
+        await alerts.stop()
+        await watchdog.stop()
+        await ingest.stop()
+        try:
+            for state in ingest.states:
+                await write_released(state, state.reorder.flush())
+        except Exception as e:
+            log.error(f"Flushing reorder buffers failed: {e}")
+        # what the consumers haven't read yet stays in the streams for the next start
+        for consumer in consumers:
+            await consumer.stop()
+        await spectral.stop()
+        await profiles.stop()
+        await cycles.stop()
+        await fault_store.stop()
+        try:
+            for state in ingest.states:
+                for key, points in state.compressor.flush().items():
+                    for ts, value in points:
+                        await r.execute_command("TS.ADD", key, ts, value)
+        except Exception as e:
+            log.error(f"Flushing compressed series failed: {e}")
+        try:
+            pipe = r.pipeline(transaction=False)
+            for state in ingest.states:
+                write_closed(pipe, state.rollup.flush(), ROLLUP_RETENTION)
+            await pipe.execute()
+        except Exception as e:
+            log.error(f"Flushing rollups failed: {e}")
+        if archive is not None:
+            await archive.stop()
+        await r.aclose()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -100,7 +260,11 @@ class AirPressurePayload(BaseModel):
 SensorPayload = Union[
     DistancePayload, GripForcePayload, AxisPayload, AirPressurePayload
 ]
-SensorPayloadAdapter = TypeAdapter(SensorPayload)
+# validated by sensor_type directly, instead of trying each model in turn
+TaggedSensorPayload = Annotated[SensorPayload, Field(discriminator="sensor_type")]
+SensorPayloadAdapter = TypeAdapter(TaggedSensorPayload)
+# a frame may also carry a batch of readings (see app/sensor_client.py)
+SensorPayloadBatchAdapter = TypeAdapter(List[TaggedSensorPayload])
 
 def get_timestamp(utc_str) -> int:
     """Get current timestamp in ISO format."""
@@ -108,36 +272,288 @@ def get_timestamp(utc_str) -> int:
     dt = datetime.datetime.fromisoformat(utc_str)
     return int(dt.timestamp() * 1000)  # Convert to milliseconds
 
-# ----- Redis Write Function -----
-async def add_sensor_data(payload: SensorPayload):
-    """Add sensor data to Redis time series"""
-
+def payload_samples(payload: SensorPayload) -> list[tuple[str, float]]:
+    """Split a payload into (metric, value) pairs, one per stored series."""
     if payload.sensor_type == "distance":
-        key = f"sensor:{payload.sensor_id}:device:{payload.device_id}:distance"
-        value = payload.data["distance"]
-        timestamp = get_timestamp(payload.timestamp)
-        await r.execute_command("TS.ADD", key, timestamp, value)
-
+        return [("distance", payload.data["distance"])]
     elif payload.sensor_type == "grip_force":
-        key = f"sensor:{payload.sensor_id}:device:{payload.device_id}:grip_force"
-        value = payload.data["force"]
-        timestamp = get_timestamp(payload.timestamp)
-        await r.execute_command("TS.ADD", key, timestamp, value)
-
+        return [("grip_force", payload.data["force"])]
     elif payload.sensor_type == "axis":
         assert isinstance(payload, AxisPayload)
         # Add each axis measurement separately
-        for metric in ["position", "speed", "acceleration", "load"]:
-            key = f"sensor:{payload.sensor_id}:device:{payload.device_id}:{metric}"
-            value = payload.data[metric]  # type: ignore
+        return [(metric, payload.data[metric])  # type: ignore
+                for metric in ["position", "speed", "acceleration", "load"]]
+    elif payload.sensor_type == "air_pressure":
+        return [("pressure", payload.data["pressure"])]
+    return []
+
+
+# ----- Redis Write Function -----
+class IngestState:
+    """Per-series rolling state owned by one ingest worker."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.reorder = ReorderBuffer(settings.REORDER_LATENESS_MS)
+        self.detectors = DetectorBank()
+        self.compressor = SeriesCompressor(
+            settings.INGEST_COMPRESSION, max_gap_ms=settings.COMPRESSION_MAX_GAP_MS)
+        self.rollup = Rollup(settings.ROLLUP_LEVELS_MS)
+        self.retry: List[tuple] = []  # storage commands that failed with a connection error
+        self.refused = 0  # submissions refused while the retry backlog was full
+        self.acks = PendingAcks(self.reorder.released_through)
+
+
+async def add_sensor_data(state: IngestState, batch: List[Tuple[List[SensorPayload], asyncio.Future]]):
+    """Add a batch of sensor data to the worker's reorder buffer and write out
+    whatever is now behind the lateness watermark.
+
+    Each submission's future is resolved once all of its samples have been
+    released and written (or fails with the write's error), so a sender is
+    only answered for what is stored. A sample is released once it is
+    REORDER_LATENESS_MS behind the newest one of its series (or on an idle
+    flush), so every answer waits about that long. Called with an empty batch
+    when the worker is idle, to flush quiet series. The watchdog sees samples on
+    arrival, before any reorder delay.
+
+    While MAX_RETRY_COMMANDS writes are waiting for Redis, submissions are
+    refused untouched: the reorder buffer would take a later replay of them
+    for late samples, so they must not enter it before they can be written.
+    """
+
+    if batch and len(state.retry) >= MAX_RETRY_COMMANDS:
+        if not state.refused:
+            log.error(f"Ingest worker {state.index} has {len(state.retry)} writes waiting "
+                      f"for Redis; refusing new samples until they are written")
+        state.refused += len(batch)
+        error = redis.ConnectionError(f"{len(state.retry)} writes waiting for Redis")
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_exception(error)
+        batch = []
+    elif state.refused and not state.retry:
+        log.info(f"Ingest worker {state.index} accepting samples again "
+                 f"({state.refused} submissions refused)")
+        state.refused = 0
+
+    for payloads, fut in batch:
+        newest: Dict[tuple, int] = {}
+        for payload in payloads:
             timestamp = get_timestamp(payload.timestamp)
-            await r.execute_command("TS.ADD", key, timestamp, value)
+            for metric, value in payload_samples(payload):
+                series = (payload.sensor_id, payload.device_id, metric)
+                state.reorder.push(series, timestamp, value)
+                watchdog.seen(series, timestamp)
+                if timestamp > newest.get(series, -1):
+                    newest[series] = timestamp
+        state.acks.add(fut, newest)
+    await write_released(state, state.reorder.drain())
+
+
+async def write_released(state: IngestState, released: Dict[tuple, list]):
+    """Write samples released by the reorder buffer and settle the submissions
+    they complete. Errors go to those submitters (and the log), not the caller."""
+    state.acks.release(released)
+    try:
+        await write_samples(state, released)
+    except Exception as e:
+        log.error(f"Ingest worker {state.index} write failed "
+                  f"({sum(map(len, released.values()))} new samples): {e}")
+        state.acks.settle(e)
+        return
+    state.acks.settle()
+
+
+def retry_pipeline(state: IngestState):
+    """A pipeline that first re-sends the worker's writes that failed on a connection error."""
+    pipe = r.pipeline(transaction=False)
+    for args in state.retry:
+        pipe.execute_command(*args)
+    state.retry = []
+    return pipe
+
+
+async def execute_pipeline(state: IngestState, pipe) -> list:
+    """Send ``pipe``; returns the errors. Writes that failed because Redis is
+    unreachable are kept and sent again with the worker's next pipeline."""
+    errors = []
+    if len(pipe):
+        commands = pipe.commands
+        results = await pipe.execute(raise_on_error=False)
+        for args, result in zip(commands, results):
+            if isinstance(result, Exception):
+                errors.append(result)
+                if isinstance(result, (redis.ConnectionError, redis.TimeoutError)):
+                    state.retry.append(args)
+    return errors
+
+
+def analyze_samples(state: IngestState, released: Dict[tuple, list]):
+    """Run the change detectors, correlation checks, cycle segmentation, profile scoring
+    and spectral analysis."""
+    for (sensor_id, device_id, metric), points in released.items():
+        for timestamp, value in points:
+            for event in state.detectors.update(sensor_id, device_id, metric, timestamp, value):
+                fault_store.record(event)
+            for event in correlations.update(sensor_id, device_id, metric, timestamp, value):
+                fault_store.record(event)
+            cycles.update(sensor_id, device_id, metric, timestamp, value)
+            event = profiles.score(sensor_id, device_id, metric, timestamp, value)
+            if event is not None:
+                fault_store.record(event)
+            spectral.add(sensor_id, device_id, metric, timestamp, value)
+
+
+def rollup_samples(state: IngestState, released: Dict[tuple, list], pipe):
+    """Add samples to the rollup buckets and queue the writes of closed ones on ``pipe``."""
+    for (sensor_id, device_id, metric), points in released.items():
+        key = f"sensor:{sensor_id}:device:{device_id}:{metric}"
+        for timestamp, value in points:
+            write_closed(pipe, state.rollup.add(key, timestamp, value), ROLLUP_RETENTION)
 
-    elif payload.sensor_type == "air_pressure":
-        key = f"sensor:{payload.sensor_id}:device:{payload.device_id}:pressure"
-        value = payload.data["pressure"]
-        timestamp = get_timestamp(payload.timestamp)
-        await r.execute_command("TS.ADD", key, timestamp, value)
+
+def archive_samples(released: Dict[tuple, list]):
+    for (sensor_id, device_id, metric), points in released.items():
+        key = f"sensor:{sensor_id}:device:{device_id}:{metric}"
+        for timestamp, value in points:
+            archive.add(key, timestamp, value)
+
+
+async def write_samples(state: IngestState, released: Dict[tuple, list]):
+    """Write in-order samples to Redis time series, then analyze, roll up and archive them.
+
+    Storage only gets the points kept by the worker's compressor (all of them
+    unless INGEST_COMPRESSION is set); everything else sees every sample. With
+    INGEST_STREAM the batch is appended to the worker's stream instead, and the
+    consumer groups below do the rest. All writes go out in one pipeline, so
+    samples that already left the reorder buffer are retried, not lost.
+    """
+
+    pipe = retry_pipeline(state)
+    written = []
+    for (sensor_id, device_id, metric), points in released.items():
+        key = f"sensor:{sensor_id}:device:{device_id}:{metric}"
+        for timestamp, value in points:
+            for ts, stored in state.compressor.offer(key, timestamp, value):
+                pipe.execute_command("TS.ADD", key, ts, stored)
+                written.append((key, ts))
+    if dashboard.feeds:
+        for (sensor_id, device_id, metric), points in released.items():
+            dashboard.publish_values(f"sensor:{sensor_id}:device:{device_id}:{metric}", points)
+    if settings.INGEST_STREAM:
+        if released:
+            pipe.execute_command("XADD", stream_key(state.index), "MAXLEN", "~",
+                                 settings.STREAM_MAXLEN, "*", "d", encode_entry(released))
+    else:
+        rollup_samples(state, released, pipe)
+        analyze_samples(state, released)
+        if archive is not None:
+            archive_samples(released)
+    errors = await execute_pipeline(state, pipe)
+    for key, ts in written:
+        read_cache.invalidate(key, ts)
+    if errors:
+        raise errors[0]
+
+
+ingest = IngestDispatcher(
+    add_sensor_data,
+    IngestState,
+    n_workers=settings.INGEST_WORKERS,
+    batch_size=settings.INGEST_BATCH_SIZE,
+    queue_size=settings.INGEST_QUEUE_SIZE,
+    idle_interval=max(settings.REORDER_LATENESS_MS / 2000, 0.05),
+)
+
+# ----- Stream consumers -----
+# Each group keeps its state in the ingest worker state of the stream's shard.
+async def consume_analysis(shard: int, released: Dict[tuple, list]):
+    analyze_samples(ingest.states[shard], released)
+
+
+async def consume_rollup(shard: int, released: Dict[tuple, list]):
+    # the samples are folded in by now, so a failed write is not raised (the
+    # entry would be handled twice); connection errors are retried by execute_pipeline
+    state = ingest.states[shard]
+    pipe = retry_pipeline(state)
+    rollup_samples(state, released, pipe)
+    errors = await execute_pipeline(state, pipe)
+    if errors:
+        log.error(f"Rollup writes for shard {shard} failed ({len(errors)} commands): {errors[0]}")
+
+
+async def consume_archive(shard: int, released: Dict[tuple, list]):
+    archive_samples(released)
+
+
+STREAM_HANDLERS = {"analysis": consume_analysis, "rollup": consume_rollup,
+                   "archive": consume_archive}
+stream_partitions = settings.STREAM_PARTITIONS
+if stream_partitions is None:
+    stream_partitions = list(range(settings.INGEST_WORKERS))
+if any(not 0 <= shard < settings.INGEST_WORKERS for shard in stream_partitions):
+    raise ValueError(f"STREAM_PARTITIONS must be within 0..{settings.INGEST_WORKERS - 1}")
+consumers = [
+    GroupConsumer(r, group, settings.STREAM_CONSUMER, stream_partitions, STREAM_HANDLERS[group],
+                  count=settings.STREAM_BATCH, claim_idle_ms=settings.STREAM_CLAIM_IDLE_MS)
+    for group in settings.STREAM_GROUPS
+    if group != "archive" or archive is not None
+] if settings.INGEST_STREAM else []
+
+wal = WAL(
+    settings.WAL_DIR,
+    segment_bytes=settings.WAL_SEGMENT_BYTES,
+    max_bytes=settings.WAL_MAX_BYTES,
+    commit_delay=settings.WAL_COMMIT_DELAY,
+) if settings.WAL_ENABLED else None
+
+
+def frame_payloads(raw: Union[str, bytes]) -> List[SensorPayload]:
+    """Parse and validate a /ws frame in one pass: one payload or a list of them."""
+    if raw.lstrip()[:1] in ("[", b"["):
+        return SensorPayloadBatchAdapter.validate_json(raw)
+    return [SensorPayloadAdapter.validate_json(raw)]
+
+
+async def replay_frames(records: List[bytes]) -> asyncio.Future:
+    """WAL sink: queue logged /ws frames for the ingest workers in one batch;
+    the returned future completes once they are written."""
+    payloads = []
+    for record in records:
+        try:
+            payloads.extend(frame_payloads(record))
+        except ValueError as e:
+            log.error(f"Skipping unreadable WAL record: {e}")
+    return await ingest.enqueue(payloads)
+
+
+replayer = Replayer(wal, replay_frames, batch_size=settings.WAL_REPLAY_BATCH) if wal else None
+
+
+async def ingest_frame(raw: Union[str, bytes]) -> int:
+    """Sensor gateway handler: ingest one /ws frame, answered once it is stored."""
+    payloads = frame_payloads(raw)
+    if not payloads:
+        return 0  # heartbeat
+    if wal is not None:
+        # durable once appended; the replayer writes it to storage
+        await wal.append(raw.encode() if isinstance(raw, str) else raw)
+    else:
+        await ingest.submit(payloads)
+    return len(payloads)
+
+
+# /ws connections; see app/gateway.py
+gateway = SensorGateway(
+    ingest_frame,
+    max_connections=settings.WS_MAX_CONNECTIONS,
+    accept_rate=settings.WS_ACCEPT_RATE,
+    accept_burst=settings.WS_ACCEPT_BURST,
+    heartbeat_timeout=settings.WS_HEARTBEAT_TIMEOUT_S,
+    idle_timeout=settings.WS_IDLE_TIMEOUT_S,
+    max_in_flight=settings.WS_MAX_IN_FLIGHT,
+    gc_freeze=settings.WS_GC_FREEZE,
+)
 
 # ------ Analysis Worker -----
 analysis_queue = asyncio.Queue(maxsize=1000)
@@ -146,6 +562,9 @@ async def analysis_worker():
     """worker to analyze sensor data. 
     Every 10 seconds, fetch data from Redis and perform analysis.
     if data out or bounds, log it. and record in postgres
+
+    Step/drift detection does not need this: it runs on every ingested
+    sample, see analyze_samples and app/detectors.py.
     """
     while True:
         try:
@@ -172,7 +591,6 @@ async def analysis_worker():
 
         await asyncio.sleep(10)  # Adjust the sleep time as needed
     
-connected_clients: set[WebSocket] = set()
 last_sent_ts: Dict[str, str] = {}
 
 async def dashboard_update_worker():
@@ -189,7 +607,9 @@ async def dashboard_update_worker():
             json_str = json.dumps(data_serializable)
         except Exception as e:
             log.error(f"Redis TS.GET error: {e}")
-            json_str = json.dumps({"error": str(e)})
+            dashboard.publish(key, {"json": json.dumps({"error": str(e)})})
+            await asyncio.sleep(1)
+            continue
         
         if data[0] == last_sent_ts.get(key):
             log.info(f"No new data for {key}, skipping broadcast")
@@ -197,17 +617,12 @@ async def dashboard_update_worker():
             continue
         last_sent_ts[key] = data[0]
 
-        to_remove = []
-        for client in connected_clients:
-            try:
-                await client.send_text(json_str)
-            except Exception as e:
-                log.warning(f"Send failed: {e}")
-                to_remove.append(client)
-
-        for client in to_remove:
-            connected_clients.remove(client)
-            log.info(f"Removed client. Total: {len(connected_clients)}")
+        # encode once per format in use, not once per client
+        frames: Dict[str, Union[str, bytes]] = {"json": json_str}
+        for fmt in dashboard.formats() - frames.keys():
+            series = codec.from_range(key, [data])
+            frames[fmt] = codec.encode(fmt, [series], data[0], data[0])
+        dashboard.publish(key, frames)
 
         await asyncio.sleep(1)  # broadcast rate
 
@@ -222,62 +637,302 @@ async def get():
 async def get_dashboard():
     return FileResponse("app/static/dashboard.html")
 
+def now_ms() -> int:
+    return int(datetime.datetime.now().timestamp() * 1000)
+
+
+async def read_history(key: str, start: int, end: int) -> codec.Series:
+    """Points of ``key`` with ``start <= ts <= end``: sealed archive blocks, then Redis
+    for whatever is newer than the archive."""
+    until = archive.archived_until(key) if archive is not None else -1
+    parts = []
+    if start <= until:
+        ts, values = await asyncio.to_thread(archive.read, key, start, min(end, until))
+        parts.append(codec.Series(key, ts, values))
+    if end > until:
+        data = await r.execute_command("TS.RANGE", key, max(start, until + 1), end)
+        parts.append(codec.from_range(key, data))
+    if len(parts) == 1:
+        return parts[0]
+    return codec.Series(key, np.concatenate([p.ts for p in parts]),
+                        np.concatenate([p.values for p in parts]))
+
+
+# learns from the cycle index and stored history, scores samples in analyze_samples
+profiles = ProfileStore(
+    cycles,
+    read_history,
+    bin_ms=settings.PROFILE_BIN_MS,
+    history_ms=settings.PROFILE_HISTORY_MS,
+    refresh_interval=settings.PROFILE_REFRESH_S,
+    band_z=settings.PROFILE_BAND_Z,
+)
+
+
 @app.get("/data/{sensor_id}/{device_id}/{metric}")
-async def get_data(sensor_id: int, device_id: int, metric: str):
+async def get_data(sensor_id: int, device_id: int, metric: str, request: Request,
+                   format: Optional[str] = None, interval: Optional[int] = Query(None, ge=1),
+                   start: Optional[int] = None, end: Optional[int] = None):
+    """Last 10 minutes of one series, or ``start``..``end`` (epoch ms), which
+    may reach back into the archive.
+
+    With ``interval`` (ms) the stored points are resampled onto a regular grid,
+    reconstructing what ingest compression left out.
+    """
     key = f"sensor:{sensor_id}:device:{device_id}:{metric}"
     try:
-        # Fetch last 10 seconds of data
-        cur_time = await r.time()
-        print(cur_time)
-        end_time = cur_time[0] * 1000 + cur_time[1] // 1000  # Current time
-        print(end_time)
-        start_time = end_time - 600_000  # 60 seconds ago
-        print(start_time)
-
-        # start_time = "-"
-        # end_time = "+"
-        data = await r.execute_command("TS.RANGE", key, start_time, end_time)
-        return {"start": start_time, "end": end_time, "key": key, "data": data}
+        fmt = codec.negotiate(request.headers.get("accept"), format)
+    except ValueError as e:
+        return {"error": str(e)}
+    try:
+        if start is None and end is None:
+            # Last 10 minutes, aligned so concurrent readers share one query
+            start_time, end_time = read_cache.window(600_000)
+            data = await read_cache.get(
+                key, start_time, end_time,
+                lambda: r.execute_command("TS.RANGE", key, start_time, end_time),
+            )
+            # the open bucket holds the newest samples and is cached on its own
+            tail_start, end_time = read_cache.tail(end_time)
+            data = data + await read_cache.get(
+                key, tail_start, end_time,
+                lambda: r.execute_command("TS.RANGE", key, tail_start, end_time),
+            )
+            if fmt == "json" and interval is None:
+                return {"start": start_time, "end": end_time, "key": key, "data": data}
+            series = codec.from_range(key, data)
+        else:
+            end_time = end if end is not None else now_ms()
+            start_time = start if start is not None else end_time - 600_000
+            series = await read_history(key, start_time, end_time)
+        if interval is not None:
+            grid = np.arange(start_time - start_time % interval + interval, end_time + 1, interval)
+            values = reconstruct(series.ts, series.values, grid, settings.INGEST_COMPRESSION)
+            known = ~np.isnan(values)
+            series = codec.Series(key, grid[known], values[known])
+        body = codec.encode(fmt, [series], start_time, end_time)
+        return Response(content=body, media_type=codec.MEDIA_TYPES[fmt])
     except redis.ResponseError as e:
         log.error(f"Error fetching data for {key}: {e}")
         return {"error": str(e)}
 
 
+def parse_series(series: List[str]) -> List[str]:
+    """``sensor_id:device_id:metric`` query values to series keys."""
+    keys = []
+    for s in series:
+        sensor_id, device_id, metric = s.split(":")
+        keys.append(f"sensor:{int(sensor_id)}:device:{int(device_id)}:{metric}")
+    return keys
+
+
+def range_fetcher(start: int, end: int):
+    """``fetch_many`` for ReadCache.get_many: TS.RANGE of each series in one pipeline."""
+    async def fetch_many(missing: List[str]):
+        pipe = r.pipeline(transaction=False)
+        for key in missing:
+            pipe.execute_command("TS.RANGE", key, start, end)
+        return await pipe.execute(raise_on_error=False)
+    return fetch_many
+
+
+@app.get("/data")
+async def get_data_multi(request: Request, series: List[str] = Query(...),
+                         format: Optional[str] = None):
+    """Read several series at once, e.g. ``/data?series=1:1:position&series=2:1:speed``.
+
+    Each ``series`` value is ``sensor_id:device_id:metric``.
+    """
+    try:
+        fmt = codec.negotiate(request.headers.get("accept"), format)
+        keys = parse_series(series)
+    except ValueError as e:
+        return {"error": str(e)}
+    try:
+        start_time, end_time = read_cache.window(600_000)
+        results = await read_cache.get_many(
+            keys, start_time, end_time, range_fetcher(start_time, end_time))
+        # the open bucket holds the newest samples and is cached on its own
+        tail_start, end_time = read_cache.tail(end_time)
+        tails = await read_cache.get_many(
+            keys, tail_start, end_time, range_fetcher(tail_start, end_time))
+
+        series_list = []
+        for key, data, tail in zip(keys, results, tails):
+            if isinstance(data, Exception) or isinstance(tail, Exception):
+                error = data if isinstance(data, Exception) else tail
+                log.error(f"Error fetching data for {key}: {error}")
+                data = []
+            else:
+                data = data + tail
+            series_list.append(codec.from_range(key, data))
+        body = codec.encode(fmt, series_list, start_time, end_time)
+        return Response(content=body, media_type=codec.MEDIA_TYPES[fmt])
+    except redis.RedisError as e:
+        log.error(f"Error fetching data for {keys}: {e}")
+        return {"error": str(e)}
+
+
+@app.get("/export")
+async def export_data(request: Request, series: List[str] = Query(...), start: int = Query(...),
+                      end: Optional[int] = None, format: Optional[str] = None):
+    """Every stored point of one or more series in ``[start, end]`` (epoch ms) as a
+    download, from the archive and Redis."""
+    try:
+        fmt = codec.negotiate(request.headers.get("accept"), format)
+        keys = parse_series(series)
+    except ValueError as e:
+        return {"error": str(e)}
+    end = end if end is not None else now_ms()
+    results = await asyncio.gather(*(read_history(key, start, end) for key in keys),
+                                   return_exceptions=True)
+    series_list = []
+    for key, result in zip(keys, results):
+        if isinstance(result, Exception):
+            log.error(f"Error exporting {key}: {result}")
+            result = codec.from_range(key, [])
+        series_list.append(result)
+    body = codec.encode(fmt, series_list, start, end)
+    return Response(content=body, media_type=codec.MEDIA_TYPES[fmt], headers={
+        "Content-Disposition": f'attachment; filename="export-{start}-{end}.{fmt}"'})
+
+
+@app.get("/stats")
+async def get_stats(series: List[str] = Query(...), start: Optional[int] = None,
+                    end: Optional[int] = None,
+                    q: List[float] = Query([0.5, 0.9, 0.99])):
+    """Count, mean, std, min, max and quantiles per series over ``[start, end)``
+    (epoch ms, default the last hour), from the rollup buckets in app/rollup.py.
+
+    The range is widened to whole minutes; quantiles are within 1% of the true value.
+    """
+    try:
+        keys = parse_series(series)
+        if any(not 0 <= x <= 1 for x in q):
+            raise ValueError("Quantiles must be between 0 and 1")
+    except ValueError as e:
+        return {"error": str(e)}
+    end = end if end is not None else now_ms()
+    start = start if start is not None else end - 3_600_000
+
+    def open_buckets(key: str, level: int):
+        for state in ingest.states:
+            bucket = state.rollup.open_bucket(key, level)
+            if bucket is not None:
+                yield bucket
+
+    try:
+        start, end, aggs = await range_stats(r, keys, start, end, settings.ROLLUP_LEVELS_MS,
+                                             open_buckets)
+    except redis.RedisError as e:
+        log.error(f"Error computing stats for {keys}: {e}")
+        return {"error": str(e)}
+    return {
+        "start": start, "end": end,
+        "series": [{"key": key, **agg.summary(q)} for key, agg in zip(keys, aggs)],
+    }
+
+
+@app.get("/ingest/status")
+async def get_ingest_status():
+    """Ingest pipeline counters: queue depths, reorder drops, compression ratio."""
+    return {
+        "dispatcher": ingest.stats(),
+        "reorder": [state.reorder.stats() for state in ingest.states],
+        "compression": [state.compressor.stats() for state in ingest.states],
+        "read_cache": read_cache.stats(),
+        "faults": fault_store.stats(),
+        "spectral": spectral.stats(),
+        "watchdog": watchdog.stats(),
+        "correlation": correlations.stats(),
+        "cycles": cycles.stats(),
+        "profiles": profiles.stats(),
+        "alerts": alerts.stats(),
+        "archive": archive.stats() if archive is not None else None,
+        "wal": {**wal.stats(), **replayer.stats()} if wal is not None else None,
+        "broadcast": {"dashboard": dashboard.stats(), "alerts": alert_channel.stats()},
+        "streams": {consumer.group: consumer.stats() for consumer in consumers},
+        "gateway": gateway.stats(),
+    }
+
+
+@app.get("/alerts")
+async def get_alerts():
+    """Currently firing alerts."""
+    return alerts.active()
+
+
+@app.get("/correlation/{device_id}")
+async def get_correlation(device_id: int):
+    """Learned cross-sensor relations of a device (see app/correlation.py)."""
+    return {"device_id": device_id, "pairs": correlations.snapshot(device_id)}
+
+
+@app.get("/cycles/{device_id}")
+async def get_cycles(device_id: int, start: Optional[int] = None, end: Optional[int] = None,
+                     sort: Optional[str] = None, order: Literal["asc", "desc"] = "desc",
+                     limit: int = Query(100, ge=1, le=10_000)):
+    """Machine cycles of a device that started in ``[start, end)`` (epoch ms): the
+    newest ones, or the top ``limit`` by a feature, e.g. ``sort=duration_ms`` for
+    the slowest. See app/cycles.py for the features."""
+    try:
+        return cycles.query(device_id, start, end, sort, limit, descending=order == "desc")
+    except ValueError as e:
+        return {"error": str(e)}
+
+
+@app.get("/profiles/{sensor_id}/{device_id}/{metric}")
+async def get_profile(sensor_id: int, device_id: int, metric: str):
+    """Learned cycle profile of a series: expected mean and band per phase bin
+    (see app/profiles.py)."""
+    profile = profiles.snapshot(sensor_id, device_id, metric)
+    if profile is None:
+        return {"error": f"No profile for sensor:{sensor_id}:device:{device_id}:{metric}"}
+    return {"sensor_id": sensor_id, "device_id": device_id, "metric": metric, **profile}
+
+
+@app.get("/faults")
+async def get_faults(device_id: Optional[int] = None, sensor_id: Optional[int] = None,
+                     metric: Optional[str] = None, start: Optional[int] = None,
+                     end: Optional[int] = None, limit: int = Query(100, ge=1, le=1000),
+                     cursor: Optional[str] = None):
+    """Fault events, newest first. ``start``/``end`` are epoch ms."""
+    try:
+        return await fault_store.query(device_id, sensor_id, metric, start, end, limit, cursor)
+    except (ValueError, OSError, asyncpg.PostgresError) as e:
+        log.error(f"Error querying faults: {e}")
+        return {"error": str(e)}
+
+
 @app.websocket("/ws_dashboard")
-async def websocket_dashboard_endpoint(ws: WebSocket):
+async def websocket_dashboard_endpoint(ws: WebSocket, format: str = "json",
+                                       fps: Optional[int] = None, mode: str = "latest"):
+    """Latest dashboard values. With ``fps``, every ingested series at up to that
+    many frames per second, conflated to the latest sample or to min/max/latest
+    (``mode=minmax``) in between; see app/broadcast.py."""
     await ws.accept()
-    connected_clients.add(ws)
-    log.info(f"Client connected. Total clients: {len(connected_clients)}")
-    
-    try:
-        while True:
-            await asyncio.sleep(10)  # optional keep-alive or ping
-    except WebSocketDisconnect:
-        connected_clients.remove(ws)
-        log.info(f"Client disconnected. Total clients: {len(connected_clients)}")
+    if format not in codec.MEDIA_TYPES:
+        await ws.close(code=1003, reason=f"Unsupported format: {format}")
+        return
+    if mode not in MODES or (fps is not None and fps <= 0):
+        await ws.close(code=1003, reason="fps must be positive and mode latest or minmax")
+        return
+    await dashboard.serve(ws, format, fps=fps, mode=mode)
+
+
+@app.websocket("/ws_alerts")
+async def websocket_alerts_endpoint(ws: WebSocket):
+    """Alert state transitions (firing/resolved) as JSON, starting with the active ones."""
+    await ws.accept()
+    initial = [((a["series"], a["rule"]), json.dumps(a)) for a in alerts.active()]
+    await alert_channel.serve(ws, "json", initial)
 
 
 # ----- WebSocket Endpoint -----
 @app.websocket("/ws")
 async def websocket_endpoint(ws: WebSocket):
-    await ws.accept()
-    while True:
-        try:
-            raw = await ws.receive_text()
-            data = json.loads(raw)
-            payload = SensorPayloadAdapter.validate_python(data)
-            await add_sensor_data(payload)
-            await ws.send_text("ok")
-        except WebSocketDisconnect:
-            log.info("Sensor client disconnected.")
-            break
-        except Exception as e:
-            log.error(f"WebSocket error: {e}")
-            try:
-                await ws.send_text(f"error: {str(e)}")
-            except Exception:
-                pass  # Connection might already be closed
-        
+    await gateway.serve(ws)
+
 # ----- Example Usage -----
 """
 Example JSON payloads that would be sent via WebSocket:
@@ -1,5 +1,7 @@
-from typing import Literal, Union, Dict
+from datetime import datetime
+from typing import Literal, Optional, Union, Dict
 from pydantic import BaseModel
+from sqlalchemy import DateTime
 from sqlmodel import Field, SQLModel
 
 
@@ -42,7 +44,56 @@ class AirPressurePayload(BaseModel):
 SensorPayload = Union[
     AxisPayload,
     DistancePayload,
-    GripForcePayload]
+    GripForcePayload,
+    AirPressurePayload]
+
+
+# ----- Table Models -----
+class SensorRecord(SQLModel):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sensor_id: int = Field(index=True)
+    device_id: int = Field(index=True)
+    timestamp: datetime = Field(sa_type=DateTime(timezone=True), index=True)
+    status: str = "active"
+
+
+class AxisData(SensorRecord, table=True):
+    position: float
+    speed: float
+    acceleration: float
+    load: float
+
+
+class DistanceData(SensorRecord, table=True):
+    distance: float
+
+
+class GripForceData(SensorRecord, table=True):
+    force: float
+
+
+class AirPressureData(SensorRecord, table=True):
+    pressure: float
+
+
+# sensor_type -> table model; the model's value columns match the payload's data keys
+TABLE_MODELS = {
+    "axis": AxisData,
+    "distance": DistanceData,
+    "grip_force": GripForceData,
+    "air_pressure": AirPressureData,
+}
+
+
+def to_row(payload: SensorPayload) -> dict:
+    """Column values for inserting a payload into its TABLE_MODELS table."""
+    return {
+        "sensor_id": payload.sensor_id,
+        "device_id": payload.device_id,
+        "timestamp": datetime.fromisoformat(payload.timestamp),
+        "status": payload.status,
+        **payload.data,
+    }
 
 number_of_sensors = 6
 number_of_devices = 2
@@ -0,0 +1,265 @@
+"""Cycle-aware baseline profiles for anomaly scoring.
+
+On a machine that repeats a cycle, what a signal should read depends on
+where in the cycle it is: the load peaks while the axis accelerates, and the
+distance is high before the gripper closes. A static limit has to be wide
+enough for the whole cycle, so it misses a bad value on a quiet phase and
+alarms on every cycle whose transition happens slightly late.
+
+A profile holds the expected mean and band of one series per phase bin
+(``bin_ms`` of time since the cycle start, see app/cycles.py), learned from
+recent healthy history:
+
+* a background job takes the cycles the ``CycleEngine`` indexed since the last
+  refresh, keeps those whose duration is within ``duration_tol`` of the
+  median and that had no profile alarm, reads their samples (archive and
+  Redis) and adds them to per-bin sums. Older cycles are decayed by ``decay``
+  per new cycle, so the profile follows slow changes. On the first refresh
+  it looks back ``history_ms``;
+* once a profile exists, samples further than ``reject_z`` from it are left
+  out, so a fault that the filters missed does not widen the band;
+* mean, lower and upper bound are published together as one tuple of new
+  NumPy arrays, never modified in place. Learning runs in a thread, so
+  readers take the tuple in one attribute access and never mix arrays of two
+  refreshes (which can differ in length).
+
+Scoring a live sample is a dict lookup, the cycle start and an array
+lookup. A series is flagged after ``persist`` samples in a row outside the
+band, and once more only after it came back in. Bins with fewer than
+``min_count`` (decayed) samples, and phases past the end of the profile
+(an overlong cycle, see ``duration_ms`` in the cycle index), are not scored.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import numpy as np
+
+from app import codec
+from app.cycles import CycleEngine
+from app.detectors import DETECTOR_CONFIG
+from app.faults import FaultEvent
+
+log = logging.getLogger(__name__)
+
+Fetch = Callable[[str, int, int], Awaitable[codec.Series]]
+
+
+class _Profile:
+    __slots__ = ("s0", "s1", "s2", "band", "duration", "cycles",
+                 "refreshed_until", "out", "out_since", "alarmed", "alarms")
+
+    def __init__(self):
+        self.s0 = self.s1 = self.s2 = np.zeros(0)
+        # published (mean, lower, upper): NaN where a bin has too few samples
+        self.band: Tuple[np.ndarray, np.ndarray, np.ndarray] = (np.zeros(0),) * 3
+        self.duration: Optional[float] = None  # median healthy cycle, ms
+        self.cycles = 0.0                      # decayed number of cycles learned from
+        self.refreshed_until: Optional[int] = None  # next cycle start to learn from
+        self.out = 0
+        self.out_since = 0
+        self.alarmed = False
+        self.alarms: Deque[int] = deque(maxlen=1000)  # kept out of the history
+
+
+class ProfileStore:
+    def __init__(self, cycles: CycleEngine, fetch: Fetch, bin_ms: int = 250,
+                 history_ms: int = 6 * 3_600_000, refresh_interval: float = 60.0,
+                 decay: float = 0.99, band_z: float = 4.0, reject_z: float = 6.0,
+                 persist: int = 3, min_count: float = 20.0, duration_tol: float = 0.2,
+                 max_bins: int = 4096, batch_cycles: int = 200):
+        self.cycles = cycles
+        self.fetch = fetch
+        self.bin_ms = bin_ms
+        self.history_ms = history_ms
+        self.refresh_interval = refresh_interval
+        self.decay = decay
+        self.band_z = band_z
+        self.reject_z = reject_z
+        self.persist = persist
+        self.min_count = min_count
+        self.duration_tol = duration_tol
+        self.max_bins = max_bins
+        self.batch_cycles = batch_cycles
+        self._profiles: Dict[Tuple[int, int, str], _Profile] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.scored = 0
+        self.flagged = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.refresh_ms = 0.0
+
+    # ----- Scoring -----
+
+    def score(self, sensor_id: int, device_id: int, metric: str, ts: int,
+              value: float) -> Optional[FaultEvent]:
+        start = self.cycles.cycle_start(device_id, ts)
+        if start is None:
+            return None
+        series = (sensor_id, device_id, metric)
+        prof = self._profiles.get(series)
+        if prof is None:
+            self._profiles[series] = _Profile()  # learned on the next refresh
+            return None
+        b = (ts - start) // self.bin_ms
+        mean, lower, upper = prof.band
+        if b >= len(lower):
+            return None
+        self.scored += 1
+        lo, hi = lower[b], upper[b]
+        if not (value < lo or value > hi):  # also true for bins without a profile (NaN)
+            prof.out = 0
+            prof.alarmed = False
+            return None
+        if prof.out == 0:
+            prof.out_since = ts
+        prof.out += 1
+        if prof.out < self.persist or prof.alarmed:
+            return None
+        prof.alarmed = True
+        prof.alarms.append(ts)
+        self.flagged += 1
+        cfg = DETECTOR_CONFIG.get(metric, DETECTOR_CONFIG["default"])
+        return FaultEvent(
+            device_id=device_id, sensor_id=sensor_id, metric=metric, rule="profile_deviation",
+            severity=cfg.severity, start_ts=prof.out_since, value=value,
+            message=f"{value:.3f} outside [{lo:.3f}, {hi:.3f}] at {b * self.bin_ms} ms into "
+                    f"the cycle (expected {mean[b]:.3f})",
+        )
+
+    # ----- Learning -----
+
+    async def refresh(self):
+        """Learn from the cycles indexed since the last refresh, for every series."""
+        for series, prof in list(self._profiles.items()):
+            try:
+                while await self._refresh_series(series, prof):
+                    pass
+            except Exception as e:
+                self.failures += 1
+                log.error(f"Refreshing the profile of {series} failed, will retry: {e}")
+
+    async def _refresh_series(self, series: tuple, prof: _Profile) -> bool:
+        """One batch of new cycles; True if there may be more."""
+        sensor_id, device_id, metric = series
+        starts, ends = self.cycles.closed_since(device_id, prof.refreshed_until or 0)
+        if not len(starts):
+            return False
+        if prof.refreshed_until is None:
+            keep = starts >= ends[-1] - self.history_ms
+            starts, ends = starts[keep], ends[keep]
+        more = len(starts) > self.batch_cycles
+        starts, ends = starts[:self.batch_cycles], ends[:self.batch_cycles]
+
+        durations = ends - starts
+        typical = float(np.median(durations)) if len(durations) >= 3 else prof.duration
+        if typical is None:
+            typical = float(np.median(durations))
+        healthy = np.abs(durations - typical) <= self.duration_tol * typical
+        if prof.alarms:
+            alarms = np.fromiter(prof.alarms, np.int64)
+            # a cycle with an alarm has one at or after its start and before its end
+            first = np.searchsorted(alarms, starts, "left")
+            healthy &= (first >= len(alarms)) | (alarms[np.minimum(first, len(alarms) - 1)] >= ends)
+        if healthy.any():
+            t0 = time.perf_counter()
+            key = f"sensor:{sensor_id}:device:{device_id}:{metric}"
+            data = await self.fetch(key, int(starts[healthy][0]), int(ends[healthy][-1]) - 1)
+            await asyncio.to_thread(self._learn, prof, starts[healthy], ends[healthy], typical,
+                                    data.ts, data.values, DETECTOR_CONFIG.get(
+                                        metric, DETECTOR_CONFIG["default"]).min_sigma)
+            self.refreshes += 1
+            self.refresh_ms = (time.perf_counter() - t0) * 1000
+        prof.refreshed_until = int(starts[-1]) + 1
+        return more
+
+    def _learn(self, prof: _Profile, starts: np.ndarray, ends: np.ndarray, duration: float,
+               ts: np.ndarray, values: np.ndarray, min_sigma: float):
+        ts = np.asarray(ts, np.int64)
+        values = np.asarray(values, np.float64)
+        i = np.searchsorted(starts, ts, "right") - 1
+        inside = i >= 0
+        inside[inside] &= ts[inside] < ends[i[inside]]
+        i, ts, values = i[inside], ts[inside], values[inside]
+        phase = (ts - starts[i]) // self.bin_ms
+
+        n_bins = min(self.max_bins, max(len(prof.s0), math.ceil(1.5 * duration / self.bin_ms)))
+        keep = phase < n_bins
+        mean, _, upper = prof.band
+        if len(mean):
+            # leave out what is far from the current profile
+            b = np.minimum(phase, len(mean) - 1)
+            sigma = (upper[b] - mean[b]) / self.band_z
+            z = np.abs(values - mean[b]) / sigma
+            keep &= ~(z > self.reject_z) | (phase >= len(mean))
+        phase, values = phase[keep], values[keep]
+
+        grow = n_bins - len(prof.s0)
+        s0, s1, s2 = (np.pad(s, (0, grow)) for s in (prof.s0, prof.s1, prof.s2))
+        weight = self.decay ** len(starts)
+        s0 = s0 * weight + np.bincount(phase, minlength=n_bins)
+        s1 = s1 * weight + np.bincount(phase, values, minlength=n_bins)
+        s2 = s2 * weight + np.bincount(phase, values * values, minlength=n_bins)
+        prof.s0, prof.s1, prof.s2 = s0, s1, s2
+        prof.cycles = prof.cycles * weight + len(starts)
+        prof.duration = duration
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = s1 / s0
+            sigma = np.maximum(np.sqrt(np.maximum(s2 / s0 - mean * mean, 0.0)), min_sigma)
+        mean[s0 < self.min_count] = np.nan
+        prof.band = (mean, mean - self.band_z * sigma, mean + self.band_z * sigma)
+
+    # ----- Queries -----
+
+    def snapshot(self, sensor_id: int, device_id: int, metric: str) -> Optional[dict]:
+        prof = self._profiles.get((sensor_id, device_id, metric))
+        if prof is None:
+            return None
+
+        def column(values: np.ndarray) -> list:
+            return [None if np.isnan(v) else round(v, 3) for v in values.tolist()]
+
+        mean, lower, upper = prof.band
+        return {
+            "bin_ms": self.bin_ms,
+            "cycle_ms": prof.duration,
+            "cycles": round(prof.cycles, 1),
+            "phase_ms": (np.arange(len(mean)) * self.bin_ms).tolist(),
+            "mean": column(mean),
+            "lower": column(lower),
+            "upper": column(upper),
+            "count": np.round(prof.s0[:len(mean)], 1).tolist(),
+        }
+
+    # ----- Lifecycle -----
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    def stats(self) -> dict:
+        return {
+            "series": len(self._profiles),
+            "learned": sum(1 for prof in self._profiles.values() if len(prof.band[0])),
+            "scored": self.scored,
+            "flagged": self.flagged,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_refresh_ms": round(self.refresh_ms, 1),
+        }
@@ -0,0 +1,105 @@
+"""Per-series reorder buffer with a lateness watermark.
+
+Samples are held in a min-heap per series and released in timestamp order
+once they fall behind the series' watermark (newest timestamp seen minus
+``lateness_ms``). A series that goes quiet is flushed completely after
+``lateness_ms`` of wall-clock time without new samples, so its tail is not
+held back forever.
+
+A sample at or before the last released timestamp of its series can no longer
+be placed in order; it is dropped and counted.
+"""
+import heapq
+import itertools
+import time
+from typing import Dict, Hashable, List, Set, Tuple
+
+Point = Tuple[int, float]
+
+
+class _SeriesBuffer:
+    __slots__ = ("heap", "max_ts", "last_emitted", "last_arrival")
+
+    def __init__(self):
+        self.heap: List[Tuple[int, int, float]] = []  # (ts, arrival seq, value)
+        self.max_ts = -1
+        self.last_emitted = -1
+        self.last_arrival = 0.0
+
+
+class ReorderBuffer:
+    def __init__(self, lateness_ms: int = 1000, max_pending: int = 10_000):
+        self.lateness_ms = lateness_ms
+        self.max_pending = max_pending
+        self._series: Dict[Hashable, _SeriesBuffer] = {}
+        self._nonempty: Set[Hashable] = set()
+        self._seq = itertools.count()
+        self.dropped_late = 0
+        self.dropped_by_series: Dict[Hashable, int] = {}
+
+    def push(self, key: Hashable, ts: int, value: float) -> bool:
+        """Buffer a sample; returns False if it was too late and got dropped."""
+        buf = self._series.get(key)
+        if buf is None:
+            buf = self._series[key] = _SeriesBuffer()
+        if ts <= buf.last_emitted:
+            self.dropped_late += 1
+            self.dropped_by_series[key] = self.dropped_by_series.get(key, 0) + 1
+            return False
+        heapq.heappush(buf.heap, (ts, next(self._seq), value))
+        self._nonempty.add(key)
+        if ts > buf.max_ts:
+            buf.max_ts = ts
+        buf.last_arrival = time.monotonic()
+        return True
+
+    def drain(self) -> Dict[Hashable, List[Point]]:
+        """Release every sample that is behind its watermark, sorted per series."""
+        now = time.monotonic()
+        out: Dict[Hashable, List[Point]] = {}
+        for key in list(self._nonempty):
+            buf = self._series[key]
+            if (now - buf.last_arrival) * 1000 >= self.lateness_ms:
+                watermark = buf.max_ts  # idle series: flush everything
+            else:
+                watermark = buf.max_ts - self.lateness_ms
+            heap = buf.heap
+            released = []
+            while heap and (heap[0][0] <= watermark or len(heap) > self.max_pending):
+                ts, _, value = heapq.heappop(heap)
+                if ts == buf.last_emitted:
+                    continue  # duplicate timestamp, keep the first (DUPLICATE_POLICY first)
+                buf.last_emitted = ts
+                released.append((ts, value))
+            if not heap:
+                self._nonempty.discard(key)
+            if released:
+                out[key] = released
+        return out
+
+    def flush(self) -> Dict[Hashable, List[Point]]:
+        """Release everything, e.g. on shutdown."""
+        out: Dict[Hashable, List[Point]] = {}
+        for key in self._nonempty:
+            buf = self._series[key]
+            released = []
+            while buf.heap:
+                ts, _, value = heapq.heappop(buf.heap)
+                if ts != buf.last_emitted:
+                    buf.last_emitted = ts
+                    released.append((ts, value))
+            if released:
+                out[key] = released
+        self._nonempty.clear()
+        return out
+
+    def released_through(self, key: Hashable) -> int:
+        """Newest timestamp released for ``key`` (-1 if none)."""
+        buf = self._series.get(key)
+        return -1 if buf is None else buf.last_emitted
+
+    def pending(self) -> int:
+        return sum(len(self._series[key].heap) for key in self._nonempty)
+
+    def stats(self) -> dict:
+        return {"pending": self.pending(), "dropped_late": self.dropped_late}
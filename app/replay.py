@@ -0,0 +1,362 @@
+"""Replay stored history through the change detectors, as fast as possible.
+
+For tuning detector thresholds without waiting for live data. Sources:
+
+* the local archive (``--archive DIR``, see app/archive.py)
+* a file downloaded from ``/export`` in any of its formats (``--export FILE``)
+* the Timescale ``sensor_data`` table (``--timescale URL``)
+
+Each series is one job in a process pool. A job runs vectorized versions of
+the detectors in app/detectors.py over whole arrays: the CUSUM sums are a
+Lindley recursion, ``s = C - min(C)`` over the cumulative sum ``C``, and the
+Page-Hinkley mean is a running or exponentially weighted mean, both plain
+NumPy scans. Python only loops once per alarm (a detector resets after one)
+and once per chunk of samples. The events match what ``DetectorBank`` reports
+live, up to float rounding.
+
+The output is the fault events (JSON lines) and a summary per rule: the event
+count and the detection latency (alarm ts - estimated onset ts) quantiles.
+Rule versions are compared by replaying with different ``--rules`` files,
+JSON objects of per-metric overrides such as ``{"load": {"cusum_h": 10}}``::
+
+    python -m app.replay --archive archive --start 1719792000000 \\
+        --rules rules-v2.json --out events-v2.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app import codec
+from app.archive import Archive
+from app.detectors import DETECTOR_CONFIG, DetectorConfig, Detection, to_event
+from app.faults import FaultEvent
+
+log = logging.getLogger(__name__)
+
+# samples scanned per NumPy call: small right after a reset, when the next
+# alarm may be close (the rest of the chunk is thrown away), growing to CHUNK
+FIRST_CHUNK = 256
+CHUNK = 16_384
+
+
+# ----- Vectorized detectors -----
+
+def _lindley(d: np.ndarray, s0: float) -> np.ndarray:
+    """``s[t] = max(0, s[t-1] + d[t])`` with ``s[-1] = s0``, without a Python loop."""
+    c = np.cumsum(d)
+    return c - np.minimum(np.minimum.accumulate(c), -s0)
+
+
+def _last(mask: np.ndarray, default: int) -> int:
+    hits = np.flatnonzero(mask)
+    return int(hits[-1]) if len(hits) else default
+
+
+def cusum_batch(ts: np.ndarray, x: np.ndarray, cfg: DetectorConfig) -> List[Detection]:
+    """Same alarms as feeding ``x`` to a ``Cusum`` one sample at a time."""
+    out: List[Detection] = []
+    n, w = len(x), max(cfg.warmup, 1)
+    i = 0
+    while i + w <= n:
+        base = x[i:i + w]
+        std = float(base.std(ddof=1)) if w > 1 else 0.0
+        mean, sigma = float(base.mean()), max(std, cfg.min_sigma)
+        i += w
+        s_hi = s_lo = 0.0
+        onset_hi = onset_lo = i
+        alarm = None
+        size = FIRST_CHUNK
+        while i < n and alarm is None:
+            z = (x[i:i + size] - mean) / sigma
+            hi = _lindley(z - cfg.cusum_k, s_hi)
+            lo = _lindley(-z - cfg.cusum_k, s_lo)
+            hits = np.flatnonzero((hi > cfg.cusum_h) | (lo > cfg.cusum_h))
+            end = int(hits[0]) + 1 if len(hits) else len(z)
+            # the onset is the last sample that started from a zero sum
+            onset_hi = i + _last(np.concatenate(([s_hi], hi[:end - 1])) == 0.0, onset_hi - i)
+            onset_lo = i + _last(np.concatenate(([s_lo], lo[:end - 1])) == 0.0, onset_lo - i)
+            if len(hits):
+                t = int(hits[0])
+                if hi[t] > cfg.cusum_h:
+                    alarm = ("up", onset_hi, i + t, float(hi[t]))
+                else:
+                    alarm = ("down", onset_lo, i + t, float(lo[t]))
+            else:
+                s_hi, s_lo = float(hi[-1]), float(lo[-1])
+                i += len(z)
+                size = min(size * 2, CHUNK)
+        if alarm is None:
+            break
+        direction, onset, t, statistic = alarm
+        out.append(Detection(rule="cusum", direction=direction, onset_ts=int(ts[onset]),
+                             ts=int(ts[t]), value=float(x[t]), statistic=statistic))
+        i = t + 1
+    return out
+
+
+def _ph_means(x: np.ndarray, n0: int, m0: float, alpha: float) -> np.ndarray:
+    """Page-Hinkley running means for ``x`` after ``n0`` samples with mean ``m0``.
+
+    The weight is ``min(alpha, 1 - 1/n)``: a plain running mean until ``1/n``
+    drops below ``1 - alpha``, an exponentially weighted one after that.
+    """
+    n = n0 + np.arange(1, len(x) + 1)
+    means = np.empty(len(x))
+    k = int(np.count_nonzero(1.0 - 1.0 / n < alpha))
+    if k:
+        means[:k] = (m0 * n0 + np.cumsum(x[:k])) / n[:k]
+        m0 = means[k - 1]
+    # EWMA in blocks short enough that alpha**-block stays well within float range
+    block = max(1, min(len(x), int(13.8 / -np.log(alpha)))) if alpha < 1 else len(x)
+    for a in range(k, len(x), block):
+        seg = x[a:a + block]
+        p = alpha ** np.arange(1, len(seg) + 1)
+        means[a:a + len(seg)] = p * (m0 + (1 - alpha) * np.cumsum(seg / p))
+        m0 = means[a + len(seg) - 1]
+    return means
+
+
+def page_hinkley_batch(ts: np.ndarray, x: np.ndarray, cfg: DetectorConfig) -> List[Detection]:
+    """Same alarms as feeding ``x`` to a ``PageHinkley`` one sample at a time."""
+    out: List[Detection] = []
+    n_total = len(x)
+    i = 0
+    while i < n_total:
+        # state after a reset
+        count, mean = 0, 0.0
+        m_up = min_up = m_down = max_down = 0.0
+        onset_up = onset_down = i
+        alarm = None
+        size = FIRST_CHUNK
+        while i < n_total and alarm is None:
+            seg = x[i:i + size]
+            means = _ph_means(seg, count, mean, cfg.ph_alpha)
+            up_inc = seg - means - cfg.ph_delta
+            down_inc = seg - means + cfg.ph_delta
+            armed = count + np.arange(1, len(seg) + 1) > cfg.warmup
+            if count == 0:
+                up_inc[0] = down_inc[0] = 0.0  # the first sample only sets the mean
+                armed[0] = False
+            ups = m_up + np.cumsum(up_inc)
+            downs = m_down + np.cumsum(down_inc)
+            prev_min = np.minimum.accumulate(np.concatenate(([min_up], ups)))
+            prev_max = np.maximum.accumulate(np.concatenate(([max_down], downs)))
+            up_stat = ups - prev_min[1:]
+            down_stat = prev_max[1:] - downs
+            hits = np.flatnonzero(armed & ((up_stat > cfg.ph_lambda) | (down_stat > cfg.ph_lambda)))
+            end = int(hits[0]) + 1 if len(hits) else len(seg)
+            onset_up = i + _last(ups[:end] <= prev_min[:end], onset_up - i)
+            onset_down = i + _last(downs[:end] >= prev_max[:end], onset_down - i)
+            if len(hits):
+                t = int(hits[0])
+                if up_stat[t] > cfg.ph_lambda:
+                    alarm = ("up", onset_up, i + t, float(up_stat[t]))
+                else:
+                    alarm = ("down", onset_down, i + t, float(down_stat[t]))
+            else:
+                count += len(seg)
+                mean = float(means[-1])
+                m_up, min_up = float(ups[-1]), float(prev_min[-1])
+                m_down, max_down = float(downs[-1]), float(prev_max[-1])
+                i += len(seg)
+                size = min(size * 2, CHUNK)
+        if alarm is None:
+            break
+        direction, onset, t, statistic = alarm
+        out.append(Detection(rule="page_hinkley", direction=direction, onset_ts=int(ts[onset]),
+                             ts=int(ts[t]), value=float(x[t]), statistic=statistic))
+        i = t + 1
+    return out
+
+
+# ----- Jobs -----
+
+def parse_key(key: str) -> Tuple[int, int, str]:
+    """``sensor:S:device:D:metric`` -> (sensor_id, device_id, metric)."""
+    _, sensor_id, _, device_id, metric = key.split(":", 4)
+    return int(sensor_id), int(device_id), metric
+
+
+def config_for(config: Dict[str, DetectorConfig], metric: str) -> DetectorConfig:
+    return config.get(metric) or config["default"]
+
+
+def detect_series(key: str, ts: np.ndarray, values: np.ndarray,
+                  config: Dict[str, DetectorConfig]) -> List[FaultEvent]:
+    """Run both detectors over one series; events in alarm order."""
+    sensor_id, device_id, metric = parse_key(key)
+    cfg = config_for(config, metric)
+    ts = np.asarray(ts, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    detections = cusum_batch(ts, values, cfg) + page_hinkley_batch(ts, values, cfg)
+    detections.sort(key=lambda det: det.ts)
+    return [to_event(sensor_id, device_id, metric, cfg, det) for det in detections]
+
+
+def _run_job(job: tuple, config: Dict[str, DetectorConfig]) -> Tuple[str, int, List[dict]]:
+    """Process-pool entry point. A job is ``("archive", dir, key, start, end)`` or
+    ``("timescale", url, key, start, end)`` (read in the worker), or
+    ``("arrays", key, ts, values)``."""
+    if job[0] == "archive":
+        _, directory, key, start, end = job
+        ts, values = Archive(directory).read(key, start, end)
+    elif job[0] == "timescale":
+        _, url, key, start, end = job
+        ts, values = asyncio.run(read_timescale(url, key, start, end))
+    else:
+        _, key, ts, values = job
+    events = detect_series(key, ts, values, config)
+    return key, len(ts), [event.model_dump(exclude_none=True) for event in events]
+
+
+def archive_jobs(directory: str, keys: Optional[List[str]], start: int, end: int) -> List[tuple]:
+    keys = keys or Archive(directory).archived_series()
+    return [("archive", directory, key, start, end) for key in keys]
+
+
+def export_jobs(path: str, keys: Optional[List[str]], start: int, end: int) -> List[tuple]:
+    with open(path, "rb") as f:
+        series = codec.decode(f.read())
+    jobs = []
+    for s in series:
+        if keys and s.key not in keys:
+            continue
+        keep = (s.ts >= start) & (s.ts <= end)
+        jobs.append(("arrays", s.key, s.ts[keep], s.values[keep]))
+    return jobs
+
+
+async def timescale_jobs(url: str, keys: Optional[List[str]], start: int, end: int) -> List[tuple]:
+    if not keys:
+        import asyncpg
+
+        conn = await asyncpg.connect(url)
+        try:
+            rows = await conn.fetch("SELECT DISTINCT sensor_id, device_id, metric FROM sensor_data")
+        finally:
+            await conn.close()
+        keys = [f"sensor:{row['sensor_id']}:device:{row['device_id']}:{row['metric']}"
+                for row in rows]
+    return [("timescale", url, key, start, end) for key in keys]
+
+
+async def read_timescale(url: str, key: str, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+    """One series from the ``sensor_data`` table, in time order."""
+    import asyncpg
+
+    sensor_id, device_id, metric = parse_key(key)
+    conn = await asyncpg.connect(url)
+    try:
+        rows = await conn.fetch(
+            "SELECT (extract(epoch FROM time) * 1000)::bigint AS ts, value FROM sensor_data "
+            "WHERE sensor_id = $1 AND device_id = $2 AND metric = $3 "
+            "AND time BETWEEN to_timestamp($4 / 1000.0) AND to_timestamp($5 / 1000.0) "
+            "ORDER BY time",
+            sensor_id, device_id, metric, start, end)
+    finally:
+        await conn.close()
+    ts = np.fromiter((row["ts"] for row in rows), np.int64, len(rows))
+    values = np.fromiter((row["value"] for row in rows), np.float64, len(rows))
+    return ts, values
+
+
+# ----- Engine -----
+
+def load_rules(path: Optional[str]) -> Dict[str, DetectorConfig]:
+    """Detector config with the per-metric overrides from a JSON file applied."""
+    config = dict(DETECTOR_CONFIG)
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+        for metric, fields in overrides.items():
+            config[metric] = config_for(config, metric).model_copy(update=fields)
+    return config
+
+
+def summarize(events: List[dict], samples: int, elapsed: float) -> dict:
+    by_rule: Dict[str, List[int]] = {}
+    for event in events:
+        by_rule.setdefault(event["rule"], []).append(event["end_ts"] - event["start_ts"])
+    rules = {}
+    for rule, latencies in sorted(by_rule.items()):
+        lat = np.array(latencies)
+        rules[rule] = {
+            "events": len(lat),
+            "latency_ms": {"p50": round(float(np.percentile(lat, 50)), 1),
+                           "p95": round(float(np.percentile(lat, 95)), 1),
+                           "max": int(lat.max())},
+        }
+    return {
+        "samples": samples,
+        "events": len(events),
+        "elapsed_s": round(elapsed, 3),
+        "samples_per_s": round(samples / elapsed) if elapsed > 0 else None,
+        "rules": rules,
+    }
+
+
+def replay(jobs: Iterable[tuple], config: Optional[Dict[str, DetectorConfig]] = None,
+           workers: Optional[int] = None) -> Tuple[List[dict], dict]:
+    """Run the jobs across ``workers`` processes; returns (events, summary)."""
+    config = config or DETECTOR_CONFIG
+    jobs = list(jobs)
+    started = time.perf_counter()
+    events: List[dict] = []
+    samples = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        for key, n, series_events in pool.map(_run_job, jobs, [config] * len(jobs)):
+            samples += n
+            events.extend(series_events)
+    events.sort(key=lambda event: (event["end_ts"], event["sensor_id"], event["rule"]))
+    return events, summarize(events, samples, time.perf_counter() - started)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--archive", help="archive directory")
+    source.add_argument("--export", help="file downloaded from /export")
+    source.add_argument("--timescale", help="Postgres URL of the sensor_data table")
+    parser.add_argument("--series", action="append",
+                        help="sensor_id:device_id:metric (repeatable; default: all)")
+    parser.add_argument("--start", type=int, default=0, help="epoch ms")
+    parser.add_argument("--end", type=int, default=2 ** 62, help="epoch ms")
+    parser.add_argument("--rules", help="JSON file of per-metric detector overrides")
+    parser.add_argument("--workers", type=int, help="processes (default: all cores)")
+    parser.add_argument("--out", help="write events here as JSON lines")
+    args = parser.parse_args(argv)
+
+    keys = None
+    if args.series:
+        keys = []
+        for s in args.series:
+            sensor_id, device_id, metric = s.split(":")
+            keys.append(f"sensor:{int(sensor_id)}:device:{int(device_id)}:{metric}")
+    if args.archive:
+        jobs = archive_jobs(args.archive, keys, args.start, args.end)
+    elif args.export:
+        jobs = export_jobs(args.export, keys, args.start, args.end)
+    else:
+        jobs = asyncio.run(timescale_jobs(args.timescale, keys, args.start, args.end))
+
+    events, summary = replay(jobs, load_rules(args.rules), args.workers)
+    if args.out:
+        with open(args.out, "w") as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Per-bucket aggregates for range statistics.
+
+Every sample is folded into one open bucket per level (by default 1 minute,
+1 hour and 1 day). A bucket holds count, mean and sum of squared deviations
+(Welford's update, merged with Chan's formula, so a large mean with a small
+spread keeps its variance), min, max and a quantile sketch, and all of these
+can be merged. When a sample lands in a
+later bucket, the previous one is closed and written to Redis. Each series has
+one sorted set per level, scored by bucket start, stored next to the series
+(same shard).
+
+A range query covers whole days with day buckets, the rest with hour
+buckets, and the remaining edges with minute buckets. So a day costs at most
+about 24 + 2*60 reads whatever the sample rate, and a month about the same.
+Ranges are widened to whole minutes. Buckets that are still open are read
+from the ingest workers' memory.
+
+The sketch is a DDSketch-style log histogram: quantiles come with a relative
+error of at most ``alpha``, and merging adds bin counts.
+"""
+import math
+import os
+import struct
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import msgpack
+
+SKETCH_ALPHA = 0.01
+_MIN_ABS = 1e-9  # smaller magnitudes count as zero
+
+
+class QuantileSketch:
+    __slots__ = ("alpha", "_log_gamma", "pos", "neg", "zero")
+
+    def __init__(self, alpha: float = SKETCH_ALPHA):
+        self.alpha = alpha
+        self._log_gamma = math.log((1 + alpha) / (1 - alpha))
+        self.pos: Dict[int, int] = {}
+        self.neg: Dict[int, int] = {}
+        self.zero = 0
+
+    def add(self, x: float, n: int = 1):
+        if x > _MIN_ABS:
+            k = math.ceil(math.log(x) / self._log_gamma)
+            self.pos[k] = self.pos.get(k, 0) + n
+        elif x < -_MIN_ABS:
+            k = math.ceil(math.log(-x) / self._log_gamma)
+            self.neg[k] = self.neg.get(k, 0) + n
+        else:
+            self.zero += n
+
+    def merge(self, other: "QuantileSketch"):
+        if other.alpha != self.alpha:
+            raise ValueError("Can't merge sketches with different accuracy")
+        for k, n in other.pos.items():
+            self.pos[k] = self.pos.get(k, 0) + n
+        for k, n in other.neg.items():
+            self.neg[k] = self.neg.get(k, 0) + n
+        self.zero += other.zero
+
+    def _value(self, k: int) -> float:
+        gamma = math.exp(self._log_gamma)
+        return 2 * gamma ** k / (gamma + 1)
+
+    def quantiles(self, qs: Sequence[float], count: int) -> List[Optional[float]]:
+        """Values at the given quantiles (0..1) in one pass over the bins."""
+        if count == 0:
+            return [None] * len(qs)
+        # bins from the most negative value to the most positive
+        bins = [(-self._value(k), n) for k, n in sorted(self.neg.items(), reverse=True)]
+        if self.zero:
+            bins.append((0.0, self.zero))
+        bins.extend((self._value(k), n) for k, n in sorted(self.pos.items()))
+
+        order = sorted(range(len(qs)), key=lambda i: qs[i])
+        out: List[Optional[float]] = [None] * len(qs)
+        seen, b = 0, 0
+        for i in order:
+            rank = qs[i] * (count - 1)
+            while b < len(bins) - 1 and seen + bins[b][1] <= rank:
+                seen += bins[b][1]
+                b += 1
+            out[i] = bins[b][0]
+        return out
+
+
+class Aggregate:
+    __slots__ = ("count", "mean", "m2", "min", "max", "sketch")
+
+    def __init__(self, alpha: float = SKETCH_ALPHA):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch(alpha)
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        self.sketch.add(x)
+
+    def merge(self, other: "Aggregate"):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+
+    def summary(self, qs: Sequence[float]) -> dict:
+        if self.count == 0:
+            return {"count": 0}
+        # the sketch is exact to alpha; clamp to the exact extremes
+        values = [min(max(v, self.min), self.max) for v in self.sketch.quantiles(qs, self.count)]
+        return {
+            "count": self.count, "mean": self.mean, "std": math.sqrt(self.m2 / self.count),
+            "min": self.min, "max": self.max,
+            "quantiles": {str(q): v for q, v in zip(qs, values)},
+        }
+
+    def to_bytes(self) -> bytes:
+        s = self.sketch
+        return msgpack.packb([
+            self.count, self.mean, self.m2, self.min, self.max,
+            s.alpha, s.zero, list(s.pos.items()), list(s.neg.items()),
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Aggregate":
+        count, mean, m2, lo, hi, alpha, zero, pos, neg = msgpack.unpackb(data)
+        agg = cls(alpha)
+        agg.count, agg.mean, agg.m2, agg.min, agg.max = count, mean, m2, lo, hi
+        agg.sketch.zero = zero
+        agg.sketch.pos = dict(pos)
+        agg.sketch.neg = dict(neg)
+        return agg
+
+
+def rollup_key(series: str, level_ms: int) -> str:
+    # keeps the series prefix so it is sharded with the series (see shards.shard_key)
+    return f"{series}:rollup:{level_ms}"
+
+
+# a bucket can be written more than once (e.g. flushed on shutdown and continued
+# after a restart), so members get a random tag and partial buckets are merged on read
+_MEMBER = struct.Struct(">q4s")
+
+
+def encode_member(start: int, agg: Aggregate) -> bytes:
+    return _MEMBER.pack(start, os.urandom(4)) + agg.to_bytes()
+
+
+def decode_member(member: bytes) -> Tuple[int, Aggregate]:
+    start, _ = _MEMBER.unpack_from(member)
+    return start, Aggregate.from_bytes(member[_MEMBER.size:])
+
+
+Closed = Tuple[str, int, int, Aggregate]  # (series, level, bucket start, aggregate)
+
+
+class Rollup:
+    """Open buckets of the series owned by one ingest worker."""
+
+    def __init__(self, levels: Sequence[int], alpha: float = SKETCH_ALPHA):
+        self.levels = sorted(levels)
+        self.alpha = alpha
+        self._open: Dict[Tuple[str, int], Tuple[int, Aggregate]] = {}
+
+    def add(self, series: str, ts: int, value: float) -> List[Closed]:
+        """Fold a sample into its buckets; returns buckets that closed because of it."""
+        closed = []
+        for level in self.levels:
+            start = ts - ts % level
+            entry = self._open.get((series, level))
+            if entry is None or entry[0] != start:
+                if entry is not None:
+                    closed.append((series, level, entry[0], entry[1]))
+                entry = self._open[(series, level)] = (start, Aggregate(self.alpha))
+            entry[1].add(value)
+        return closed
+
+    def open_bucket(self, series: str, level: int) -> Optional[Tuple[int, Aggregate]]:
+        return self._open.get((series, level))
+
+    def flush(self) -> List[Closed]:
+        closed = [(series, level, start, agg) for (series, level), (start, agg) in self._open.items()]
+        self._open.clear()
+        return closed
+
+
+def write_closed(pipe, closed: Iterable[Closed], retention: Dict[int, int]):
+    """Queue closed buckets (and trimming of expired ones) on a Redis pipeline."""
+    for series, level, start, agg in closed:
+        key = rollup_key(series, level)
+        pipe.execute_command("ZADD", key, start, encode_member(start, agg))
+        keep = retention.get(level)
+        if keep:
+            pipe.execute_command("ZREMRANGEBYSCORE", key, "-inf", f"({start - keep}")
+
+
+def plan(start: int, end: int, levels: Sequence[int]) -> List[Tuple[int, int, int]]:
+    """Split ``[start, end)`` into ``(level, first bucket, last bucket)`` ranges,
+    using the coarsest buckets that fit. ``start``/``end`` must be aligned to the
+    finest level, and each level must divide the next."""
+    if start >= end:
+        return []
+    if not levels:
+        raise ValueError("No rollup levels")
+    *finer, level = levels
+    lo = -(-start // level) * level
+    hi = end - end % level
+    if not finer:
+        return [(level, lo, hi - level)] if lo < hi else []
+    if lo >= hi:
+        return plan(start, end, finer)
+    return plan(start, lo, finer) + [(level, lo, hi - level)] + plan(hi, end, finer)
+
+
+async def range_stats(r, series_keys: List[str], start: int, end: int, levels: Sequence[int],
+                      open_buckets: Callable[[str, int], Iterable[Tuple[int, Aggregate]]],
+                      alpha: float = SKETCH_ALPHA) -> Tuple[int, int, List[Aggregate]]:
+    """Merge the buckets covering ``[start, end)`` for each series.
+
+    Returns the range actually covered (widened to the finest level) and one
+    aggregate per series.
+    """
+    levels = sorted(levels)
+    finest = levels[0]
+    start -= start % finest
+    end = -(-end // finest) * finest
+    ranges = plan(start, end, levels)
+
+    pipe = r.pipeline(transaction=False)
+    for key in series_keys:
+        for level, lo, hi in ranges:
+            pipe.execute_command("ZRANGEBYSCORE", rollup_key(key, level), lo, hi)
+    replies = iter(await pipe.execute())
+
+    results = []
+    for key in series_keys:
+        agg = Aggregate(alpha)
+        for level, lo, hi in ranges:
+            for member in next(replies):
+                agg.merge(decode_member(member)[1])
+            for bucket_start, bucket in open_buckets(key, level):
+                if lo <= bucket_start <= hi:
+                    agg.merge(bucket)
+        results.append(agg)
+    return start, end, results
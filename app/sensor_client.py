@@ -0,0 +1,316 @@
+"""Asyncio sensor client with pipelined, batched sends and an offline spool.
+
+Readings passed to ``AsyncSensorClient.send`` are grouped into frames (a JSON
+list of payloads) and sent without waiting for each reply; up to
+``max_in_flight`` frames may be unacknowledged at once. The server answers
+every frame in order, so replies are matched to the oldest in-flight frame.
+
+While the server is unreachable, and until the backlog has been sent after a
+reconnect, readings are appended to a local ``Spool`` file instead of being
+dropped. On reconnect the spool is drained in full-size frames before any new
+readings go out, so the server sees readings in the order they were taken.
+
+With nothing to send for ``heartbeat_interval`` seconds the client sends an
+empty frame, so the server doesn't close the connection as dead. If the
+server closes it as idle (no readings for a long time), the client
+reconnects once there is a reading to send.
+
+Example::
+
+    client = AsyncSensorClient("ws://localhost:8000/ws")
+    asyncio.create_task(client.run())
+    await client.send({"sensor_type": "distance", ...})
+"""
+import asyncio
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+from collections import deque
+from typing import List, Optional, Tuple
+
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed, WebSocketException
+
+logger = logging.getLogger(__name__)
+
+_LEN = struct.Struct("<I")
+
+
+class Spool:
+    """Append-only file of length-prefixed JSON records.
+
+    The read position is kept in ``<path>.offset`` and only advanced once the
+    server has acknowledged the records, so nothing is lost if the process
+    dies mid-drain. The file is truncated once everything has been sent.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._offset_path = path + ".offset"
+        self._file = open(path, "ab")
+        self.offset = 0
+        if os.path.exists(self._offset_path):
+            with open(self._offset_path) as f:
+                self.offset = int(f.read().strip() or 0)
+        self._drop_partial_tail()
+        self.offset = min(self.offset, self.size())
+
+    def _drop_partial_tail(self):
+        """Cut off a record left half-written by a crash during append."""
+        end = self.size()
+        if end == 0:
+            return
+        pos = 0
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ) as m:
+            while pos + 4 <= end:
+                (n,) = _LEN.unpack_from(m, pos)
+                if pos + 4 + n > end:
+                    break
+                pos += 4 + n
+        if pos < end:
+            self._file.truncate(pos)
+            self._file.seek(pos)
+
+    def size(self) -> int:
+        return self._file.tell()
+
+    def pending(self) -> bool:
+        return self.size() > self.offset
+
+    def append(self, records: List[dict]):
+        buf = bytearray()
+        for record in records:
+            data = json.dumps(record).encode()
+            buf += _LEN.pack(len(data))
+            buf += data
+        self._file.write(buf)
+        self._file.flush()
+
+    def read(self, start: int, max_records: int) -> Tuple[List[dict], int]:
+        """Read up to ``max_records`` starting at byte ``start``; returns (records, end offset)."""
+        end = self.size()
+        if start >= end:
+            return [], start
+        records = []
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ) as m:
+            pos = start
+            while pos < end and len(records) < max_records:
+                (n,) = _LEN.unpack_from(m, pos)
+                if pos + 4 + n > end:
+                    break  # partial record from a crash mid-append
+                records.append(json.loads(m[pos + 4:pos + 4 + n]))
+                pos += 4 + n
+        return records, pos
+
+    def commit(self, offset: int):
+        """Mark everything before ``offset`` as delivered."""
+        self.offset = offset
+        if offset >= self.size():
+            self._file.truncate(0)
+            self._file.seek(0)
+            self.offset = 0
+        tmp = self._offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(self.offset))
+        os.replace(tmp, self._offset_path)
+
+    def close(self):
+        self._file.close()
+
+
+class _Frame:
+    __slots__ = ("records", "spool_end")
+
+    def __init__(self, records: List[dict], spool_end: Optional[int] = None):
+        self.records = records
+        self.spool_end = spool_end  # spool offset to commit on ack, None for live frames
+
+
+class AsyncSensorClient:
+    def __init__(self, uri: str, spool_path: str = "sensor_spool.bin", batch_size: int = 100,
+                 max_in_flight: int = 8, linger: float = 0.05, queue_size: int = 10_000,
+                 initial_backoff: float = 1, max_backoff: float = 60,
+                 heartbeat_interval: float = 20):
+        self.uri = uri
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.linger = linger
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.heartbeat_interval = heartbeat_interval
+        self.spool = Spool(spool_path)
+        self._queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=queue_size)
+        self._in_flight: deque[_Frame] = deque()
+        self._batch: List[dict] = []
+        self._window = asyncio.Semaphore(max_in_flight)
+        self._spool_read = self.spool.offset
+        self._last_sent = 0.0
+        self._has_readings = asyncio.Event()
+        self.connected = False
+        self.sent = 0
+        self.acked = 0
+        self.rejected = 0
+
+    async def send(self, reading: dict):
+        """Queue a reading. Never blocks on the network."""
+        self._has_readings.set()
+        if not self.connected or self.spool.pending():
+            self.spool.append([reading])
+            return
+        try:
+            self._queue.put_nowait(reading)
+        except asyncio.QueueFull:
+            # keep order: everything queued goes to the spool ahead of this reading
+            backlog = []
+            while not self._queue.empty():
+                backlog.append(self._queue.get_nowait())
+            backlog.append(reading)
+            self.spool.append(backlog)
+
+    # ----- Connection loop -----
+
+    async def run(self):
+        retry_count = 0
+        while True:
+            websocket = None
+            try:
+                logger.info(f"Connecting to {self.uri}")
+                async with connect(self.uri) as websocket:
+                    logger.info("Connected")
+                    retry_count = 0
+                    self.connected = True
+                    await self._session(websocket)
+            except (ConnectionClosed, WebSocketException, OSError) as e:
+                logger.warning(f"Connection error: {e}")
+            finally:
+                self._on_disconnect()
+
+            idle = websocket is not None and websocket.close_code == 1000 \
+                and websocket.close_reason == "idle"
+            if idle and not self.spool.pending():
+                logger.info("Closed as idle by the server; reconnecting on the next reading")
+                self._has_readings.clear()
+                await self._has_readings.wait()
+                continue
+
+            backoff = min(self.initial_backoff * (2 ** retry_count), self.max_backoff)
+            backoff += random.uniform(0.1, 0.5) * backoff
+            retry_count += 1
+            logger.info(f"Retrying in {backoff:.2f} seconds...")
+            await asyncio.sleep(backoff)
+
+    def _on_disconnect(self):
+        self.connected = False
+        # unacked live frames and anything still queued go to the spool;
+        # unacked spool frames will simply be re-read from the last commit
+        live = [r for frame in self._in_flight if frame.spool_end is None for r in frame.records]
+        live.extend(self._batch)
+        self._batch = []
+        while not self._queue.empty():
+            live.append(self._queue.get_nowait())
+        if live:
+            self.spool.append(live)
+        self._in_flight.clear()
+        self._window = asyncio.Semaphore(self.max_in_flight)
+        self._spool_read = self.spool.offset
+
+    async def _session(self, websocket):
+        self._last_sent = asyncio.get_running_loop().time()
+        sender = asyncio.create_task(self._sender(websocket))
+        receiver = asyncio.create_task(self._receiver(websocket))
+        try:
+            done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in (sender, receiver):
+                task.cancel()
+            await asyncio.gather(sender, receiver, return_exceptions=True)
+
+    async def _send_frame(self, websocket, frame: _Frame):
+        await self._window.acquire()
+        self._in_flight.append(frame)
+        if frame.spool_end is None:
+            self._batch = []
+        await websocket.send(json.dumps(frame.records))
+        self._last_sent = asyncio.get_running_loop().time()
+        self.sent += len(frame.records)
+
+    async def _sender(self, websocket):
+        while True:
+            # drain the spool at full speed first
+            if self.spool.pending():
+                records, end = self.spool.read(self._spool_read, self.batch_size)
+                if records:
+                    self._spool_read = end
+                    await self._send_frame(websocket, _Frame(records, spool_end=end))
+                    continue
+                if self._in_flight:
+                    # wait for outstanding spool frames to be acked
+                    await asyncio.sleep(self.linger)
+                    continue
+
+            # readings taken off the queue live in self._batch until they are
+            # in flight, so a disconnect at any await below can spool them
+            try:
+                self._batch.append(await asyncio.wait_for(self._queue.get(), timeout=self.linger))
+            except asyncio.TimeoutError:
+                if asyncio.get_running_loop().time() - self._last_sent >= self.heartbeat_interval:
+                    # an empty frame keeps the server from timing the connection out
+                    await self._send_frame(websocket, _Frame([]))
+                continue
+            deadline = asyncio.get_running_loop().time() + self.linger
+            while len(self._batch) < self.batch_size:
+                if self._queue.empty():
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        self._batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    self._batch.append(self._queue.get_nowait())
+            await self._send_frame(websocket, _Frame(self._batch))
+
+    async def _receiver(self, websocket):
+        async for reply in websocket:
+            if not self._in_flight:
+                logger.warning(f"Unexpected reply: {reply}")
+                continue
+            frame = self._in_flight.popleft()
+            self._window.release()
+            if isinstance(reply, str) and reply.startswith("error"):
+                # the server rejected the frame's contents; resending won't help
+                self.rejected += len(frame.records)
+                logger.error(f"Frame of {len(frame.records)} readings rejected: {reply}")
+            else:
+                self.acked += len(frame.records)
+            if frame.spool_end is not None:
+                self.spool.commit(frame.spool_end)
+                if not self.spool.pending():
+                    self._spool_read = 0
+
+
+async def main():
+    from app.sensors import get_timestamp, periodic_step_function
+
+    client = AsyncSensorClient("ws://localhost:8000/ws")
+    asyncio.create_task(client.run())
+    while True:
+        await client.send({
+            "sensor_type": "distance",
+            "sensor_id": 6,
+            "device_id": 2,
+            "timestamp": get_timestamp(),
+            "data": {"distance": periodic_step_function()},
+            "status": "active",
+        })
+        await asyncio.sleep(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -8,6 +8,9 @@ import pydantic
 import random
 from websockets.exceptions import ConnectionClosedError, ConnectionClosedOK, WebSocketException
 import logging
+import sys
+
+from app.compression import SwingingDoor, COMPRESSION_TOLERANCES
 
 keys = [
     "sensor:1:device:1:position",
@@ -116,13 +119,27 @@ def get_timestamp() -> str:
     else:
         raise ValueError("Invalid timestamp type. Use 'iso' or 'epoch'.")
 
+def format_timestamp(ts_ms: int) -> str:
+    """Format an epoch-ms timestamp the same way get_timestamp does."""
+    if TIMESTAMP_TYPE == "iso":
+        return datetime.datetime.fromtimestamp(ts_ms / 1000, datetime.timezone.utc).isoformat()
+    elif TIMESTAMP_TYPE == "epoch":
+        return str(ts_ms)
+    else:
+        raise ValueError("Invalid timestamp type. Use 'iso' or 'epoch'.")
+
 class WebSocketClient:
-    def __init__(self, uri, max_retries=5, initial_backoff=1, max_backoff=60):
+    def __init__(self, uri, max_retries=5, initial_backoff=1, max_backoff=60, compressor=None,
+                 heartbeat_interval=20):
         self.uri = uri
         self.max_retries = max_retries
         self.initial_backoff = initial_backoff
         self.max_backoff = max_backoff
         self.retry_count = 0
+        # optional Deadband/SwingingDoor; only the points it keeps are sent
+        self.compressor = compressor
+        # with nothing to send for this long, an empty frame tells the server we're alive
+        self.heartbeat_interval = heartbeat_interval
     
     def get_backoff_time(self):
         """Calculate exponential backoff with jitter"""
@@ -168,26 +185,46 @@ class WebSocketClient:
                 with connect(self.uri) as websocket:
                     logger.info("Connected successfully!")
                     self.retry_count = 0  # Reset retry count on successful connection
-                    
+                    last_sent = time.monotonic()
+
                     while True:
-                        # Prepare your data
-                        axisData = AxisData(
-                            sensor_id=6,
-                            device_id=2,
-                            timestamp=get_timestamp(),
-                            data={"distance": periodic_step_function()},
-                            status="active"
-                        )
-                        
-                        # Send data
-                        if not self.send_data_safely(websocket, axisData.model_dump()):
-                            break  # Connection issue, will reconnect
-                        
-                        # Receive response
-                        response = self.receive_data_safely(websocket)
-                        if response is None:
-                            break  # Connection issue, will reconnect
-                        
+                        ts_ms = int(time.time() * 1000)
+                        value = periodic_step_function()
+                        if self.compressor is not None:
+                            points = self.compressor.offer(ts_ms, value)
+                        else:
+                            points = [(ts_ms, value)]
+
+                        sent = True
+                        for point_ts, point_value in points:
+                            # Prepare your data
+                            axisData = AxisData(
+                                sensor_id=6,
+                                device_id=2,
+                                timestamp=format_timestamp(point_ts),
+                                data={"distance": point_value},
+                                status="active"
+                            )
+
+                            # Send data
+                            if not self.send_data_safely(websocket, axisData.model_dump()):
+                                sent = False
+                                break  # Connection issue, will reconnect
+
+                            # Receive response
+                            response = self.receive_data_safely(websocket)
+                            if response is None:
+                                sent = False
+                                break  # Connection issue, will reconnect
+                            last_sent = time.monotonic()
+                        if sent and not points and time.monotonic() - last_sent >= self.heartbeat_interval:
+                            # heartbeat: an empty frame, answered like any other
+                            sent = self.send_data_safely(websocket, []) and \
+                                self.receive_data_safely(websocket) is not None
+                            last_sent = time.monotonic()
+                        if not sent:
+                            break
+
                         time.sleep(1)
             
             except (ConnectionClosedError, ConnectionClosedOK) as e:
@@ -209,9 +246,19 @@ class WebSocketClient:
                 logger.error("Max retries reached, giving up")
                 break
 
+# Sending only the points a swinging door keeps (--compress) leaves gaps of up to
+# COMPRESSION_MAX_GAP_MS on flat stretches; the server's stale-sensor watchdog
+# needs WATCHDOG_MIN_TIMEOUT_MS above that, or it reports the sensor silent.
+# Heartbeats keep the connection open meanwhile.
+COMPRESSION_MAX_GAP_MS = 60_000
+
+
 def main():
     uri = "ws://localhost:8000/ws"
-    client = WebSocketClient(uri)
+    compressor = None
+    if "--compress" in sys.argv[1:]:
+        compressor = SwingingDoor(COMPRESSION_TOLERANCES["distance"], max_gap_ms=COMPRESSION_MAX_GAP_MS)
+    client = WebSocketClient(uri, compressor=compressor)
     client.run()
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+"""Redis TimeSeries spread over several nodes.
+
+Series keys are placed on a consistent-hash ring by device id, so all series of
+one device live on the same node and adding a node only moves about 1/N of
+the devices. Every node gets its own connection pool.
+
+``ShardedRedis`` mimics the small part of ``redis.asyncio.Redis`` that the app
+uses: ``execute_command`` is routed by its key argument, and ``pipeline()``
+returns a pipeline that splits commands per node and runs the node pipelines
+in parallel, returning results in the original order.
+
+To try it locally, start a few servers and list them in the settings::
+
+    redis-stack-server --port 6380 &  redis-stack-server --port 6381 &
+    REDIS_URLS='["redis://localhost:6380", "redis://localhost:6381"]' fastapi dev app/main.py
+"""
+import asyncio
+import bisect
+import hashlib
+from typing import Dict, List, Sequence, Tuple
+
+import redis.asyncio as redis
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def shard_key(key: str) -> str:
+    """Part of a key that decides its node: the device for sensor series."""
+    parts = key.split(":")
+    if len(parts) >= 4 and parts[0] == "sensor" and parts[2] == "device":
+        return f"device:{parts[3]}"
+    return key
+
+
+class HashRing:
+    def __init__(self, nodes: Sequence[str], vnodes: int = 160):
+        ring = sorted((_hash(f"{node}#{i}"), n) for n, node in enumerate(nodes) for i in range(vnodes))
+        self._points = [point for point, _ in ring]
+        self._nodes = [n for _, n in ring]
+
+    def node_index(self, value: str) -> int:
+        i = bisect.bisect(self._points, _hash(value)) % len(self._points)
+        return self._nodes[i]
+
+
+class ShardedPipeline:
+    def __init__(self, sharded: "ShardedRedis"):
+        self.sharded = sharded
+        self._pipes: Dict[int, redis.client.Pipeline] = {}
+        self._order: List[Tuple[int, int]] = []  # (node, position in that node's pipeline)
+        self.commands: List[tuple] = []  # queued command args, in order
+
+    def execute_command(self, *args, **options):
+        n = self.sharded.node_index(args[1])
+        pipe = self._pipes.get(n)
+        if pipe is None:
+            pipe = self._pipes[n] = self.sharded.nodes[n].pipeline(transaction=False)
+        self._order.append((n, len(pipe)))
+        self.commands.append(args)
+        pipe.execute_command(*args, **options)
+        return self
+
+    def __len__(self):
+        return len(self._order)
+
+    async def execute(self, raise_on_error: bool = True) -> list:
+        nodes = list(self._pipes)
+        replies = await asyncio.gather(
+            *(self._pipes[n].execute(raise_on_error=False) for n in nodes),
+            return_exceptions=True,
+        )
+        by_node = dict(zip(nodes, replies))
+        results = []
+        for n, i in self._order:
+            reply = by_node[n]
+            # a whole node pipeline can fail (e.g. connection refused)
+            results.append(reply if isinstance(reply, BaseException) else reply[i])
+        self._pipes, self._order, self.commands = {}, [], []
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+        return results
+
+
+class ShardedRedis:
+    def __init__(self, urls: Sequence[str], max_connections: int = 50, vnodes: int = 160):
+        if not urls:
+            raise ValueError("At least one Redis URL is required")
+        self.urls = list(urls)
+        self.nodes = [
+            redis.Redis(connection_pool=redis.BlockingConnectionPool.from_url(
+                url, max_connections=max_connections))
+            for url in self.urls
+        ]
+        self.ring = HashRing(self.urls, vnodes)
+
+    def node_index(self, key) -> int:
+        if len(self.nodes) == 1:
+            return 0
+        if isinstance(key, bytes):
+            key = key.decode()
+        return self.ring.node_index(shard_key(str(key)))
+
+    def node_for(self, key) -> redis.Redis:
+        return self.nodes[self.node_index(key)]
+
+    async def execute_command(self, *args, **options):
+        return await self.node_for(args[1]).execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = False) -> ShardedPipeline:
+        if transaction:
+            raise ValueError("Transactions can't span shards")
+        return ShardedPipeline(self)
+
+    async def time(self):
+        return await self.nodes[0].time()
+
+    async def aclose(self):
+        await asyncio.gather(*(node.aclose() for node in self.nodes))
@@ -0,0 +1,213 @@
+"""Spectral vibration features for acceleration and load.
+
+Ingest only appends each sample to a per-series ring buffer (O(1)). Every
+``hop`` samples the last ``window`` samples are queued for the series' device.
+A background task stacks the queued windows of each device into one 2-D array,
+puts it in a shared-memory block and hands the block to a process pool, where
+the FFT and band energies are computed for all windows at once. The results
+come back through the same block and are written as derived series, e.g.
+``sensor:3:device:1:acceleration:band0``.
+
+Nothing here runs FFTs on the event loop, so /ws and /ws_dashboard are not
+held up while analysis runs.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+SPECTRAL_METRICS = ("acceleration", "load")
+
+# band edges as fractions of the Nyquist frequency
+DEFAULT_BANDS = ((0.0, 0.1), (0.1, 0.25), (0.25, 0.5), (0.5, 1.0))
+
+# rms, peak frequency (Hz), then one energy per band
+BASE_FEATURES = ("rms", "peak_hz")
+
+
+def feature_names(bands=DEFAULT_BANDS) -> Tuple[str, ...]:
+    return BASE_FEATURES + tuple(f"band{i}" for i in range(len(bands)))
+
+
+def compute_features(values: np.ndarray, ts: np.ndarray, bands=DEFAULT_BANDS) -> np.ndarray:
+    """Features for a batch of windows.
+
+    values, ts: (n_windows, window) arrays of samples and their ms timestamps.
+    Returns an (n_windows, n_features) float64 array, see ``feature_names``.
+    """
+    n, window = values.shape
+    x = values - values.mean(axis=1, keepdims=True)
+    spectrum = np.abs(np.fft.rfft(x * np.hanning(window), axis=1)) ** 2
+    n_bins = spectrum.shape[1]
+
+    out = np.empty((n, len(BASE_FEATURES) + len(bands)))
+    out[:, 0] = np.sqrt(np.mean(x * x, axis=1))
+    # sample rate per window from its own timestamps
+    span_s = (ts[:, -1] - ts[:, 0]) / 1000.0
+    fs = np.where(span_s > 0, (window - 1) / np.where(span_s > 0, span_s, 1.0), 0.0)
+    peak_bin = np.argmax(spectrum[:, 1:], axis=1) + 1
+    out[:, 1] = peak_bin * fs / window
+    total = spectrum[:, 1:].sum(axis=1)
+    total = np.where(total > 0, total, 1.0)
+    for i, (lo, hi) in enumerate(bands):
+        a = max(1, int(lo * (n_bins - 1)))
+        b = max(a + 1, int(hi * (n_bins - 1)) + (1 if hi >= 1.0 else 0))
+        out[:, 2 + i] = spectrum[:, a:b].sum(axis=1) / total
+    return out
+
+
+def _features_in_shm(name: str, n: int, window: int, n_features: int, bands) -> None:
+    """Process-pool entry point: read windows from shared memory, write features back.
+
+    Block layout: float64 values[n, window] | int64 ts[n, window] | float64 out[n, n_features]
+    """
+    # pool workers are spawned and share the parent's resource tracker, so
+    # attaching here does not take ownership; the parent unlinks the block
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        values = np.ndarray((n, window), np.float64, shm.buf, 0)
+        ts = np.ndarray((n, window), np.int64, shm.buf, values.nbytes)
+        out = np.ndarray((n, n_features), np.float64, shm.buf, values.nbytes + ts.nbytes)
+        out[:] = compute_features(values, ts, bands)
+        del values, ts, out
+    finally:
+        shm.close()
+
+
+class _Ring:
+    """Fixed-size ring buffer of (ts, value) for one series."""
+
+    __slots__ = ("ts", "values", "pos", "count", "since_emit")
+
+    def __init__(self, size: int):
+        self.ts = np.zeros(size, np.int64)
+        self.values = np.zeros(size, np.float64)
+        self.pos = 0
+        self.count = 0
+        self.since_emit = 0
+
+    def append(self, ts: int, value: float):
+        self.ts[self.pos] = ts
+        self.values[self.pos] = value
+        self.pos = (self.pos + 1) % len(self.ts)
+        self.count += 1
+        self.since_emit += 1
+
+    def last(self) -> Tuple[np.ndarray, np.ndarray]:
+        idx = np.arange(self.pos, self.pos + len(self.ts)) % len(self.ts)
+        return self.ts[idx], self.values[idx]
+
+
+SeriesId = Tuple[int, int, str]  # (sensor_id, device_id, metric)
+
+
+class SpectralAnalyzer:
+    def __init__(self, redis_client, window: int = 256, hop: int = 128, workers: int = 2,
+                 interval: float = 1.0, max_pending: int = 10_000, retention_ms: int = 600_000,
+                 bands=DEFAULT_BANDS):
+        self.r = redis_client
+        self.window = window
+        self.hop = hop
+        self.workers = workers
+        self.interval = interval
+        self.max_pending = max_pending
+        self.retention_ms = retention_ms
+        self.bands = bands
+        self.features = feature_names(bands)
+        self._rings: Dict[SeriesId, _Ring] = {}
+        # device_id -> queued windows as (series, ts, values)
+        self._pending: Dict[int, List[Tuple[SeriesId, np.ndarray, np.ndarray]]] = {}
+        self._n_pending = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.processed = 0
+
+    # ----- Ingest side -----
+
+    def add(self, sensor_id: int, device_id: int, metric: str, ts: int, value: float):
+        if metric not in SPECTRAL_METRICS:
+            return
+        sid = (sensor_id, device_id, metric)
+        ring = self._rings.get(sid)
+        if ring is None:
+            ring = self._rings[sid] = _Ring(self.window)
+        ring.append(ts, value)
+        if ring.count >= self.window and ring.since_emit >= self.hop:
+            ring.since_emit = 0
+            if self._n_pending >= self.max_pending:
+                self.dropped += 1
+                return
+            ts_w, values_w = ring.last()
+            self._pending.setdefault(device_id, []).append((sid, ts_w, values_w))
+            self._n_pending += 1
+
+    # ----- Analysis side -----
+
+    async def start(self):
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._pending:
+                continue
+            batches, self._pending, self._n_pending = self._pending, {}, 0
+            results = await asyncio.gather(
+                *(self._analyze(windows) for windows in batches.values()),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    log.error(f"Spectral analysis failed: {result}")
+
+    async def _analyze(self, windows: List[Tuple[SeriesId, np.ndarray, np.ndarray]]):
+        n, window, n_features = len(windows), self.window, len(self.features)
+        size = n * window * 16 + n * n_features * 8
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            values = np.ndarray((n, window), np.float64, shm.buf, 0)
+            ts = np.ndarray((n, window), np.int64, shm.buf, values.nbytes)
+            for i, (_, ts_w, values_w) in enumerate(windows):
+                ts[i] = ts_w
+                values[i] = values_w
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                self._pool, _features_in_shm, shm.name, n, window, n_features, self.bands)
+            out = np.ndarray((n, n_features), np.float64, shm.buf, values.nbytes + ts.nbytes).copy()
+            end_ts = ts[:, -1].copy()
+            del values, ts
+        finally:
+            shm.close()
+            shm.unlink()
+
+        pipe = self.r.pipeline(transaction=False)
+        for (sid, _, _), t, row in zip(windows, end_ts.tolist(), out.tolist()):
+            sensor_id, device_id, metric = sid
+            for name, value in zip(self.features, row):
+                key = f"sensor:{sensor_id}:device:{device_id}:{metric}:{name}"
+                pipe.execute_command("TS.ADD", key, t, value, "RETENTION", self.retention_ms,
+                                     "ON_DUPLICATE", "LAST")
+        await pipe.execute()
+        self.processed += n
+
+    def stats(self) -> dict:
+        return {"pending": self._n_pending, "processed": self.processed, "dropped": self.dropped}
@@ -0,0 +1,197 @@
+"""Redis Streams log of ingested samples, read by consumer groups.
+
+Every batch an ingest worker releases from its reorder buffer is appended
+(XADD, in the same pipeline as the time-series writes) to that worker's stream
+``ingest:<shard>``. An entry holds one msgpack field ``d``: a list of
+``[sensor_id, device_id, metric, [ts...], [value...]]``.
+
+Each kind of downstream work (analysis, rollups, archive) is a consumer group.
+A ``GroupConsumer`` reads its streams with XREADGROUP, calls the handler and
+XACKs only after the handler succeeded, so a crash re-delivers the entries on
+restart. Delivery is at-least-once:
+
+* on start it first re-reads its own pending entries (ID ``0``), i.e. what it
+  had read but not acked before it died;
+* entries left pending by another consumer for longer than ``claim_idle_ms``
+  are taken over with XAUTOCLAIM, so a dead peer's work is not stuck;
+* within a process, points at or before the newest timestamp a handler has
+  already returned from for a series are filtered out, so a retried entry is
+  not counted twice. A handler that raises gets the same points again, so it
+  raises only before changing its state; failed writes it keeps for retry
+  itself and returns normally.
+
+An entry counts as handled once the handler returns, not once its effects are
+durable. The handlers keep state in memory (detector state, open rollup
+buckets, the archive's unflushed chunks) and only the closed buckets and
+chunks are written, so a crash loses that state for entries already acked:
+at-least-once holds for delivery, not for what the handlers derived.
+
+Handlers keep per-series state, so a stream is read by one consumer of a
+group at a time. A group scales out by splitting the streams
+(``partitions``) across processes. For example, with four ingest workers, run a second instance with ``STREAM_GROUPS='["analysis"]'`` and
+``STREAM_PARTITIONS='[2, 3]'`` and give the first ``STREAM_PARTITIONS='[0, 1]'``.
+Streams are trimmed to about ``maxlen`` entries; a group that falls further
+behind than that loses the oldest entries. A pending entry that was trimmed
+comes back without fields (or in XAUTOCLAIM's list of deleted IDs); it is
+acked and counted as ``lost``.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple
+
+import msgpack
+import redis.asyncio as redis
+
+log = logging.getLogger(__name__)
+
+Released = Dict[Tuple[int, int, str], List[Tuple[int, float]]]
+Handler = Callable[[int, Released], Awaitable[None]]
+
+
+def stream_key(shard: int) -> str:
+    return f"ingest:{shard}"
+
+
+def encode_entry(released: Released) -> bytes:
+    return msgpack.packb([
+        [sensor_id, device_id, metric, [ts for ts, _ in points], [value for _, value in points]]
+        for (sensor_id, device_id, metric), points in released.items()
+    ])
+
+
+def decode_entry(fields: dict) -> Released:
+    data = fields.get(b"d") or fields.get("d")
+    return {
+        (sensor_id, device_id, metric): list(zip(ts, values))
+        for sensor_id, device_id, metric, ts, values in msgpack.unpackb(data)
+    }
+
+
+def _entries(reply) -> List[Tuple[bytes, dict]]:
+    """Entries of a single-stream XREADGROUP reply (None when the block timed out)."""
+    if not reply:
+        return []
+    if isinstance(reply, dict):  # RESP3
+        return next(iter(reply.values()))[0] if reply else []
+    return reply[0][1]
+
+
+class GroupConsumer:
+    def __init__(self, r, group: str, name: str, partitions: Sequence[int], handler: Handler,
+                 count: int = 100, block_ms: int = 1000, claim_idle_ms: int = 30_000,
+                 start_id: str = "$"):
+        self.r = r
+        self.group = group
+        self.name = name
+        self.partitions = list(partitions)
+        self.handler = handler
+        self.count = count
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.start_id = start_id
+        self._tasks: List[asyncio.Task] = []
+        self.processed = 0
+        self.failures = 0
+        self.claimed = 0
+        self.lost = 0  # trimmed before this group read them
+        self._seen: Dict[Tuple[int, tuple], int] = {}  # (shard, series) -> newest ts handled
+
+    async def start(self):
+        # create the groups now, so entries added from here on are delivered
+        for shard in self.partitions:
+            key = stream_key(shard)
+            try:
+                await self._ensure_group(self.r.node_for(key), key)
+            except redis.RedisError as e:
+                log.error(f"Creating consumer group {self.group} on {key} failed: {e}")
+        self._tasks = [asyncio.create_task(self._run(shard)) for shard in self.partitions]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _ensure_group(self, node, key: str):
+        try:
+            await node.execute_command("XGROUP", "CREATE", key, self.group, self.start_id, "MKSTREAM")
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _handle(self, node, shard: int, key: str, entries: List[Tuple[bytes, dict]]):
+        released: Released = {}
+        newest: Dict[tuple, int] = {}
+        for _, fields in entries:
+            if not fields:
+                self.lost += 1  # trimmed while pending
+                continue
+            for series, points in decode_entry(fields).items():
+                seen = newest.get(series, self._seen.get((shard, series), -1))
+                fresh = [p for p in points if p[0] > seen]
+                if fresh:
+                    released.setdefault(series, []).extend(fresh)
+                    newest[series] = fresh[-1][0]
+        if released:
+            await self.handler(shard, released)
+        # only now: if the handler raised, the retried entries must reach it again
+        for series, ts in newest.items():
+            self._seen[(shard, series)] = ts
+        await node.execute_command("XACK", key, self.group, *(entry_id for entry_id, _ in entries))
+        self.processed += len(entries)
+
+    async def _run(self, shard: int):
+        key = stream_key(shard)
+        node = self.r.node_for(key)  # XREADGROUP's first argument is not the key
+        backoff = 0.5
+        pending = True  # re-deliver our own unacked entries first
+        next_claim = 0.0
+        while True:
+            try:
+                await self._ensure_group(node, key)
+                if pending:
+                    reply = await node.execute_command(
+                        "XREADGROUP", "GROUP", self.group, self.name, "COUNT", self.count,
+                        "STREAMS", key, "0")
+                    entries = _entries(reply)
+                    if not entries:
+                        pending = False
+                        continue
+                else:
+                    if time.monotonic() >= next_claim:
+                        next_claim = time.monotonic() + self.claim_idle_ms / 1000
+                        _, claimed, *deleted = await node.execute_command(
+                            "XAUTOCLAIM", key, self.group, self.name, self.claim_idle_ms, "0-0",
+                            "COUNT", self.count)
+                        if deleted and deleted[0]:
+                            self.lost += len(deleted[0])  # trimmed, dropped from the pending list
+                        if claimed:
+                            self.claimed += len(claimed)
+                            await self._handle(node, shard, key, claimed)
+                            continue
+                    reply = await node.execute_command(
+                        "XREADGROUP", "GROUP", self.group, self.name, "COUNT", self.count,
+                        "BLOCK", self.block_ms, "STREAMS", key, ">")
+                    entries = _entries(reply)
+                    if not entries:
+                        continue
+                await self._handle(node, shard, key, entries)
+                backoff = 0.5
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                log.error(f"Consumer {self.group}/{self.name} on {key} failed, retrying in {backoff:.1f}s: {e}")
+                pending = True  # unacked entries are retried from the pending list
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def stats(self) -> dict:
+        return {
+            "partitions": self.partitions,
+            "processed": self.processed,
+            "failures": self.failures,
+            "claimed": self.claimed,
+            "lost": self.lost,
+        }
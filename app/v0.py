@@ -1,7 +1,8 @@
 import json
 import aioredis
+from datetime import datetime
 
-from typing import Annotated
+from typing import Annotated, AsyncIterator, List
 from fastapi import Depends, FastAPI, WebSocket
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
@@ -10,8 +11,9 @@ from contextlib import asynccontextmanager
 from pydantic import TypeAdapter
 
 import models
-from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 from config import get_settings
+from database import BatchWriter, create_db_and_tables, make_engine, make_sessionmaker
 from redis_config import initialize_redis
 import logging
 
@@ -21,25 +23,27 @@ database = get_settings().POSTGRES_URL
 
 redis = aioredis.from_url(get_settings().REDIS_URL, decode_responses=True)
 
-engine = create_engine(database)
+engine = make_engine(database)
+async_session = make_sessionmaker(engine)
+writer = BatchWriter(async_session)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
 
-
-def get_session():
-    with Session(engine) as session:
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with async_session() as session:
         yield session
 
 
-SessionDep = Annotated[Session, Depends(get_session)]
+SessionDep = Annotated[AsyncSession, Depends(get_session)]
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
+    await create_db_and_tables(engine)
     await initialize_redis(redis, log)
+    await writer.start()
     yield
+    await writer.stop()
+    await engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -54,10 +58,10 @@ async def get():
 
 @app.get("/component/test-add")
 async def test_add_axis_data(session: SessionDep):
-    test_data = AxisData(
+    test_data = models.AxisData(
         sensor_id=1,
         device_id=1,
-        timestamp="2024-06-01T12:00:00Z",
+        timestamp=datetime.fromisoformat("2024-06-01T12:00:00Z"),
         status="idle",
         position=100.0,
         speed=10.0,
@@ -65,56 +69,22 @@ async def test_add_axis_data(session: SessionDep):
         load=50.0,
     )
     session.add(test_data)
-    session.commit()
-    session.refresh(test_data)
+    await session.commit()
+    await session.refresh(test_data)
     return {"message": "AxisData added", "id": test_data.id}
 
 # ----- Database Write Function -----
-async def add_sensor_data(payload: SensorPayload, session: Session):
-    """Add sensor data to the appropriate database table"""
-    
-    if payload.sensor_type == 'distance':
-        db_record = models.DistancePayload(
-            sensor_id=payload.sensor_id,
-            device_id=payload.device_id,
-            timestamp=payload.timestamp,
-            status=payload.status,
-            distance=payload.data['distance']
-        )
-    elif payload.sensor_type == 'grip_force':
-        db_record = models.GripForceData(
-            sensor_id=payload.sensor_id,
-            device_id=payload.device_id,
-            timestamp=payload.timestamp,
-            status=payload.status,
-            force=payload.data['force']
-        )
-    elif payload.sensor_type == 'axis':
-        db_record = AxisData(
-            sensor_id=payload.sensor_id,
-            device_id=payload.device_id,
-            timestamp=payload.timestamp,
-            status=payload.status,
-            position=payload.data['position'],
-            speed=payload.data['speed'],
-            acceleration=payload.data['acceleration'],
-            load=payload.data['load']
-        )
-    elif payload.sensor_type == 'air_pressure':
-        db_record = AirPressureData(
-            sensor_id=payload.sensor_id,
-            device_id=payload.device_id,
-            timestamp=payload.timestamp,
-            status=payload.status,
-            pressure=payload.data['pressure']
-        )
-    
-    session.add(db_record)
-    session.commit()
-    session.refresh(db_record)
-    return db_record
-
-SensorsPayloadAdapter = TypeAdapter(SensorPayload)
+async def add_sensor_data(payloads: List[models.SensorPayload]):
+    """Add sensor data to the appropriate database tables.
+
+    Goes through the batched writer: rows are bulk-inserted per table and
+    committed once per batch, not once per record.
+    """
+    await writer.write_many(payloads)
+
+SensorsPayloadAdapter = TypeAdapter(models.SensorPayload)
+# a frame may also carry a list of readings (see app/sensor_client.py)
+SensorsPayloadBatchAdapter = TypeAdapter(List[models.SensorPayload])
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -124,18 +94,13 @@ async def websocket_endpoint(websocket: WebSocket):
         # Parse JSON data
         try:
             data = json.loads(raw)
-            payload = SensorsPayloadAdapter.validate_python(data)
-            await add_sensor_data(payload)
+            if isinstance(data, list):
+                payloads = SensorsPayloadBatchAdapter.validate_python(data)
+            else:
+                payloads = [SensorsPayloadAdapter.validate_python(data)]
+            await add_sensor_data(payloads)
             await websocket.send_text("ok")
         except Exception as e:
             log.error(f'WebSocket error: {e}')
             await websocket.send_text(f'error: {str(e)}')
             continue
-
-        # Save to DB
-        with Session(engine) as session:
-            session.add(payload)
-            session.commit()
-            session.refresh(payload)
-
-            await websocket.send_text(f"Saved data with id: {payload.id}")
@@ -0,0 +1,383 @@
+"""Local write-ahead log for accepted ingest frames.
+
+The log is a directory of fixed-size segment files (``00000000000000000001.wal``,
+...). Each one is preallocated and memory-mapped, so an append is a memcpy
+into the mapping. Records are ``u32 length | u32 crc32 | bytes``. A zero
+length marks the unused tail of a segment.
+
+``append`` returns once the record is on disk. Appends are group-committed:
+while one fdatasync runs, the next appends pile up and share the following
+one, so the fsync rate stays constant no matter how many sensors write.
+
+``Replayer`` reads committed records from a checkpoint (``checkpoint`` file:
+segment and offset) and hands them to a sink in large batches. The sink
+queues a batch and returns a future that completes once the batch is written
+to storage; up to ``max_in_flight`` batches are queued at once, and the
+checkpoint only moves past a batch when it and every batch before it are
+written. Records still in a reorder buffer, or in a write retried after a
+connection error, are therefore replayed again after a crash. If storage is
+down it backs off and retries from the checkpoint while the log keeps
+growing, up to ``max_bytes``. Segments behind the checkpoint are deleted.
+
+On startup the write position is recovered by walking the records after the
+checkpoint. The first bad length or crc marks the end (a torn write).
+"""
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import zlib
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<II")  # length, crc32
+_SUFFIX = ".wal"
+
+Position = Tuple[int, int]  # (segment number, byte offset)
+
+
+class WALFull(Exception):
+    pass
+
+
+def _segment_name(seq: int) -> str:
+    return f"{seq:020d}{_SUFFIX}"
+
+
+def _read_record(m, pos: int, end: int) -> Optional[bytes]:
+    """Record at ``pos``, or None if there is no valid one (end of log)."""
+    if pos + _HEADER.size > end:
+        return None
+    n, crc = _HEADER.unpack_from(m, pos)
+    start = pos + _HEADER.size
+    if n == 0 or start + n > end:
+        return None
+    data = m[start:start + n]
+    if zlib.crc32(data) != crc:
+        return None
+    return data
+
+
+class _Segment:
+    __slots__ = ("seq", "path", "fd", "mm", "size")
+
+    def __init__(self, directory: str, seq: int, size: int):
+        self.seq = seq
+        self.path = os.path.join(directory, _segment_name(seq))
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        current = os.fstat(self.fd).st_size
+        if current < size:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(self.fd, 0, size)
+            else:
+                os.ftruncate(self.fd, size)
+        self.size = max(current, size)
+        self.mm = mmap.mmap(self.fd, self.size)
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+
+class WAL:
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 max_bytes: int = 8 * 1024 * 1024 * 1024, commit_delay: float = 0.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max(2, max_bytes // segment_bytes)
+        self.commit_delay = commit_delay
+        self._checkpoint_path = os.path.join(directory, "checkpoint")
+        self.checkpoint: Position = (1, 0)
+        self.committed: Position = (1, 0)
+        self._active: Optional[_Segment] = None
+        self._pos = 0
+        self._unsynced: List[_Segment] = []  # sealed segments awaiting their final sync
+        self._waiters: List[Tuple[asyncio.Future, Position]] = []
+        self._dirty = asyncio.Event()
+        self._committed_event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.appended = 0
+        self.syncs = 0
+
+    def open(self):
+        """Open the log and find the end of what was written before a restart."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.checkpoint = self._load_checkpoint()
+        seqs = self.segments()
+        if not seqs:
+            seqs = [self.checkpoint[0]]
+        self._active = _Segment(self.directory, seqs[-1], self.segment_bytes)
+        self._pos = self._recover_end(self._active)
+        self.committed = (self._active.seq, self._pos)
+
+    # ----- Segments and checkpoint -----
+
+    def segments(self) -> List[int]:
+        return sorted(int(name[:-len(_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(_SUFFIX))
+
+    def segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, _segment_name(seq))
+
+    def _load_checkpoint(self) -> Position:
+        try:
+            with open(self._checkpoint_path) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (FileNotFoundError, ValueError):
+            seqs = self.segments()
+            return (seqs[0] if seqs else 1), 0
+
+    def save_checkpoint(self, position: Position):
+        tmp = self._checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{position[0]} {position[1]}")
+        os.replace(tmp, self._checkpoint_path)
+        self.checkpoint = position
+        for seq in self.segments():
+            if seq >= position[0]:
+                break
+            os.remove(self.segment_path(seq))
+
+    def _recover_end(self, segment: _Segment) -> int:
+        pos = self.checkpoint[1] if segment.seq == self.checkpoint[0] else 0
+        while True:
+            data = _read_record(segment.mm, pos, segment.size)
+            if data is None:
+                break
+            pos += _HEADER.size + len(data)
+        if pos + _HEADER.size <= segment.size:
+            segment.mm[pos:pos + _HEADER.size] = bytes(_HEADER.size)  # drop a torn record
+        return pos
+
+    # ----- Writing -----
+
+    def _write(self, data: bytes) -> Position:
+        need = _HEADER.size + len(data)
+        if need > self.segment_bytes:
+            raise ValueError(f"Record of {len(data)} bytes doesn't fit a WAL segment")
+        if self._pos + need > self._active.size:
+            if len(self.segments()) >= self.max_segments:
+                raise WALFull("WAL is full; storage has not caught up")
+            self._unsynced.append(self._active)
+            self._active = _Segment(self.directory, self._active.seq + 1, self.segment_bytes)
+            self._pos = 0
+        mm, pos = self._active.mm, self._pos
+        mm[pos + _HEADER.size:pos + need] = data
+        mm[pos:pos + _HEADER.size] = _HEADER.pack(len(data), zlib.crc32(data))
+        self._pos = pos + need
+        self.appended += 1
+        return self._active.seq, self._pos
+
+    async def append(self, data: bytes):
+        """Append one record and wait until it is durable."""
+        position = self._write(data)
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((fut, position))
+        self._dirty.set()
+        await fut
+
+    async def start(self):
+        if self._active is None:
+            self.open()
+        self._task = asyncio.create_task(self._committer())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._active is None:
+            return
+        await self._sync()
+        for segment in self._unsynced:
+            segment.close()
+        self._active.close()
+        self._active = None
+
+    async def _sync(self):
+        waiters, self._waiters = self._waiters, []
+        sealed, self._unsynced = self._unsynced, []
+        active, position = self._active, (self._active.seq, self._pos)
+        try:
+            # fdatasync writes back the mapping's dirty pages and releases the GIL
+            for segment in sealed:
+                await asyncio.to_thread(os.fdatasync, segment.fd)
+                segment.close()
+            await asyncio.to_thread(os.fdatasync, active.fd)
+        except OSError as e:
+            log.error(f"WAL sync failed: {e}")
+            self._unsynced = [seg for seg in sealed if not seg.mm.closed] + self._unsynced
+            for fut, _ in waiters:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.syncs += 1
+        self.committed = position
+        self._committed_event.set()
+        for fut, _ in waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+    async def _committer(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            if self.commit_delay:
+                await asyncio.sleep(self.commit_delay)
+            await self._sync()
+
+    # ----- Reading -----
+
+    def read(self, start: Position, max_records: int) -> Tuple[List[bytes], Position]:
+        """Committed records from ``start``; returns them and the position after them."""
+        seq, pos = start
+        records: List[bytes] = []
+        while len(records) < max_records:
+            end = self.committed[1] if seq == self.committed[0] else None
+            if seq > self.committed[0] or not os.path.exists(self.segment_path(seq)):
+                break
+            with open(self.segment_path(seq), "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                limit = end if end is not None else len(m)
+                while len(records) < max_records:
+                    data = _read_record(m, pos, limit)
+                    if data is None:
+                        break
+                    records.append(data)
+                    pos += _HEADER.size + len(data)
+            if end is not None or len(records) >= max_records:
+                break
+            seq, pos = seq + 1, 0  # sealed segment fully read
+        return records, (seq, pos)
+
+    async def wait_committed(self, position: Position, timeout: float):
+        """Wait until something past ``position`` is committed (or ``timeout``)."""
+        self._committed_event.clear()
+        if self.committed > position:
+            return
+        try:
+            await asyncio.wait_for(self._committed_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def backlog(self) -> int:
+        """Bytes appended but not yet replayed (approximate across segments)."""
+        if self._active is None:
+            return 0
+        cseq, coff = self.checkpoint
+        wseq, woff = self._active.seq, self._pos
+        return (wseq - cseq) * self.segment_bytes + woff - coff
+
+    def stats(self) -> dict:
+        return {
+            "appended": self.appended,
+            "syncs": self.syncs,
+            "segments": len(self.segments()) if self._active is not None else 0,
+            "backlog_bytes": self.backlog(),
+        }
+
+
+# queues records for storage; the future completes once they are written
+Sink = Callable[[List[bytes]], Awaitable[asyncio.Future]]
+
+
+class Replayer:
+    """Drains committed WAL records into ``sink`` and advances the checkpoint."""
+
+    def __init__(self, wal: WAL, sink: Sink, batch_size: int = 5000, max_in_flight: int = 8,
+                 initial_backoff: float = 0.5, max_backoff: float = 30):
+        self.wal = wal
+        self.sink = sink
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._task: Optional[asyncio.Task] = None
+        # batches handed to the sink: (end position, records, written)
+        self._in_flight: Deque[Tuple[Position, int, asyncio.Future]] = deque()
+        self._position: Position = (0, 0)  # read position, ahead of the checkpoint
+        self.replayed = 0
+        self.failures = 0
+
+    async def start(self):
+        self._position = self.wal.checkpoint
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def drain(self):
+        """Replay everything committed so far (e.g. on shutdown)."""
+        self._position = self.wal.checkpoint
+        self._in_flight.clear()
+        while await self._fill() or self._in_flight:
+            await asyncio.wait([self._in_flight[0][2]])
+            self._advance()
+
+    async def _fill(self) -> bool:
+        """Hand batches to the sink up to ``max_in_flight``; False if none was left."""
+        while len(self._in_flight) < self.max_in_flight:
+            records, end = self.wal.read(self._position, self.batch_size)
+            if not records:
+                self._position = end
+                if not self._in_flight and end != self.wal.checkpoint:
+                    self.wal.save_checkpoint(end)  # moved past a sealed segment
+                return False
+            self._in_flight.append((end, len(records), await self.sink(records)))
+            self._position = end
+        return True
+
+    def _advance(self):
+        """Move the checkpoint past the written batches at the head; raises if one failed."""
+        while self._in_flight and self._in_flight[0][2].done():
+            end, n, written = self._in_flight[0]
+            if written.cancelled():
+                raise RuntimeError("ingest stopped before the batch was written")
+            if written.exception() is not None:
+                raise written.exception()
+            self._in_flight.popleft()
+            self.wal.save_checkpoint(end)
+            self.replayed += n
+
+    async def _run(self):
+        backoff = self.initial_backoff
+        while True:
+            try:
+                more = await self._fill()
+                if self._in_flight:
+                    waits = [self._in_flight[0][2]]
+                    if not more and len(self._in_flight) < self.max_in_flight:
+                        waits.append(asyncio.ensure_future(
+                            self.wal.wait_committed(self._position, timeout=1.0)))
+                    await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+                    for waiter in waits[1:]:
+                        waiter.cancel()
+                elif not more:
+                    await self.wal.wait_committed(self._position, timeout=1.0)
+                self._advance()
+                backoff = self.initial_backoff
+            except Exception as e:
+                self.failures += 1
+                log.error(f"WAL replay from {self.wal.checkpoint} failed, retrying in {backoff:.1f}s: {e}")
+                # let the rest settle, then start over from the checkpoint
+                await asyncio.gather(*(written for _, _, written in self._in_flight),
+                                     return_exceptions=True)
+                self._in_flight.clear()
+                self._position = self.wal.checkpoint
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def stats(self) -> dict:
+        return {"replayed": self.replayed, "failures": self.failures,
+                "in_flight": len(self._in_flight)}
@@ -0,0 +1,140 @@
+"""Stale-sensor watchdog.
+
+Every sensor has a deadline by which its next sample is expected:
+``factor`` times its typical sample interval (a moving average of the gaps
+between its timestamps), but at least ``min_timeout_ms``. Deadlines sit in a
+min-heap, and the watchdog task sleeps until the earliest one, so nothing
+scans all sensors periodically.
+
+A sample only updates the sensor's deadline in a dict. The heap holds at most
+one entry per sensor: when an entry comes due, its current deadline is checked
+and it is pushed back if it has moved (O(log n)), or reported as silent.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+
+def _now_ms() -> float:
+    return time.monotonic() * 1000
+
+
+class _Sensor:
+    __slots__ = ("last_ts", "interval", "deadline", "scheduled", "silent_since")
+
+    def __init__(self):
+        self.last_ts: Optional[int] = None
+        self.interval: Optional[float] = None
+        self.deadline = 0.0
+        self.scheduled = False
+        self.silent_since: Optional[int] = None
+
+
+class Watchdog:
+    def __init__(self, on_silent: Callable[[Hashable, int, float], None],
+                 on_resumed: Optional[Callable[[Hashable, int, int], None]] = None,
+                 factor: float = 3.0, min_timeout_ms: int = 2000, alpha: float = 0.1):
+        """on_silent(sensor, last_ts, timeout_ms) and on_resumed(sensor, silent_since, ts)."""
+        self.on_silent = on_silent
+        self.on_resumed = on_resumed
+        self.factor = factor
+        self.min_timeout_ms = min_timeout_ms
+        self.alpha = alpha
+        self._sensors: Dict[Hashable, _Sensor] = {}
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._counter = 0  # tie-breaker, sensors need not be comparable
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def timeout_ms(self, sensor: _Sensor) -> float:
+        if sensor.interval is None:
+            return self.min_timeout_ms
+        return max(self.min_timeout_ms, self.factor * sensor.interval)
+
+    def seen(self, key: Hashable, ts: int):
+        """Record a sample from ``key`` with event timestamp ``ts`` (ms)."""
+        sensor = self._sensors.get(key)
+        if sensor is None:
+            sensor = self._sensors[key] = _Sensor()
+        if sensor.last_ts is not None and ts > sensor.last_ts:
+            gap = ts - sensor.last_ts
+            sensor.interval = gap if sensor.interval is None else \
+                (1 - self.alpha) * sensor.interval + self.alpha * gap
+        if sensor.last_ts is None or ts > sensor.last_ts:
+            sensor.last_ts = ts
+
+        if sensor.silent_since is not None:
+            if self.on_resumed:
+                self.on_resumed(key, sensor.silent_since, ts)
+            sensor.silent_since = None
+
+        sensor.deadline = _now_ms() + self.timeout_ms(sensor)
+        if not sensor.scheduled:
+            self._push(key, sensor)
+
+    def _push(self, key: Hashable, sensor: _Sensor):
+        sensor.scheduled = True
+        self._counter += 1
+        heapq.heappush(self._heap, (sensor.deadline, self._counter, key))
+        if self._heap[0][2] == key:
+            self._wakeup.set()  # new earliest deadline
+
+    def forget(self, key: Hashable):
+        """Stop watching a sensor (its heap entry is discarded when it comes due)."""
+        self._sensors.pop(key, None)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            due = self._heap[0][0]
+            delay = (due - _now_ms()) / 1000
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._check_due()
+
+    def _check_due(self):
+        now = _now_ms()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key = heapq.heappop(self._heap)
+            sensor = self._sensors.get(key)
+            if sensor is None:
+                continue
+            sensor.scheduled = False
+            if sensor.deadline > now:
+                self._push(key, sensor)  # samples arrived since; reschedule
+            elif sensor.silent_since is None:
+                sensor.silent_since = sensor.last_ts
+                try:
+                    self.on_silent(key, sensor.last_ts, self.timeout_ms(sensor))
+                except Exception as e:
+                    log.error(f"Watchdog callback failed for {key}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "sensors": len(self._sensors),
+            "silent": sum(1 for s in self._sensors.values() if s.silent_since is not None),
+            "scheduled": len(self._heap),
+        }
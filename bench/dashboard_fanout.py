@@ -0,0 +1,245 @@
+"""Fan-out benchmark for the dashboard broadcast path (app/broadcast.py).
+
+Starts a server process with only a ``Broadcaster`` behind ``/ws_dashboard``
+(no Redis or Postgres). A publisher task feeds ``--series`` series at
+``--rate`` samples per second each, stamped with the wall clock. Then it opens
+``--clients`` local WebSocket clients, spread over ``--procs`` client
+processes, each asking for one of the ``--fps`` rates. ``--slow`` is the
+fraction of clients that stall for 200 ms after every frame.
+
+Reported:
+    frames/s per client vs the rate asked for
+    send lag: sample timestamp -> frame received, p50/p95/p99/max
+    dropped: frames replaced in a client's outbox before they were sent
+    server CPU (% of one core) and event-loop lag while fanning out
+
+Slow clients' lag is mostly frames already sitting in socket buffers:
+conflation only kicks in once a send blocks. Clients and server share the
+machine, so on few cores the client processes are the limit; compare
+server_cpu_pct against what is left.
+
+    python -m bench.dashboard_fanout --clients 5000 --series 200 --fps 1 10 30
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# ----- Server -----
+
+def serve(port: int, n_series: int, rate: float):
+    from contextlib import asynccontextmanager
+
+    import uvicorn
+    from fastapi import FastAPI, WebSocket
+
+    from app.broadcast import Broadcaster
+
+    dashboard = Broadcaster("dashboard", max_fps=60)
+    loop_lag = {"max_ms": 0.0, "sum_ms": 0.0, "n": 0}
+
+    async def publisher():
+        keys = [f"sensor:{i}:device:{i // 4}:distance" for i in range(n_series)]
+        interval = 1 / rate
+        while True:
+            ts = int(time.time() * 1000)
+            for i, key in enumerate(keys):
+                dashboard.publish_values(key, [(ts, float(i + ts % 1000))])
+            await asyncio.sleep(interval)
+
+    async def lag_probe():
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(0.05)
+            lag = (time.perf_counter() - t - 0.05) * 1000
+            loop_lag["max_ms"] = max(loop_lag["max_ms"], lag)
+            loop_lag["sum_ms"] += lag
+            loop_lag["n"] += 1
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        tasks = [asyncio.create_task(publisher()), asyncio.create_task(lag_probe())]
+        yield
+        for task in tasks:
+            task.cancel()
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.get("/stats")
+    async def stats():
+        cpu = os.times()
+        out = {**dashboard.stats(), "cpu_s": cpu.user + cpu.system, "wall_s": time.monotonic(),
+               "loop_lag_max_ms": loop_lag["max_ms"],
+               "loop_lag_avg_ms": loop_lag["sum_ms"] / max(loop_lag["n"], 1)}
+        loop_lag.update(max_ms=0.0, sum_ms=0.0, n=0)
+        return out
+
+    @app.websocket("/ws_dashboard")
+    async def ws_dashboard(ws: WebSocket, fps: int = 10, mode: str = "latest"):
+        await ws.accept()
+        await dashboard.serve(ws, "json", fps=fps, mode=mode)
+
+    raise_fd_limit()
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096,
+                ws_ping_interval=None)
+
+
+# ----- Clients -----
+
+async def client(index: int, url: str, duration: float, slow: bool, result: dict,
+                 start_at: float):
+    import websockets
+
+    lags = result["slow_lags" if slow else "lags"]
+    end = start_at + duration
+    frames = 0
+    try:
+        async with websockets.connect(url, max_size=None, ping_interval=None,
+                                      open_timeout=60) as ws:
+            result["connected"] += 1
+            # keep reading while the others connect, but only measure the window
+            while True:
+                left = end - time.time()
+                if left <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(ws.recv(), left)
+                except asyncio.TimeoutError:
+                    break
+                now = time.time()
+                if now >= start_at:
+                    frames += 1
+                    if len(lags) < 200_000:
+                        lags.append(now * 1000 - json.loads(message)["end"])
+                if slow:
+                    await asyncio.sleep(0.2)
+    except Exception as e:
+        result["errors"] += 1
+        result["error"] = repr(e)
+    result["frames"][index] = frames
+
+
+def run_clients(args: tuple) -> dict:
+    urls, slow_flags, duration, start_at = args
+    raise_fd_limit()
+    result = {"connected": 0, "errors": 0, "frames": [0] * len(urls), "lags": [],
+              "slow_lags": [], "error": None}
+
+    async def main():
+        tasks = []
+        for i, (url, slow) in enumerate(zip(urls, slow_flags)):
+            tasks.append(asyncio.create_task(client(i, url, duration, slow, result, start_at)))
+            if i % 200 == 199:
+                await asyncio.sleep(0.05)  # don't overrun the accept backlog
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    return result
+
+
+def get_stats(port: int) -> dict:
+    import urllib.request
+
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats") as response:
+        return json.load(response)
+
+
+def percentiles(lags: list):
+    if not lags:
+        return None
+    return {q: round(float(np.percentile(lags, p)), 1)
+            for q, p in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dashboard fan-out benchmark")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--series", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=50.0, help="samples/s per series")
+    parser.add_argument("--fps", type=int, nargs="+", default=[1, 10, 30])
+    parser.add_argument("--mode", choices=["latest", "minmax"], default="latest")
+    parser.add_argument("--slow", type=float, default=0.1, help="fraction of stalling clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds measured")
+    parser.add_argument("--procs", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.series, args.rate)
+        return
+
+    server = subprocess.Popen([sys.executable, "-m", "bench.dashboard_fanout", "--serve",
+                               "--port", str(args.port),
+                               "--series", str(args.series), "--rate", str(args.rate)])
+    try:
+        for _ in range(100):
+            try:
+                get_stats(args.port)
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        rng = np.random.default_rng(0)
+        fps = [args.fps[i % len(args.fps)] for i in range(args.clients)]
+        slow = (rng.random(args.clients) < args.slow).tolist()
+        urls = [f"ws://127.0.0.1:{args.port}/ws_dashboard?fps={f}&mode={args.mode}" for f in fps]
+        # connecting thousands of clients takes a while; measure only once all are in
+        start_at = time.time() + 5 + args.clients / 1000
+        jobs = [(urls[p::args.procs], slow[p::args.procs], args.duration, start_at)
+                for p in range(args.procs)]
+        with multiprocessing.get_context("spawn").Pool(args.procs) as pool:
+            pending = pool.map_async(run_clients, jobs)
+            time.sleep(max(0.0, start_at - time.time()))
+            before = get_stats(args.port)
+            time.sleep(max(0.0, start_at + args.duration - time.time()))
+            after = get_stats(args.port)
+            results = pending.get()
+    finally:
+        server.terminate()
+        server.wait()
+
+    frames = np.array([f for r in results for f in r["frames"]], dtype=float)
+    wall = after["wall_s"] - before["wall_s"]
+    per_fps = {}
+    for p in range(args.procs):
+        for f, n, s in zip(fps[p::args.procs], results[p]["frames"], slow[p::args.procs]):
+            if not s:
+                per_fps.setdefault(f, []).append(n / args.duration)
+    report = {
+        "clients": args.clients,
+        "connected": sum(r["connected"] for r in results),
+        "disconnected": sum(r["errors"] for r in results),
+        "series": args.series,
+        "samples_per_s": args.series * args.rate,
+        "frames_per_s_per_client": {f"{f} fps": round(float(np.mean(v)), 2)
+                                    for f, v in sorted(per_fps.items())},
+        "frames_received": int(frames.sum()),
+        "send_lag_ms": percentiles([lag for r in results for lag in r["lags"]]),
+        "slow_client_lag_ms": percentiles([lag for r in results for lag in r["slow_lags"]]),
+        "dropped_frames": after["dropped"] - before["dropped"],
+        "server_cpu_pct": round(100 * (after["cpu_s"] - before["cpu_s"]) / wall, 1),
+        "server_loop_lag_ms": {"avg": round(after["loop_lag_avg_ms"], 2),
+                               "max": round(after["loop_lag_max_ms"], 2)},
+    }
+    errors = [r["error"] for r in results if r["error"]]
+    if errors:
+        report["first_error"] = errors[0]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
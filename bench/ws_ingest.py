@@ -0,0 +1,337 @@
+"""Connection-scaling benchmark for the sensor ingest endpoint (app/gateway.py).
+
+Starts a server process with a ``SensorGateway`` behind ``/ws``. Frames go
+through the real validation (``frame_payloads``) and ingest routing
+(``IngestDispatcher``), and the workers only count the readings (no Redis).
+It then opens ``--sensors`` simulated sensors from ``--procs`` client
+processes. Each sensor connects, then sends one reading every ``--interval``
+seconds (an empty heartbeat frame ``[]`` for ``--quiet`` of them) and waits
+for the reply.
+
+The clients speak just enough WebSocket over raw asyncio streams: unmasked
+payloads (zero mask key), no extensions, answers to pings. That keeps their
+own overhead low enough to run tens of thousands of them next to the server.
+Each client process binds a different 127.x source address, so the sensors
+are not limited by the ephemeral ports of a single address. Connects are paced
+at ``--connect-rate`` (by default the server's ``--accept-rate``), and a sensor
+that is refused or times out retries with backoff like the sensor client.
+
+Reported:
+    connected / refused (admission) / failed, and how long connecting took
+    readings/s acked, reply latency p50/p95/p99/max
+    server: open connections, RSS per connection, event-loop lag, CPU (% of one core)
+
+Every process needs an open-file limit above the connections it holds
+(``ulimit -n``). The gateway caps its connections below the server's limit
+and logs a warning, which shows up here as ``max_connections`` and refused
+sensors. Clients and server share the machine, so on few cores the clients
+are the limit; compare server_cpu_pct against what is left.
+
+    python -m bench.ws_ingest --sensors 50000 --procs 4 --interval 5
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# ----- Server -----
+
+def serve(port: int, max_connections: int, accept_rate: float, lag_window: float):
+    raise_fd_limit()
+    from contextlib import asynccontextmanager
+
+    import uvicorn
+    from fastapi import FastAPI, WebSocket
+
+    from app.gateway import SensorGateway
+    from app.ingest import IngestDispatcher
+    from app.main import frame_payloads
+
+    async def count(state: dict, batch: list):
+        for payloads, fut in batch:
+            state["readings"] += len(payloads)
+            fut.set_result(None)
+
+    ingest = IngestDispatcher(count, lambda i: {"readings": 0})
+
+    async def ingest_frame(raw) -> int:
+        payloads = frame_payloads(raw)
+        if payloads:
+            await ingest.submit(payloads)
+        return len(payloads)
+
+    # a gateway-only process, so freezing the connections' objects is safe here;
+    # the max loop lag covers the measured phase
+    gateway = SensorGateway(ingest_frame, max_connections=max_connections,
+                            accept_rate=accept_rate, accept_burst=accept_rate,
+                            lag_window=lag_window, gc_freeze=True)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await ingest.start()
+        await gateway.start()
+        yield
+        await gateway.stop()
+        await ingest.stop()
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.get("/stats")
+    async def stats():
+        cpu = os.times()
+        return {**gateway.stats(), "cpu_s": cpu.user + cpu.system, "wall_s": time.monotonic()}
+
+    @app.websocket("/ws")
+    async def ws_ingest(ws: WebSocket):
+        await gateway.serve(ws)
+
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level="warning", backlog=16384,
+                ws_per_message_deflate=False)
+
+
+# ----- Clients -----
+
+class Refused(Exception):
+    pass
+
+
+def ws_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, 0x80 | n)
+    else:
+        header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, n)
+    return header + b"\0\0\0\0" + payload  # zero mask key: the payload goes as is
+
+
+async def ws_connect(host: str, port: int, local_ip: str):
+    reader, writer = await asyncio.open_connection(host, port, local_addr=(local_ip, 0))
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(f"GET /ws HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\n"
+                 f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                 f"Sec-WebSocket-Version: 13\r\n\r\n".encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    if b" 101 " not in head.split(b"\r\n", 1)[0]:
+        writer.close()
+        raise Refused(head.split(b"\r\n", 1)[0].decode())
+    return reader, writer
+
+
+async def ws_recv(reader, writer) -> bytes:
+    while True:
+        b0, b1 = await reader.readexactly(2)
+        n = b1 & 0x7F
+        if n == 126:
+            n = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif n == 127:
+            n = struct.unpack("!Q", await reader.readexactly(8))[0]
+        payload = await reader.readexactly(n)
+        opcode = b0 & 0x0F
+        if opcode == 0x9:
+            writer.write(ws_frame(payload, 0xA))
+        elif opcode == 0x8:
+            code = struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else 1005
+            raise ConnectionError(f"closed by server: {code}")
+        elif opcode != 0xA:
+            return payload
+
+
+async def sensor(i: int, host: str, port: int, local_ip: str, quiet: bool, interval: float,
+                 connect_by: float, start_at: float, end_at: float, result: dict):
+    writer = None
+    try:
+        delay = 0.5
+        while True:
+            try:
+                # a server out of file descriptors leaves connections hanging in its backlog
+                reader, writer = await asyncio.wait_for(ws_connect(host, port, local_ip), 10)
+                break
+            except (Refused, OSError) as e:  # TimeoutError included
+                if time.time() + delay > connect_by:
+                    result["refused" if isinstance(e, Refused) else "failed"] += 1
+                    result["error"] = repr(e)
+                    return
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, 5)
+        result["connected"] += 1
+        result["connect_done"] = max(result["connect_done"], time.time())
+        # send from the start (heartbeats keep the early ones open), measure only the window
+        await asyncio.sleep(random.uniform(0, interval))
+        reading = {"sensor_type": "distance", "sensor_id": i, "device_id": i // 4,
+                   "timestamp": "", "data": {"distance": 0.0}, "status": "active"}
+        while True:
+            now = time.time()
+            if now >= end_at:
+                break
+            if quiet:
+                frame = b"[]"
+            else:
+                reading["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(now))
+                reading["data"]["distance"] = random.random() * 100
+                frame = json.dumps([reading]).encode()
+            writer.write(ws_frame(frame))
+            reply = await ws_recv(reader, writer)
+            took = time.time() - now
+            if reply != b"ok":
+                result["errors"] += 1
+                result["error"] = reply[:200].decode()
+            elif now >= start_at and not quiet:
+                result["acked"] += 1
+                if len(result["latencies"]) < 100_000:
+                    result["latencies"].append(took * 1000)
+            await asyncio.sleep(max(0.0, interval - took))
+    except Exception as e:
+        result["dropped"] += 1
+        result["error"] = repr(e)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def run_clients(args: tuple) -> dict:
+    proc, ids, quiet, host, port, interval, connect_rate, connect_by, start_at, end_at = args
+    raise_fd_limit()
+    result = {"connected": 0, "refused": 0, "failed": 0, "dropped": 0, "errors": 0, "acked": 0,
+              "latencies": [], "connect_done": 0.0, "error": None}
+
+    async def main():
+        tasks = []
+        for n, (i, q) in enumerate(zip(ids, quiet)):
+            local_ip = f"127.{1 + proc}.{n % 8}.1"
+            tasks.append(asyncio.create_task(sensor(
+                i, host, port, local_ip, q, interval, connect_by, start_at, end_at, result)))
+            if n % 50 == 49:
+                await asyncio.sleep(50 / connect_rate)  # don't overrun the accept backlog
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    return result
+
+
+def get_stats(port: int) -> dict:
+    import urllib.request
+
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=30) as response:
+        return json.load(response)
+
+
+def percentiles(values: list):
+    if not values:
+        return None
+    return {q: round(float(np.percentile(values, p)), 1)
+            for q, p in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sensor ingest connection benchmark")
+    parser.add_argument("--sensors", type=int, default=50_000)
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between readings")
+    parser.add_argument("--quiet", type=float, default=0.2,
+                        help="fraction of sensors sending only heartbeats")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds measured")
+    parser.add_argument("--accept-rate", type=float, default=2_000.0,
+                        help="server admission: new connections per second")
+    parser.add_argument("--connect-rate", type=float, default=0,
+                        help="new connections per second from all clients (default: accept rate)")
+    parser.add_argument("--procs", type=int, default=0,
+                        help="client processes (default: enough for the open-file limit)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.sensors, args.accept_rate, args.duration)
+        return
+
+    raise_fd_limit()
+    fd_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    procs = args.procs or max((os.cpu_count() or 2) - 1,
+                              math.ceil(args.sensors / max(fd_limit - 1000, 1000)))
+    server = subprocess.Popen([sys.executable, "-m", "bench.ws_ingest", "--serve",
+                               "--port", str(args.port),
+                               "--sensors", str(args.sensors),
+                               "--accept-rate", str(args.accept_rate),
+                               "--duration", str(args.duration)])
+    try:
+        for _ in range(300):
+            try:
+                get_stats(args.port)
+                break
+            except OSError:
+                time.sleep(0.1)
+        idle = get_stats(args.port)
+
+        rng = np.random.default_rng(0)
+        quiet = (rng.random(args.sensors) < args.quiet).tolist()
+        t0 = time.time()
+        # admission spreads the connects over sensors / accept_rate seconds
+        connect_by = t0 + 10 + 1.5 * args.sensors / args.accept_rate
+        start_at = connect_by + args.interval
+        end_at = start_at + args.duration
+        ids = list(range(args.sensors))
+        connect_rate = (args.connect_rate or args.accept_rate) / procs
+        jobs = [(p, ids[p::procs], quiet[p::procs], "127.0.0.1", args.port, args.interval,
+                 connect_rate, connect_by, start_at, end_at) for p in range(procs)]
+        with multiprocessing.get_context("spawn").Pool(procs) as pool:
+            pending = pool.map_async(run_clients, jobs)
+            time.sleep(max(0.0, start_at - time.time()))
+            before = get_stats(args.port)
+            time.sleep(max(0.0, end_at - time.time()))
+            after = get_stats(args.port)
+            results = pending.get(timeout=60 + 2 * args.interval)
+    finally:
+        server.terminate()
+        server.wait()
+
+    wall = after["wall_s"] - before["wall_s"]
+    connected = sum(r["connected"] for r in results)
+    report = {
+        "sensors": args.sensors,
+        "client_procs": procs,
+        "connected": connected,
+        "refused": sum(r["refused"] for r in results),
+        "failed": sum(r["failed"] for r in results),
+        "dropped": sum(r["dropped"] for r in results),
+        "connect_s": round(max(r["connect_done"] for r in results) - t0, 1) if connected else None,
+        "readings_per_s": round(sum(r["acked"] for r in results) / args.duration, 1),
+        "reply_latency_ms": percentiles([x for r in results for x in r["latencies"]]),
+        "reply_errors": sum(r["errors"] for r in results),
+        "server": {
+            "max_connections": after["max_connections"],
+            "connections": after["connections"],
+            "refused_full": after["refused_full"],
+            "refused_rate": after["refused_rate"],
+            "heartbeat_timeouts": after["heartbeat_timeouts"],
+            "rss_mb": round(after["rss_bytes"] / 2**20, 1) if after["rss_bytes"] else None,
+            "rss_idle_mb": round(idle["rss_bytes"] / 2**20, 1) if idle["rss_bytes"] else None,
+            "rss_per_connection_kb": round(after["rss_per_connection"] / 1024, 1)
+            if after["rss_per_connection"] else None,
+            "loop_lag_ms": {"avg": after["loop_lag_ms"], "max": after["max_loop_lag_ms"]},
+            "cpu_pct": round(100 * (after["cpu_s"] - before["cpu_s"]) / wall, 1),
+        },
+    }
+    errors = [r["error"] for r in results if r["error"]]
+    if errors:
+        report["first_error"] = errors[0]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+
+from app.cache import ReadCache
+
+
+class Fetcher:
+    """Counts calls and holds them until ``release`` so callers overlap."""
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, *args):
+        self.calls += 1
+        await self.release.wait()
+        if args:  # fetch_many
+            return [self.samples for _ in args[0]]
+        return self.samples
+
+
+class ReadCacheTest(unittest.TestCase):
+    def test_concurrent_gets_share_one_fetch(self):
+        async def run():
+            cache = ReadCache(bucket_ms=1000)
+            fetch = Fetcher([[1, 1.0]])
+            readers = [asyncio.create_task(cache.get("s", 0, 999, fetch)) for _ in range(50)]
+            await asyncio.sleep(0)
+            fetch.release.set()
+            results = await asyncio.gather(*readers)
+            self.assertEqual(fetch.calls, 1)
+            self.assertTrue(all(r == [[1, 1.0]] for r in results))
+            self.assertEqual(await cache.get("s", 0, 999, fetch), [[1, 1.0]])
+            self.assertEqual(fetch.calls, 1)
+            self.assertEqual((cache.misses, cache.coalesced, cache.hits), (1, 49, 1))
+        asyncio.run(run())
+
+    def test_concurrent_tail_reads_share_one_fetch(self):
+        async def run():
+            cache = ReadCache(bucket_ms=1000)
+            start, end = cache.window(600_000, at_ms=1_000_500)
+            tail_start, tail_end = cache.tail(end)
+            self.assertEqual((tail_start, tail_end), (1_000_001, 1_001_000))
+            fetch = Fetcher([[1_000_200, 2.0]])
+            readers = [asyncio.create_task(cache.get_many(["a", "b"], tail_start, tail_end, fetch))
+                       for _ in range(20)]
+            await asyncio.sleep(0)
+            fetch.release.set()
+            await asyncio.gather(*readers)
+            self.assertEqual(fetch.calls, 1)
+        asyncio.run(run())
+
+    def test_sample_in_open_bucket_drops_the_cached_tail(self):
+        async def run():
+            cache = ReadCache(bucket_ms=1000)
+            fetch = Fetcher([])
+            fetch.release.set()
+            await cache.get("s", 1001, 2000, fetch)
+            cache.invalidate("s", 1500)
+            await cache.get("s", 1001, 2000, fetch)
+            self.assertEqual(fetch.calls, 2)
+        asyncio.run(run())
+
+    def test_query_invalidated_in_flight_is_not_cached(self):
+        async def run():
+            cache = ReadCache(bucket_ms=1000)
+            fetch = Fetcher([])
+            reader = asyncio.create_task(cache.get("s", 1001, 2000, fetch))
+            await asyncio.sleep(0)
+            cache.invalidate("s", 1500)  # written while the read was in flight
+            fetch.release.set()
+            await reader
+            await cache.get("s", 1001, 2000, fetch)
+            self.assertEqual(fetch.calls, 2)
+            self.assertEqual(cache.stats()["inflight"], 0)
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()